@@ -52,7 +52,7 @@ async def create_admin_user():
             "user_management": True
         },
         "is_active": True,
-        "created_at": datetime.now(timezone.utc).isoformat(),
+        "created_at": datetime.now(timezone.utc),
         "created_by": "system"
     }
     
@@ -0,0 +1,330 @@
+"""
+Parsers for Huawei MA5600/MA5683T display commands.
+
+Covers `display ont autofind`, `display ont info`, `display ont optical-info`,
+`display service-port` and `display board`. `ont info` and `optical-info`
+come in a table form (one row per ONT, port-wide queries) and a block form
+("Key : value" lines separated by dashes, single-ONT queries); both are
+recognised in the same pass, so callers never have to say which one they sent.
+Autofind output is always blocks; service-port and board output always tables.
+Output may use LF or the CRLF line endings telnet delivers.
+
+Parsing is regex driven over the whole text rather than line by line.
+`IncrementalParser` applies the same parsers to output as it streams in
+from telnet. Captures of every form live in tests/fixtures/huawei, and
+tests/test_huawei_parser.py benchmarks multi-MB captures.
+"""
+import re
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+Record = Dict[str, Any]
+Scanner = Callable[[str], List[Tuple[int, Record]]]
+
+# "Key : value" lines and dashed separators of the block format
+BLOCK_LINE_PATTERN = re.compile(
+    r'^[ \t]*(?:(?P<sep>-{8,})|(?P<key>[A-Za-z][^:\r\n]*):[ \t]*(?P<value>[^\r\n]*))',
+    re.MULTILINE
+)
+# "0/1/3" and the padded "0/ 1/3" or "0/1 /3" variants
+FSP = r'(?P<frame>\d+)[ \t]*/[ \t]*(?P<board>\d+)[ \t]*/[ \t]*(?P<port>\d+)'
+FSP_PATTERN = re.compile(FSP)
+NUMBER = r'(?:-?\d+(?:\.\d+)?|-)'
+# "485754439F3887B1 (HWTC-9F3887B1)"
+SERIAL_PATTERN = re.compile(r'^(?P<hex>[0-9A-Fa-f]{16})?\s*(?:\((?P<readable>[^)]+)\))?')
+
+ONT_INFO_ROW_PATTERN = re.compile(
+    r'^[ \t]*' + FSP + r'[ \t]+(?P<ont_id>\d+)[ \t]+(?P<serial>[0-9A-Fa-f]{16})[ \t]+'
+    r'(?P<control_flag>\S+)[ \t]+(?P<run_state>\S+)[ \t]+(?P<config_state>\S+)[ \t]+'
+    r'(?P<match_state>\S+)(?:[ \t]+(?P<protect_side>\S+))?[ \t]*\r?$',
+    re.MULTILINE
+)
+# Second table of `display ont info ... all`
+ONT_DESCRIPTION_ROW_PATTERN = re.compile(
+    r'^[ \t]*' + FSP + r'[ \t]+(?P<ont_id>\d+)[ \t]+(?P<description>(?![0-9A-Fa-f]{16}[ \t])\S[^\r\n]*)',
+    re.MULTILINE
+)
+OPTICAL_ROW_PATTERN = re.compile(
+    r'^[ \t]*(?P<ont_id>\d+)((?:[ \t]+' + NUMBER + r'){2,6})[ \t]*\r?$',
+    re.MULTILINE
+)
+OPTICAL_TABLE_COLUMNS = ["rx_power", "tx_power", "olt_rx_power", "temperature", "voltage", "current"]
+SERVICE_PORT_ROW_PATTERN = re.compile(
+    r'^[ \t]*(?P<index>\d+)[ \t]+(?P<vlan>\d+|-)[ \t]+(?P<vlan_attr>\S+)[ \t]+'
+    r'(?P<port_type>gpon|epon|xgpon|xgspon|eth|adsl|vdsl)[ \t]+' + FSP + r'(?P<rest>[^\r\n]*?)[ \t]*\r?$',
+    re.MULTILINE | re.IGNORECASE
+)
+SERVICE_PORT_COLUMNS = ["vpi", "vci", "flow_type", "flow_para", "rx", "tx", "state"]
+BOARD_ROW_PATTERN = re.compile(r'^[ \t]*(?P<slot>\d{1,2})(?P<rest>(?:[ \t]+[A-Za-z_][^\r\n]*)?)[ \t]*\r?$', re.MULTILINE)
+
+# Block keys that map onto the table column names
+OPTICAL_BLOCK_KEYS = {
+    "rx_optical_power_dbm": "rx_power",
+    "tx_optical_power_dbm": "tx_power",
+    "olt_rx_ont_optical_power_dbm": "olt_rx_power",
+    "temperature_c": "temperature",
+    "voltage_v": "voltage",
+    "laser_bias_current_ma": "current",
+}
+ONT_INFO_BLOCK_KEYS = {
+    "ont_id": "ont_id",
+    "control_flag": "control_flag",
+    "run_state": "run_state",
+    "config_state": "config_state",
+    "match_state": "match_state",
+    "description": "description",
+    "last_down_cause": "last_down_cause",
+    "last_up_time": "last_up_time",
+    "last_down_time": "last_down_time",
+    "ont_distance_m": "distance",
+    "memory_occupation": "memory_occupation",
+    "cpu_occupation": "cpu_occupation",
+    "temperature": "temperature",
+}
+
+@lru_cache(maxsize=1024)
+def normalize_key(key: str) -> str:
+    """'Rx optical power(dBm)' -> 'rx_optical_power_dbm'"""
+    return re.sub(r'[^0-9a-z]+', '_', key.lower()).strip('_')
+
+def to_number(value: Optional[str]):
+    """Numeric cell to int/float; '-' and blanks (no reading) become None"""
+    if value is None:
+        return None
+    value = value.strip()
+    if not value or value == '-':
+        return None
+    try:
+        return float(value) if '.' in value else int(value)
+    except ValueError:
+        return value
+
+def split_serial(value: str) -> Tuple[Optional[str], Optional[str]]:
+    """(hex, readable) from '485754439F3887B1 (HWTC-9F3887B1)'"""
+    match = SERIAL_PATTERN.match(value.strip())
+    if not match or not (match.group('hex') or match.group('readable')):
+        return None, value.split()[0] if value.strip() else None
+    return match.group('hex'), match.group('readable')
+
+def scan_blocks(text: str) -> List[Tuple[int, Dict[str, str]]]:
+    """
+    Group "Key : value" lines into records with normalised keys.
+    A record ends at a dashed separator or when a key repeats.
+    """
+    records: List[Tuple[int, Dict[str, str]]] = []
+    current: Dict[str, str] = {}
+    start = 0
+    for match in BLOCK_LINE_PATTERN.finditer(text):
+        if match.group('sep'):
+            if current:
+                records.append((start, current))
+                current = {}
+            continue
+        key = normalize_key(match.group('key'))
+        if key in current:
+            records.append((start, current))
+            current = {}
+        if not current:
+            start = match.start()
+        current[key] = match.group('value').rstrip()
+    if current:
+        records.append((start, current))
+    return records
+
+def apply_fsp(record: Record, value: Optional[str]) -> bool:
+    match = FSP_PATTERN.search(value or '')
+    if not match:
+        return False
+    record['frame'] = int(match.group('frame'))
+    record['board'] = int(match.group('board'))
+    record['port'] = int(match.group('port'))
+    return True
+
+# ==================== SCANNERS ====================
+# Each returns (offset, record) pairs in text order; offsets let the
+# incremental parser know where an unfinished record starts.
+
+def scan_autofind(text: str) -> List[Tuple[int, Record]]:
+    results = []
+    for offset, block in scan_blocks(text):
+        record: Record = {}
+        if not apply_fsp(record, block.get('f_s_p')) or 'ont_sn' not in block:
+            continue
+        sn_hex, readable = split_serial(block['ont_sn'])
+        record['serial_number'] = readable or sn_hex or "UNKNOWN"
+        record['sn_hex'] = sn_hex
+        if 'number' in block:
+            record['number'] = to_number(block['number'])
+        for key, name in (("vendorid", "vendor_id"), ("ont_equipmentid", "model"),
+                          ("ont_version", "ont_version"), ("ont_softwareversion", "software_version"),
+                          ("ont_autofind_time", "autofind_time"), ("loid", "loid")):
+            if block.get(key):
+                record[name] = block[key]
+        results.append((offset, record))
+    return results
+
+def scan_ont_info(text: str) -> List[Tuple[int, Record]]:
+    results = []
+    for match in ONT_INFO_ROW_PATTERN.finditer(text):
+        frame, board, port, ont_id, serial, control, run, config, matched, protect = match.groups()
+        record = {
+            "frame": int(frame), "board": int(board), "port": int(port), "ont_id": int(ont_id),
+            "sn_hex": serial.upper(),
+            "control_flag": control,
+            "run_state": run,
+            "config_state": config,
+            "match_state": matched,
+        }
+        if protect:
+            record['protect_side'] = protect
+        results.append((match.start(), record))
+    for match in ONT_DESCRIPTION_ROW_PATTERN.finditer(text):
+        frame, board, port, ont_id, description = match.groups()
+        results.append((match.start(), {
+            "frame": int(frame), "board": int(board), "port": int(port), "ont_id": int(ont_id),
+            "description": description.rstrip(),
+        }))
+    for offset, block in scan_blocks(text):
+        record: Record = {}
+        if not apply_fsp(record, block.get('f_s_p')) or 'ont_id' not in block:
+            continue
+        for key, name in ONT_INFO_BLOCK_KEYS.items():
+            if key in block:
+                record[name] = to_number(block[key]) if name in ("ont_id", "distance") else block[key]
+        if block.get('sn'):
+            record['sn_hex'], record['serial_number'] = split_serial(block['sn'])
+        results.append((offset, record))
+    results.sort(key=lambda item: item[0])
+    return results
+
+def scan_optical_info(text: str) -> List[Tuple[int, Record]]:
+    results = []
+    for match in OPTICAL_ROW_PATTERN.finditer(text):
+        ont_id, values = match.groups()
+        record: Record = {"ont_id": int(ont_id)}
+        record.update(zip(OPTICAL_TABLE_COLUMNS, map(to_number, values.split())))
+        results.append((match.start(), record))
+    for offset, block in scan_blocks(text):
+        if 'rx_optical_power_dbm' not in block:
+            continue
+        record = {name: to_number(block.get(key)) for key, name in OPTICAL_BLOCK_KEYS.items()}
+        if 'ont_id' in block:
+            record['ont_id'] = to_number(block['ont_id'])
+        results.append((offset, record))
+    results.sort(key=lambda item: item[0])
+    return results
+
+def scan_service_ports(text: str) -> List[Tuple[int, Record]]:
+    results = []
+    for match in SERVICE_PORT_ROW_PATTERN.finditer(text):
+        index, vlan, vlan_attr, port_type, frame, board, port, rest = match.groups()
+        record: Record = {
+            "index": int(index),
+            "vlan": to_number(vlan),
+            "vlan_attr": vlan_attr,
+            "port_type": port_type.lower(),
+            "frame": int(frame), "board": int(board), "port": int(port),
+        }
+        record.update(zip(SERVICE_PORT_COLUMNS, rest.split()))
+        for name in ("vpi", "vci"):
+            if name in record:
+                record[name] = to_number(record[name])
+        results.append((match.start(), record))
+    return results
+
+def scan_boards(text: str) -> List[Tuple[int, Record]]:
+    results = []
+    for match in BOARD_ROW_PATTERN.finditer(text):
+        tokens = match.group('rest').split()
+        record: Record = {"slot": int(match.group('slot'))}
+        if tokens:
+            record['board_name'] = tokens[0]
+        if len(tokens) > 1:
+            record['status'] = tokens[1]
+        extra = tokens[2:]
+        if extra and extra[-1].lower() in ("online", "offline"):
+            record['online_state'] = extra.pop()
+        record['subtypes'] = extra
+        results.append((match.start(), record))
+    return results
+
+# ==================== PUBLIC API ====================
+
+def parse_autofind(text: str) -> List[Record]:
+    """`display ont autofind all|F/S|F/S/P` -> one record per waiting ONT"""
+    return [record for _, record in scan_autofind(text)]
+
+def merge_ont_info(records: List[Record]) -> List[Record]:
+    """Fold the description table of `display ont info ... all` into the state rows"""
+    merged: Dict[Tuple[int, int, int, int], Record] = {}
+    for record in records:
+        key = (record['frame'], record['board'], record['port'], record['ont_id'])
+        if key in merged:
+            merged[key].update(record)
+        else:
+            merged[key] = dict(record)
+    return list(merged.values())
+
+def parse_ont_info(text: str) -> List[Record]:
+    """`display ont info F S P all` (table) or `display ont info F S P ID` (block)"""
+    return merge_ont_info([record for _, record in scan_ont_info(text)])
+
+def parse_optical_info(text: str, frame: Optional[int] = None, board: Optional[int] = None,
+                       port: Optional[int] = None) -> List[Record]:
+    """
+    `display ont optical-info P all` (table, run in `interface gpon F/S`) or
+    `display ont optical-info P ID` (block). The output does not name the
+    port, so pass F/S/P to have it stamped on every record. Missing readings
+    (offline ONTs) are None.
+    """
+    context = {key: value for key, value in (("frame", frame), ("board", board), ("port", port))
+               if value is not None}
+    return [{**context, **record} for _, record in scan_optical_info(text)]
+
+def parse_service_ports(text: str) -> List[Record]:
+    """`display service-port all|port F/S/P` -> one record per service port"""
+    return [record for _, record in scan_service_ports(text)]
+
+def parse_boards(text: str) -> List[Record]:
+    """`display board F` -> one record per slot (empty slots have no board_name)"""
+    return [record for _, record in scan_boards(text)]
+
+SCANNERS: Dict[str, Scanner] = {
+    "autofind": scan_autofind,
+    "ont_info": scan_ont_info,
+    "optical_info": scan_optical_info,
+    "service_port": scan_service_ports,
+    "board": scan_boards,
+}
+
+class IncrementalParser:
+    """
+    Parse output chunk by chunk as it arrives.
+    feed() returns the records completed so far; the last record seen is held
+    back until more output (or close()) shows it is finished. ont_info emits
+    the description table rows as separate records keyed by F/S/P + ONT ID;
+    merge_ont_info() folds them together.
+    """
+
+    def __init__(self, kind: str):
+        self._scan = SCANNERS[kind]
+        self._buffer = ""
+
+    def feed(self, chunk: str) -> List[Record]:
+        self._buffer += chunk
+        complete = self._buffer.rfind('\n') + 1
+        if not complete:
+            return []
+        records = self._scan(self._buffer[:complete])
+        if not records:
+            # Keep only the tail that could still open a record
+            self._buffer = self._buffer[complete:] if len(self._buffer) > 65536 else self._buffer
+            return []
+        last_offset = records[-1][0]
+        self._buffer = self._buffer[last_offset:]
+        return [record for _, record in records[:-1]]
+
+    def close(self) -> List[Record]:
+        records = [record for _, record in self._scan(self._buffer)]
+        self._buffer = ""
+        return records
@@ -1,22 +1,37 @@
-from fastapi import FastAPI, APIRouter, HTTPException, WebSocket, WebSocketDisconnect, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, WebSocket, WebSocketDisconnect, Depends, Request, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.responses import Response, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, IndexModel, UpdateOne
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Callable, Set, Tuple
 import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone, timedelta
 import configparser
 import asyncio
+import itertools
+import re
+import time
 import telnetlib3
 import json
+import zlib
+import gzip
+import random
 import bcrypt
 import jwt
 
+from huawei_parser import parse_autofind, parse_boards, parse_ont_info, parse_optical_info, parse_service_ports
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
@@ -25,11 +40,36 @@ SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'your-secret-key-change-in-product
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 480  # 8 hours
 
+# Verified users are cached in-process so authenticated requests skip the users lookup.
+# Changes to a user reach other workers only when their entry expires.
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', '1024'))
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', '60'))
+# Signed-claims mode: role and permissions ride in a short-lived token, no lookup at all
+AUTH_CLAIMS_IN_TOKEN = os.environ.get('AUTH_CLAIMS_IN_TOKEN', 'false').lower() == 'true'
+CLAIMS_TOKEN_EXPIRE_MINUTES = int(os.environ.get('CLAIMS_TOKEN_EXPIRE_MINUTES', '15'))
+
+# bcrypt runs in a small worker pool so it never blocks the event loop
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', '2'))
+# Concurrent login attempts allowed per username and per client IP
+LOGIN_MAX_PER_USERNAME = int(os.environ.get('LOGIN_MAX_PER_USERNAME', '2'))
+LOGIN_MAX_PER_IP = int(os.environ.get('LOGIN_MAX_PER_IP', '4'))
+# Seconds an attempt over the cap waits for a slot before it is turned away
+LOGIN_QUEUE_WAIT = float(os.environ.get('LOGIN_QUEUE_WAIT', '2'))
+
 security = HTTPBearer()
 
+# Telnet session pool: extra read-only sessions are opened on demand and closed when idle
+DEFAULT_POOL_SIZE = int(os.environ.get('OLT_POOL_SIZE', '2'))
+DEFAULT_VTY_LIMIT = 5
+POOL_IDLE_TIMEOUT = float(os.environ.get('OLT_POOL_IDLE_TIMEOUT', '300'))
+
+# Command log retention when a device has no configuration; 0 keeps logs forever
+DEFAULT_LOG_RETENTION_DAYS = int(os.environ.get('LOG_RETENTION_DAYS', '90'))
+LOG_ARCHIVE_DIR = Path(os.environ.get('LOG_ARCHIVE_DIR', str(ROOT_DIR / 'log_archive')))
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, tz_aware=True)
 db = client[os.environ['DB_NAME']]
 
 # Create the main app without a prefix
@@ -39,22 +79,85 @@ app = FastAPI(title="Huawei OLT Management System")
 api_router = APIRouter(prefix="/api")
 
 # WebSocket connections manager
+# Outbound WebSocket messages buffered per client; the oldest are dropped past this
+WS_CLIENT_QUEUE_SIZE = int(os.environ.get('WS_CLIENT_QUEUE_SIZE', '256'))
+# A client that cannot take one message within this many seconds is disconnected
+WS_SEND_TIMEOUT = 10
+
+class WebSocketClient:
+    """One /ws subscriber with its own bounded queue and sender task"""
+    
+    def __init__(self, websocket: WebSocket, device_ids: Optional[set] = None, types: Optional[set] = None):
+        self.websocket = websocket
+        self.device_ids = device_ids  # None = every device
+        self.types = types  # None = every event type
+        self.queue: deque = deque(maxlen=WS_CLIENT_QUEUE_SIZE)
+        self.ready = asyncio.Event()
+        self.dropped = 0
+        self.sender: Optional[asyncio.Task] = None
+    
+    def wants(self, event_type: Optional[str], device_id: Optional[str]) -> bool:
+        if self.types is not None and event_type not in self.types:
+            return False
+        # Events that are not about one device go to everyone
+        if self.device_ids is not None and device_id is not None and device_id not in self.device_ids:
+            return False
+        return True
+    
+    def push(self, message: str):
+        if len(self.queue) == self.queue.maxlen:
+            self.dropped += 1  # Slow consumer: keep only the latest messages
+        self.queue.append(message)
+        self.ready.set()
+
 class ConnectionManager:
     def __init__(self):
-        self.active_connections: List[WebSocket] = []
+        self.active_connections: Dict[WebSocket, WebSocketClient] = {}
 
-    async def connect(self, websocket: WebSocket):
+    async def connect(self, websocket: WebSocket, device_ids: Optional[set] = None,
+                      types: Optional[set] = None) -> WebSocketClient:
         await websocket.accept()
-        self.active_connections.append(websocket)
+        ws_client = WebSocketClient(websocket, device_ids, types)
+        ws_client.sender = asyncio.create_task(self._send_loop(ws_client))
+        self.active_connections[websocket] = ws_client
+        return ws_client
 
     def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+        ws_client = self.active_connections.pop(websocket, None)
+        if ws_client and ws_client.sender and ws_client.sender is not asyncio.current_task():
+            ws_client.sender.cancel()
 
-    async def broadcast(self, message: str):
-        for connection in self.active_connections:
+    def broadcast(self, event: Dict[str, Any]):
+        """Queue an event for every subscribed client; never waits on a socket"""
+        device_id = event.get("device_id") or event.get("olt_device_id")
+        message = None
+        for ws_client in self.active_connections.values():
+            if ws_client.wants(event.get("type"), device_id):
+                if message is None:
+                    message = json.dumps(event, default=str)
+                ws_client.push(message)
+    
+    async def _send_loop(self, ws_client: WebSocketClient):
+        websocket = ws_client.websocket
+        try:
+            while True:
+                await ws_client.ready.wait()
+                ws_client.ready.clear()
+                if ws_client.dropped:
+                    dropped, ws_client.dropped = ws_client.dropped, 0
+                    await asyncio.wait_for(
+                        websocket.send_text(json.dumps({"type": "lagged", "dropped": dropped})), WS_SEND_TIMEOUT
+                    )
+                while ws_client.queue:
+                    await asyncio.wait_for(websocket.send_text(ws_client.queue.popleft()), WS_SEND_TIMEOUT)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Dead or stuck socket: drop the client so it stops costing anything
+            self.disconnect(websocket)
             try:
-                await connection.send_text(message)
-            except:
+                await websocket.close()
+            except Exception:
                 pass
 
 manager = ConnectionManager()
@@ -71,8 +174,12 @@ class OLTDevice(BaseModel):
     username: str
     password: str
     identifier: str = ""
+    pool_size: int = DEFAULT_POOL_SIZE  # Telnet sessions kept open to this OLT
+    vty_limit: int = DEFAULT_VTY_LIMIT  # Max concurrent VTY logins the OLT allows
     is_connected: bool = False
     last_connected: Optional[datetime] = None
+    autofind_watch: bool = False  # Resume the autofind watcher on startup
+    autofind_watch_by: str = ""  # Who started it; auto-registered ONTs are credited to them
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class OLTDeviceCreate(BaseModel):
@@ -82,6 +189,8 @@ class OLTDeviceCreate(BaseModel):
     username: str
     password: str
     identifier: str = ""
+    pool_size: int = DEFAULT_POOL_SIZE
+    vty_limit: int = DEFAULT_VTY_LIMIT
 
 class OLTConfiguration(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -120,6 +229,7 @@ class OLTConfiguration(BaseModel):
     
     # Advanced Settings
     enable_log: bool = True
+    log_retention_days: int = DEFAULT_LOG_RETENTION_DAYS  # 0 keeps logs forever
     auto_reconnect: bool = True
     special_system_support: bool = False
     auto_registration: bool = True
@@ -158,6 +268,7 @@ class OLTConfigurationCreate(BaseModel):
     gemport: str = "1,2,3"
     period: float = 1.0
     enable_log: bool = True
+    log_retention_days: int = DEFAULT_LOG_RETENTION_DAYS  # 0 keeps logs forever
     auto_reconnect: bool = True
     special_system_support: bool = False
     auto_registration: bool = True
@@ -188,6 +299,10 @@ class ONTDevice(BaseModel):
     gemport: str = "1"
     description: str = ""
     service_port_index: int = 0  # Starting service-port index
+    service_port_count: int = 0  # Number of service-port indexes allocated from service_port_index
+    board_type: str = "gpon"  # gpon or epon
+    optical: Optional[Dict[str, Any]] = None  # Last optical reading, see OpticalInfoService
+    needs_reconcile: bool = False  # Provisioning outcome unknown; check the OLT before reusing its IDs
     registered_by: str = ""  # Username of person who registered
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -205,6 +320,7 @@ class ONTDeviceCreate(BaseModel):
     gemport: str = "1"
     description: str = ""
     service_port_index: int = -1  # -1 = auto-generate
+    board_type: Optional[str] = None  # gpon or epon, sets the ONT ID limit; None = the port's type
 
 # ==================== USER & AUTH MODELS ====================
 
@@ -236,6 +352,7 @@ class UserCreate(BaseModel):
     full_name: str
     role: str
     permissions: Optional[Dict[str, bool]] = None
+    is_active: Optional[bool] = None  # Only honoured on update
 
 class UserLogin(BaseModel):
     username: str
@@ -271,6 +388,10 @@ class TelnetCommand(BaseModel):
     device_id: str
     command: str
 
+class BatchCommand(BaseModel):
+    commands: List[str]
+    stop_on_error: bool = True
+
 class ConfigFileUpload(BaseModel):
     device_id: str
     config_content: str
@@ -285,6 +406,73 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a password against a hash"""
     return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
 
+password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+
+async def hash_password_async(password: str) -> str:
+    """hash_password on the bcrypt worker pool"""
+    return await asyncio.get_running_loop().run_in_executor(password_executor, hash_password, password)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """verify_password on the bcrypt worker pool"""
+    return await asyncio.get_running_loop().run_in_executor(
+        password_executor, verify_password, plain_password, hashed_password
+    )
+
+class LoginLimiter:
+    """
+    Caps concurrent login attempts per key (username, client IP).
+    Attempts over the cap wait up to `wait` seconds for a slot, first come
+    first served, and are turned away after that, so a burst of logins
+    cannot pile up bcrypt work in front of everything else while two people
+    signing in to a shared account at once both get through.
+    """
+    
+    def __init__(self, limit: int, wait: float = LOGIN_QUEUE_WAIT):
+        self.limit = limit
+        self.wait = wait
+        self._active: Dict[str, int] = {}
+        self._waiters: Dict[str, deque] = {}
+    
+    async def acquire(self, key: str) -> bool:
+        if self._active.get(key, 0) < self.limit:
+            self._active[key] = self._active.get(key, 0) + 1
+            return True
+        if self.wait <= 0:
+            return False
+        # release() hands its slot straight to the oldest waiter
+        waiter = asyncio.get_running_loop().create_future()
+        waiters = self._waiters.setdefault(key, deque())
+        waiters.append(waiter)
+        try:
+            return await asyncio.wait_for(waiter, timeout=self.wait)
+        except asyncio.TimeoutError:
+            return False
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release(key)  # Slot handed over just as the caller went away
+            raise
+        finally:
+            if waiter in waiters:
+                waiters.remove(waiter)
+            if not waiters:
+                self._waiters.pop(key, None)
+    
+    def release(self, key: str):
+        waiters = self._waiters.get(key)
+        while waiters:
+            waiter = waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(True)
+                return
+        remaining = self._active.get(key, 0) - 1
+        if remaining > 0:
+            self._active[key] = remaining
+        else:
+            self._active.pop(key, None)
+
+username_login_limiter = LoginLimiter(LOGIN_MAX_PER_USERNAME)
+ip_login_limiter = LoginLimiter(LOGIN_MAX_PER_IP)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Create JWT access token"""
     to_encode = data.copy()
@@ -296,6 +484,65 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+class UserCache:
+    """
+    LRU cache of verified users keyed by username, entries expire after `ttl`.
+    Each username carries a generation counter bumped by invalidate(), so a
+    lookup that raced an update cannot put the stale document back.
+    The cache is per process: invalidate() only reaches the worker that made
+    the change, so with several workers a deactivated or demoted user keeps
+    their old access elsewhere for up to `ttl` seconds.
+    """
+    
+    def __init__(self, max_size: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._generations: Dict[str, int] = {}
+    
+    def generation(self, username: str) -> int:
+        return self._generations.get(username, 0)
+    
+    def get(self, username: str) -> Optional[User]:
+        entry = self._entries.get(username)
+        if entry is None:
+            return None
+        user, expires_at = entry
+        if time.monotonic() >= expires_at:
+            del self._entries[username]
+            return None
+        self._entries.move_to_end(username)
+        return user
+    
+    def put(self, username: str, user: User, generation: int):
+        if self.max_size <= 0 or generation != self.generation(username):
+            return
+        self._entries[username] = (user, time.monotonic() + self.ttl)
+        self._entries.move_to_end(username)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+    
+    def invalidate(self, username: str):
+        self._entries.pop(username, None)
+        self._generations[username] = self.generation(username) + 1
+
+user_cache = UserCache()
+
+def create_user_token(user: Dict[str, Any]) -> str:
+    """Access token for a user; in signed-claims mode it also carries role and permissions"""
+    if not AUTH_CLAIMS_IN_TOKEN:
+        return create_access_token(data={"sub": user['username']})
+    created_at = user.get('created_at')
+    claims = {
+        "sub": user['username'],
+        "uid": user['id'],
+        "name": user['full_name'],
+        "role": user['role'],
+        "perms": user.get('permissions', {}),
+        "created_at": created_at.isoformat() if isinstance(created_at, datetime) else created_at
+    }
+    return create_access_token(data=claims, expires_delta=timedelta(minutes=CLAIMS_TOKEN_EXPIRE_MINUTES))
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> User:
     """Get current authenticated user from JWT token"""
     try:
@@ -312,19 +559,43 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Token has expired"
         )
-    except jwt.JWTError:
+    except jwt.InvalidTokenError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Could not validate credentials"
         )
     
+    if AUTH_CLAIMS_IN_TOKEN and "role" in payload:
+        # Signed-claims token: trusted until it expires
+        return User(
+            id=payload.get("uid", ""),
+            username=username,
+            password_hash="",
+            full_name=payload.get("name", username),
+            role=payload["role"],
+            permissions=payload.get("perms", {}),
+            created_at=payload.get("created_at") or datetime.now(timezone.utc)
+        )
+    
+    cached = user_cache.get(username)
+    if cached is not None:
+        return cached
+    
+    generation = user_cache.generation(username)
     user = await db.users.find_one({"username": username}, {"_id": 0})
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="User not found"
         )
-    return User(**user)
+    if not user.get('is_active', True):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="User account is disabled"
+        )
+    current_user = User(**user)
+    user_cache.put(username, current_user, generation)
+    return current_user
 
 def require_permission(permission: str):
     """Dependency factory to check if user has specific permission"""
@@ -341,46 +612,454 @@ def require_permission(permission: str):
 
 # ==================== TELNET CONNECTION ====================
 
+# Huawei CLI prompts: "MA5683T>", "MA5683T#", "MA5683T(config)#", "MA5683T(config-if-gpon-0/1)#"
+PROMPT_PATTERN = re.compile(r'(?:^|[\r\n])[\w.\-]+(?:\([\w.\-/: ]*\))?[#>][ \t]*$')
+# A prompt at the start of a line, followed by the echo of the next pipelined command
+LINE_PROMPT_PATTERN = re.compile(r'[\w.\-]+(?:\([\w.\-/: ]*\))?[#>]')
+# Pager shown for long outputs: "---- More ( Press 'Q' to break ) ----"
+MORE_PATTERN = re.compile(r'-+ *More[^\r\n]*?-+[ \t]*$')
+# Interactive parameter prompt, e.g. "{ <cr>|ontid<U><0,127> }:"
+PARAMETER_PROMPT_PATTERN = re.compile(r'\{[^{}\r\n]*\}:[ \t]*$')
+# Pager text plus the cursor-back/blank-out sequence the OLT sends after it
+PAGER_CLEANUP_PATTERN = re.compile(r'-+ *More[^\r\n]*?-+|\x1b\[\d+D *(?:\x1b\[\d+D)?')
+ANSI_ESCAPE_PATTERN = re.compile(r'\x1b\[[0-9;?]*[A-Za-z]')
+# Huawei CLI error replies, e.g. "% Unknown command, the error locates at '^'" or "Failure: SN already exists"
+COMMAND_ERROR_PATTERN = re.compile(
+    r'^\s*(?:% *(?:Unknown command|Parameter error|Incomplete command|Ambiguous command|Too many parameters)|Failure:)',
+    re.MULTILINE
+)
+
+COMMAND_TIMEOUT = 10.0  # Max idle seconds between two chunks of output
+READ_CHUNK_SIZE = 4096
+PROMPT_SEARCH_WINDOW = 256
+
+def clean_output(output: str) -> str:
+    """Strip pager prompts and terminal control sequences from OLT output"""
+    output = PAGER_CLEANUP_PATTERN.sub('', output)
+    return ANSI_ESCAPE_PATTERN.sub('', output)
+
+# Command priorities (lower runs first)
+PRIORITY_INTERACTIVE = 0  # Terminal commands typed by an operator
+PRIORITY_NORMAL = 1       # Detection, status queries
+PRIORITY_BULK = 2         # Provisioning scripts
+
+# Which sessions a job may run on
+LANE_WRITE = "write"        # Pinned session only
+LANE_READ = "read"          # Any session except the terminal's
+LANE_TERMINAL = "terminal"  # The terminal's own session, which keeps the operator's CLI mode
+
+MAX_QUEUE_PER_DEVICE = int(os.environ.get('OLT_MAX_QUEUE', '50'))
+QUEUE_WAIT_TIMEOUT = 30.0  # How long bulk jobs wait for queue space before being rejected
+
+class QueueFullError(Exception):
+    pass
+
+# Login handshake
+CONNECT_TIMEOUT = 5.0
+LOGIN_TIMEOUT = 10.0  # Max wait for each login prompt
+USERNAME_PROMPT_PATTERN = re.compile(r'user ?name:\s*$', re.IGNORECASE)
+PASSWORD_PROMPT_PATTERN = re.compile(r'password:\s*$', re.IGNORECASE)
+LOGIN_FAILED_PATTERN = re.compile(r'invalid|incorrect|failed|locked|denied', re.IGNORECASE)
+SESSION_SETUP_COMMANDS = ["enable", "scroll 512", "config"]
+
+LOGIN_UNREACHABLE = "unreachable"
+LOGIN_AUTH_FAILED = "auth_failed"
+LOGIN_PROMPT_TIMEOUT = "prompt_timeout"
+
+class LoginError(Exception):
+    def __init__(self, reason: str, message: str):
+        super().__init__(message)
+        self.reason = reason
+
+def is_read_only_command(command: str) -> bool:
+    return command.strip().lower().startswith('display ')
+
+def new_session(reader, writer, pinned: bool = False, terminal: bool = False) -> Dict[str, Any]:
+    return {
+        'reader': reader,
+        'writer': writer,
+        'pinned': pinned,
+        'terminal': terminal,
+        'busy': False,
+        'commands': 0,
+        'busy_time': 0.0,
+        'opened_at': time.monotonic(),
+        'last_used': time.monotonic()
+    }
+
+class CommandScheduler:
+    """
+    Runs jobs on the telnet sessions of one OLT, highest priority first.
+    A job is a coroutine function receiving a session dict; it owns the session
+    until it returns, so its output can never interleave with another job.
+    Writes always run on the pinned (primary) session. Read-only jobs run on
+    whichever session is free, and extra sessions are opened lazily up to
+    pool_size through `open_session`. Every job on those sessions leaves them
+    in config mode.
+    Terminal jobs get a session of their own (opened on first use, closed
+    after idle_timeout like the extras), so the operator's CLI mode survives
+    background work and never leaks into it. Without `dedicated_terminal`
+    (e.g. an OLT allowing a single VTY) they share the pinned session.
+    """
+    def __init__(self, device_id: str, primary: Dict[str, Any], open_session=None,
+                 pool_size: int = 1, max_queue: int = MAX_QUEUE_PER_DEVICE,
+                 idle_timeout: float = POOL_IDLE_TIMEOUT, dedicated_terminal: bool = False):
+        self.device_id = device_id
+        self.sessions: List[Dict[str, Any]] = [primary]
+        self.open_session = open_session
+        self.pool_size = max(1, pool_size)
+        self.dedicated_terminal = dedicated_terminal and open_session is not None
+        self._terminal_opening = False
+        self.max_queue = max_queue
+        self.idle_timeout = idle_timeout
+        self._jobs: List[tuple] = []
+        self._sequence = itertools.count()
+        self._changed = asyncio.Condition()
+        self._pending = 0
+        self._opening = 0
+        self._workers: List[asyncio.Task] = [asyncio.create_task(self._run(primary))]
+        
+        # Statistics
+        self.executed = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.last_wait = 0.0
+    
+    async def submit(self, job, priority: int = PRIORITY_NORMAL, read_only: bool = False, terminal: bool = False):
+        if self._pending >= self.max_queue:
+            if priority < PRIORITY_BULK:
+                self.rejected += 1
+                raise QueueFullError(f"Command queue full ({self._pending} pending)")
+            # Backpressure: bulk jobs wait for room instead of failing outright
+            try:
+                async with self._changed:
+                    await asyncio.wait_for(
+                        self._changed.wait_for(lambda: self._pending < self.max_queue),
+                        timeout=QUEUE_WAIT_TIMEOUT
+                    )
+                    self._pending += 1
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                raise QueueFullError(f"Command queue full ({self._pending} pending)")
+        else:
+            self._pending += 1
+        
+        lane = LANE_TERMINAL if terminal else LANE_READ if read_only else LANE_WRITE
+        future = asyncio.get_running_loop().create_future()
+        async with self._changed:
+            self._jobs.append((priority, next(self._sequence), time.monotonic(), lane, job, future))
+            self._changed.notify_all()
+        if lane == LANE_READ:
+            self._maybe_grow()
+        elif lane == LANE_TERMINAL:
+            self._ensure_terminal()
+        return await future
+    
+    def _runs_on(self, session: Dict[str, Any], lane: str) -> bool:
+        if session['terminal']:
+            return lane == LANE_TERMINAL
+        if lane == LANE_TERMINAL:
+            return session['pinned'] and not self.dedicated_terminal
+        return session['pinned'] or lane == LANE_READ
+    
+    def _next_job(self, session: Dict[str, Any]):
+        eligible = [entry for entry in self._jobs if self._runs_on(session, entry[3])]
+        return min(eligible) if eligible else None
+    
+    def terminal_session(self) -> Optional[Dict[str, Any]]:
+        """The session terminal jobs run on, None until it is open"""
+        for session in self.sessions:
+            if session['terminal'] or (session['pinned'] and not self.dedicated_terminal):
+                return session
+        return None
+    
+    def _maybe_grow(self):
+        """Open another session when read-only work is waiting and every session is busy"""
+        if self.open_session is None:
+            return
+        pool = [session for session in self.sessions if not session['terminal']]
+        if len(pool) + self._opening >= self.pool_size:
+            return
+        idle = sum(1 for session in pool if not session['busy'])
+        waiting = sum(1 for entry in self._jobs if entry[3] != LANE_TERMINAL)
+        if waiting <= idle + self._opening:
+            return
+        self._opening += 1
+        asyncio.create_task(self._open_extra_session())
+    
+    def _ensure_terminal(self):
+        if not self.dedicated_terminal or self._terminal_opening:
+            return
+        if any(session['terminal'] for session in self.sessions):
+            return
+        self._terminal_opening = True
+        asyncio.create_task(self._open_terminal_session())
+    
+    async def _open_terminal_session(self):
+        try:
+            reader, writer = await self.open_session()
+        except Exception as e:
+            logger.warning(f"Could not open terminal session to {self.device_id}: {e}")
+            # Nothing else can run terminal jobs: fail them rather than leave them queued
+            async with self._changed:
+                for entry in [entry for entry in self._jobs if entry[3] == LANE_TERMINAL]:
+                    self._jobs.remove(entry)
+                    self._pending -= 1
+                    if not entry[5].done():
+                        entry[5].set_exception(ConnectionError(f"Could not open terminal session: {e}"))
+                self._changed.notify_all()
+            return
+        finally:
+            self._terminal_opening = False
+        session = new_session(reader, writer, terminal=True)
+        self.sessions.append(session)
+        self._workers.append(asyncio.create_task(self._run(session)))
+    
+    async def _open_extra_session(self):
+        try:
+            reader, writer = await self.open_session()
+        except Exception as e:
+            logger.warning(f"Could not open extra session to {self.device_id}: {e}")
+            return
+        finally:
+            self._opening -= 1
+        session = new_session(reader, writer)
+        self.sessions.append(session)
+        self._workers.append(asyncio.create_task(self._run(session)))
+    
+    def _drop_session(self, session: Dict[str, Any]):
+        if session in self.sessions:
+            self.sessions.remove(session)
+        session['writer'].close()
+    
+    async def _run(self, session: Dict[str, Any]):
+        # Extra sessions close themselves after idle_timeout; the pinned one stays
+        idle_timeout = None if session['pinned'] else self.idle_timeout
+        while True:
+            async with self._changed:
+                try:
+                    await asyncio.wait_for(
+                        self._changed.wait_for(lambda: self._next_job(session) is not None),
+                        timeout=idle_timeout
+                    )
+                except asyncio.TimeoutError:
+                    self._drop_session(session)
+                    return
+                entry = self._next_job(session)
+                self._jobs.remove(entry)
+                session['busy'] = True
+            
+            priority, _, queued_at, lane, job, future = entry
+            started = time.monotonic()
+            try:
+                if future.cancelled():
+                    continue
+                wait = started - queued_at
+                self.last_wait = wait
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+                
+                try:
+                    result = await job(session)
+                except asyncio.CancelledError:
+                    # Scheduler closed mid-job: the caller must not wait forever
+                    if not future.done():
+                        future.set_exception(ConnectionError("Device disconnected"))
+                    raise
+                except ConnectionError as e:
+                    if session['pinned']:
+                        if not future.cancelled():
+                            future.set_exception(e)
+                    elif session['terminal']:
+                        # The operator's mode is gone with it; the next command opens a fresh one
+                        if not future.cancelled():
+                            future.set_exception(e)
+                        self._drop_session(session)
+                        self._ensure_terminal()
+                        return
+                    else:
+                        # An extra session went away (e.g. OLT idle timeout): retry the
+                        # read-only job on another session and let the pool reopen on demand
+                        self._pending += 1
+                        self._jobs.append(entry)
+                        self._drop_session(session)
+                        return
+                except Exception as e:
+                    if not future.cancelled():
+                        future.set_exception(e)
+                else:
+                    if not future.cancelled():
+                        future.set_result(result)
+                finally:
+                    self.executed += 1
+                    session['commands'] += 1
+                    session['busy_time'] += time.monotonic() - started
+            finally:
+                session['busy'] = False
+                session['last_used'] = time.monotonic()
+                self._pending -= 1
+                async with self._changed:
+                    self._changed.notify_all()
+    
+    async def close(self):
+        workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        for session in self.sessions:
+            if not session['pinned']:
+                session['writer'].close()
+        self.sessions = [session for session in self.sessions if session['pinned']]
+        for *_, future in self._jobs:
+            if not future.done():
+                future.set_exception(ConnectionError("Device disconnected"))
+        self._jobs = []
+        self._pending = 0
+        async with self._changed:
+            self._changed.notify_all()
+    
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "queue_depth": len(self._jobs),
+            "busy": any(session['busy'] for session in self.sessions),
+            "max_queue": self.max_queue,
+            "executed": self.executed,
+            "rejected": self.rejected,
+            "avg_wait_ms": round(self.total_wait / self.executed * 1000, 1) if self.executed else 0.0,
+            "max_wait_ms": round(self.max_wait * 1000, 1),
+            "last_wait_ms": round(self.last_wait * 1000, 1),
+            "pool": {
+                "size": len(self.sessions),
+                "max_size": self.pool_size,
+                "idle_timeout": self.idle_timeout,
+                "sessions": [
+                    {
+                        "pinned": session['pinned'],
+                        "terminal": session['terminal'],
+                        "busy": session['busy'],
+                        "commands": session['commands'],
+                        "utilisation": round(session['busy_time'] / max(now - session['opened_at'], 1e-6), 3),
+                        "idle_seconds": 0.0 if session['busy'] else round(now - session['last_used'], 1)
+                    }
+                    for session in self.sessions
+                ]
+            }
+        }
+
 class TelnetConnection:
     def __init__(self):
         self.connections: Dict[str, Any] = {}
+        self.schedulers: Dict[str, CommandScheduler] = {}
+        self._connect_locks: Dict[str, asyncio.Lock] = {}
     
-    async def connect(self, device_id: str, host: str, port: int, username: str, password: str):
+    async def _expect(self, reader, patterns: List[re.Pattern], timeout: Optional[float] = None):
+        """Read until the tail of the output matches one of `patterns`; returns the index of the match"""
+        timeout = timeout or LOGIN_TIMEOUT
+        tail = ""
+        while True:
+            chunk = await asyncio.wait_for(reader.read(READ_CHUNK_SIZE), timeout=timeout)
+            if not chunk:
+                raise ConnectionError("Connection closed by device")
+            tail = (tail + ANSI_ESCAPE_PATTERN.sub('', chunk))[-PROMPT_SEARCH_WINDOW:]
+            for index, pattern in enumerate(patterns):
+                if pattern.search(tail):
+                    return index
+    
+    async def _open_session(self, host: str, port: int, username: str, password: str):
+        """
+        Open and log in a telnet session, driven by the prompts the OLT sends.
+        Leaves the session in config mode with paging disabled.
+        Raises LoginError with reason unreachable, auth_failed or prompt_timeout.
+        """
         try:
-            reader, writer = await telnetlib3.open_connection(host, port, connect_minwait=2.0)
-            
-            # Wait for login prompt
-            await asyncio.sleep(1)
-            output = await asyncio.wait_for(reader.read(1024), timeout=5.0)
-            
-            # Send username
+            reader, writer = await asyncio.wait_for(
+                telnetlib3.open_connection(host, port, connect_minwait=0.05, connect_maxwait=1.0),
+                timeout=CONNECT_TIMEOUT
+            )
+        except (OSError, asyncio.TimeoutError) as e:
+            raise LoginError(LOGIN_UNREACHABLE, f"Host unreachable: {e or 'connection timed out'}")
+        
+        step = "login prompt"
+        try:
+            await self._expect(reader, [USERNAME_PROMPT_PATTERN])
             writer.write(username + '\n')
-            await asyncio.sleep(0.5)
-            
-            # Wait for password prompt
-            output = await asyncio.wait_for(reader.read(1024), timeout=5.0)
             
-            # Send password
+            step = "password prompt"
+            await self._expect(reader, [PASSWORD_PROMPT_PATTERN])
             writer.write(password + '\n')
-            await asyncio.sleep(1)
             
-            # Read welcome message
-            output = await asyncio.wait_for(reader.read(2048), timeout=5.0)
+            step = "CLI prompt"
+            match = await self._expect(reader, [PROMPT_PATTERN, LOGIN_FAILED_PATTERN, USERNAME_PROMPT_PATTERN])
+            if match != 0:
+                raise LoginError(LOGIN_AUTH_FAILED, "Authentication failed: invalid username or password")
+            
+            # Session setup in one write: privileged mode, no paging, config mode
+            step = "session setup"
+            writer.write(''.join(command + '\n' for command in SESSION_SETUP_COMMANDS))
+            await self._read_responses(reader, writer, len(SESSION_SETUP_COMMANDS), timeout=LOGIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            writer.close()
+            raise LoginError(LOGIN_PROMPT_TIMEOUT, f"Timed out waiting for {step}")
+        except ConnectionError:
+            writer.close()
+            raise LoginError(LOGIN_UNREACHABLE, f"Connection closed while waiting for {step}")
+        except LoginError:
+            writer.close()
+            raise
+        
+        return reader, writer
+    
+    async def connect(self, device_id: str, host: str, port: int, username: str, password: str,
+                      pool_size: int = DEFAULT_POOL_SIZE, vty_limit: int = DEFAULT_VTY_LIMIT):
+        """
+        Returns (success, message, reason); reason is None on success.
+        Connecting an OLT that is already connected keeps the existing
+        session and scheduler, so racing callers never leak a VTY slot.
+        """
+        async with self._connect_locks.setdefault(device_id, asyncio.Lock()):
+            if device_id in self.connections:
+                return True, "Already connected", None
+            return await self._connect(device_id, host, port, username, password, pool_size, vty_limit)
+    
+    async def _connect(self, device_id: str, host: str, port: int, username: str, password: str,
+                       pool_size: int, vty_limit: int):
+        try:
+            reader, writer = await self._open_session(host, port, username, password)
             
-            self.connections[device_id] = {'reader': reader, 'writer': writer}
+            self.connections[device_id] = new_session(reader, writer, pinned=True)
+            self.schedulers[device_id] = CommandScheduler(
+                device_id,
+                self.connections[device_id],
+                open_session=lambda: self._open_session(host, port, username, password),
+                # One VTY is kept back for the terminal's own session
+                pool_size=max(1, min(pool_size, vty_limit - 1)),
+                dedicated_terminal=vty_limit > 1
+            )
             
             # Update device connection status
             await db.olt_devices.update_one(
                 {"id": device_id},
-                {"$set": {"is_connected": True, "last_connected": datetime.now(timezone.utc).isoformat()}}
+                {"$set": {"is_connected": True, "last_connected": datetime.now(timezone.utc)}}
             )
             
-            return True, "Connected successfully"
+            return True, "Connected successfully", None
+        except LoginError as e:
+            return False, str(e), e.reason
         except Exception as e:
-            return False, str(e)
+            return False, str(e), LOGIN_UNREACHABLE
+    
+    def terminal_session(self, device_id: str) -> Optional[Dict[str, Any]]:
+        """Session the device's interactive commands run on, for keystrokes typed at a prompt"""
+        scheduler = self.schedulers.get(device_id)
+        return scheduler.terminal_session() if scheduler else None
     
     async def disconnect(self, device_id: str):
         if device_id in self.connections:
+            scheduler = self.schedulers.pop(device_id, None)
+            if scheduler:
+                await scheduler.close()
             writer = self.connections[device_id]['writer']
             writer.close()
             await writer.wait_closed()
@@ -392,35 +1071,648 @@ class TelnetConnection:
                 {"$set": {"is_connected": False}}
             )
     
-    async def send_command(self, device_id: str, command: str):
-        if device_id not in self.connections:
-            return False, "Not connected", ""
+    async def _read_responses(self, reader, writer, count: int, timeout: float = COMMAND_TIMEOUT,
+                              on_chunk: Optional[Callable[[str], None]] = None) -> List[str]:
+        """
+        Read the output of `count` commands that were written back-to-back and
+        split it at prompt boundaries, one entry per command.
+        Answers the "---- More ----" pager and "{ <cr>|... }:" parameter prompts
+        automatically. `timeout` is the maximum idle time between two chunks.
+        `on_chunk` receives each cleaned chunk as soon as it is read.
+        """
+        segments: List[List[str]] = [[]]
+        partial = ""
+        seen_newline = False
         
-        try:
-            reader = self.connections[device_id]['reader']
-            writer = self.connections[device_id]['writer']
+        while True:
+            try:
+                chunk = await asyncio.wait_for(reader.read(READ_CHUNK_SIZE), timeout=timeout)
+            except asyncio.TimeoutError:
+                # Hand back whatever arrived rather than dropping partial output
+                if seen_newline or partial:
+                    segments[-1].append(partial)
+                    return [clean_output(''.join(segment)) for segment in segments]
+                raise
+            if not chunk:
+                raise ConnectionError("Connection closed by device")
+            if on_chunk:
+                on_chunk(clean_output(chunk))
             
-            # Send command
-            writer.write(command + '\n')
-            await asyncio.sleep(0.5)
+            lines = (partial + chunk).split('\n')
+            partial = lines.pop()
+            for line in lines:
+                # The first line is the echo of the first command (possibly after a
+                # stale prompt), so it never closes a segment
+                match = LINE_PROMPT_PATTERN.match(line) if seen_newline else None
+                seen_newline = True
+                if match and len(segments) < count:
+                    # Prompt followed by the echo of the next pipelined command
+                    segments[-1].append(line[:match.end()])
+                    segments.append([line[match.end():] + '\n'])
+                else:
+                    segments[-1].append(line + '\n')
             
-            # Read response
-            response = ""
+            if not seen_newline:
+                continue
+            tail = partial[-PROMPT_SEARCH_WINDOW:]
+            if MORE_PATTERN.search(tail):
+                writer.write(' ')
+            elif PARAMETER_PROMPT_PATTERN.search(tail):
+                writer.write('\n')
+            elif len(segments) == count and PROMPT_PATTERN.search(tail):
+                segments[-1].append(partial)
+                return [clean_output(''.join(segment)) for segment in segments]
+    
+    async def _read_until_prompt(self, reader, writer, timeout: float = COMMAND_TIMEOUT,
+                                 on_chunk: Optional[Callable[[str], None]] = None) -> str:
+        """Read the output of a single command until the OLT prompt appears"""
+        responses = await self._read_responses(reader, writer, 1, timeout, on_chunk)
+        return responses[0]
+    
+    async def send_command(self, device_id: str, command: str, priority: int = PRIORITY_NORMAL,
+                           read_only: Optional[bool] = None,
+                           on_chunk: Optional[Callable[[str], None]] = None):
+        """
+        Run one command. Display commands may run on any pooled session.
+        Interactive commands run on the terminal's own session, which keeps the
+        CLI mode the operator left it in.
+        `on_chunk` streams the output as it arrives.
+        """
+        if device_id not in self.connections:
+            return False, "Not connected", ""
+        if read_only is None:
+            read_only = priority != PRIORITY_INTERACTIVE and is_read_only_command(command)
+        
+        async def job(connection):
+            # Send command and read until the prompt comes back
+            connection['writer'].write(command + '\n')
             try:
-                output = await asyncio.wait_for(reader.read(4096), timeout=10.0)
-                response = output
+                return await self._read_until_prompt(connection['reader'], connection['writer'], on_chunk=on_chunk)
             except asyncio.TimeoutError:
-                response = "Command executed (timeout waiting for response)"
-            
+                return "Command executed (timeout waiting for response)"
+        
+        try:
+            response = await self.schedulers[device_id].submit(
+                job, priority, read_only=read_only, terminal=priority == PRIORITY_INTERACTIVE
+            )
             return True, "success", response
+        except QueueFullError as e:
+            return False, "busy", str(e)
         except Exception as e:
             return False, "error", str(e)
     
+    async def send_batch(self, device_id: str, commands: List[str], priority: int = PRIORITY_NORMAL,
+                         stop_on_error: bool = True, cleanup: Optional[List[str]] = None,
+                         pipeline_after: Optional[int] = None, read_only: bool = False):
+        """
+        Run an ordered list of commands as a single scheduler job.
+        With stop_on_error each command is written as soon as the previous prompt
+        returns and the batch stops at the first Huawei error; otherwise the whole
+        script goes out in one write and every command runs. One-write mode is meant
+        for configuration scripts: a pager prompt in the middle would swallow the
+        typed-ahead input.
+        `pipeline_after` mixes the two: the first N commands run one at a time and
+        stop the batch if they fail, the rest go out in one write. Registration
+        uses 1, so service ports are only sent once "ont add" has succeeded (and
+        can never land on another ONT holding the ID) at two round-trips in total.
+        `cleanup` commands (e.g. `quit` after `interface gpon F/S`) still run when
+        a later command fails, as long as the first command succeeded.
+        `read_only` batches may run on any pooled session; they must leave it in
+        the mode they found it, so pair `interface` with `quit` and a cleanup.
+        Returns (success, status, results) with one result per command.
+        """
+        if device_id not in self.connections:
+            return False, "Not connected", []
+        
+        async def job(connection):
+            reader, writer = connection['reader'], connection['writer']
+            if not stop_on_error:
+                writer.write(''.join(command + '\n' for command in commands))
+                responses = await self._read_responses(reader, writer, len(commands))
+            else:
+                responses = []
+                stepped = commands if pipeline_after is None else commands[:pipeline_after]
+                for command in stepped:
+                    writer.write(command + '\n')
+                    response = await self._read_until_prompt(reader, writer)
+                    responses.append(response)
+                    if COMMAND_ERROR_PATTERN.search(response):
+                        break
+                else:
+                    pipelined = commands[len(stepped):]
+                    if pipelined:
+                        writer.write(''.join(command + '\n' for command in pipelined))
+                        responses += await self._read_responses(reader, writer, len(pipelined))
+                failed = len(responses) < len(commands) or any(
+                    COMMAND_ERROR_PATTERN.search(response) for response in responses
+                )
+                if cleanup and failed and not COMMAND_ERROR_PATTERN.search(responses[0]):
+                    for command in cleanup:
+                        writer.write(command + '\n')
+                        await self._read_until_prompt(reader, writer)
+            
+            results = []
+            for index, command in enumerate(commands):
+                if index < len(responses):
+                    response = responses[index]
+                    status = "error" if COMMAND_ERROR_PATTERN.search(response) else "success"
+                else:
+                    response, status = "", "skipped"
+                results.append({"command": command, "response": response, "status": status})
+            return results
+        
+        try:
+            results = await self.schedulers[device_id].submit(job, priority, read_only=read_only)
+        except QueueFullError as e:
+            return False, "busy", [{"command": command, "response": str(e), "status": "skipped"} for command in commands]
+        except asyncio.TimeoutError:
+            return False, "error", [{"command": command, "response": "Timeout waiting for response", "status": "error"} for command in commands]
+        except Exception as e:
+            return False, "error", [{"command": command, "response": str(e), "status": "error"} for command in commands]
+        
+        success = all(result["status"] == "success" for result in results)
+        return success, "success" if success else "error", results
+    
+    def get_stats(self, device_id: str) -> Optional[Dict[str, Any]]:
+        scheduler = self.schedulers.get(device_id)
+        return scheduler.stats() if scheduler else None
+    
     def is_connected(self, device_id: str):
         return device_id in self.connections
 
 telnet_manager = TelnetConnection()
 
+# ==================== CONNECTION SUPERVISOR ====================
+
+KEEPALIVE_INTERVAL = float(os.environ.get('OLT_KEEPALIVE_INTERVAL', '60'))
+SUPERVISOR_CHECK_INTERVAL = 5.0
+SUPERVISOR_CHECK_TIMEOUT = float(os.environ.get('OLT_SUPERVISOR_CHECK_TIMEOUT', '30'))
+RECONNECT_BASE_DELAY = 2.0
+RECONNECT_MAX_DELAY = 300.0
+STARTUP_CONNECT_CONCURRENCY = int(os.environ.get('OLT_STARTUP_CONNECT_CONCURRENCY', '5'))
+
+class ConnectionSupervisor:
+    """
+    Keeps OLT sessions alive: sends a keepalive on idle sessions, notices dropped
+    sockets and reconnects devices whose configuration has auto_reconnect set.
+    """
+    def __init__(self, telnet: TelnetConnection):
+        self.telnet = telnet
+        self._task: Optional[asyncio.Task] = None
+        self._reconnecting: Dict[str, asyncio.Task] = {}
+    
+    async def start(self):
+        # Connection flags from before a restart are stale
+        await db.olt_devices.update_many({}, {"$set": {"is_connected": False}})
+        self._task = asyncio.create_task(self._run())
+        asyncio.create_task(self._connect_auto_reconnect_devices())
+    
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        for task in self._reconnecting.values():
+            task.cancel()
+        self._reconnecting = {}
+    
+    async def _connect_auto_reconnect_devices(self):
+        configs = await db.olt_configurations.find(
+            {"auto_reconnect": True}, {"_id": 0, "device_id": 1}
+        ).to_list(1000)
+        device_ids = [config['device_id'] for config in configs]
+        devices = await db.olt_devices.find({"id": {"$in": device_ids}}, {"_id": 0}).to_list(1000)
+        
+        semaphore = asyncio.Semaphore(STARTUP_CONNECT_CONCURRENCY)
+        
+        async def connect_one(device):
+            async with semaphore:
+                await self._connect(device)
+        
+        await asyncio.gather(*[connect_one(device) for device in devices])
+    
+    async def _connect(self, device: Dict[str, Any]):
+        success, message, reason = await self.telnet.connect(
+            device['id'],
+            device['ip_address'],
+            device['port'],
+            device['username'],
+            device['password'],
+            pool_size=device.get('pool_size', DEFAULT_POOL_SIZE),
+            vty_limit=device.get('vty_limit', DEFAULT_VTY_LIMIT)
+        )
+        manager.broadcast({
+            "type": "connection",
+            "device_id": device['id'],
+            "status": "connected" if success else "connect_failed",
+            "message": message,
+            "reason": reason
+        })
+        return success
+    
+    async def _run(self):
+        while True:
+            await asyncio.sleep(SUPERVISOR_CHECK_INTERVAL)
+            # One slow or hung OLT must not hold up the keepalives of the others
+            await asyncio.gather(*[
+                self._check_guarded(device_id, session)
+                for device_id, session in list(self.telnet.connections.items())
+            ])
+    
+    async def _check_guarded(self, device_id: str, session: Dict[str, Any]):
+        try:
+            await asyncio.wait_for(self._check(device_id, session), timeout=SUPERVISOR_CHECK_TIMEOUT)
+        except asyncio.TimeoutError:
+            # Usually a keepalive stuck behind a long job; the next round checks again
+            logger.warning(f"Supervisor check timed out for {device_id}")
+        except Exception as e:
+            logger.warning(f"Supervisor check failed for {device_id}: {e}")
+    
+    async def _check(self, device_id: str, session: Dict[str, Any]):
+        # Shielded: a check timing out must not cut a disconnect short
+        if session['writer'].is_closing() or session['reader'].at_eof():
+            await asyncio.shield(self._handle_drop(device_id))
+            return
+        if session['busy'] or time.monotonic() - session['last_used'] < KEEPALIVE_INTERVAL:
+            return
+        
+        async def keepalive(connection):
+            connection['writer'].write('\n')
+            return await self.telnet._read_until_prompt(connection['reader'], connection['writer'])
+        
+        try:
+            await self.telnet.schedulers[device_id].submit(keepalive, PRIORITY_BULK)
+        except (ConnectionError, asyncio.TimeoutError):
+            await asyncio.shield(self._handle_drop(device_id))
+        except QueueFullError:
+            pass  # Busy sessions do not need a keepalive
+    
+    async def _handle_drop(self, device_id: str):
+        if device_id not in self.telnet.connections:
+            return
+        logger.warning(f"Connection to OLT {device_id} lost")
+        try:
+            await self.telnet.disconnect(device_id)
+        except Exception:
+            pass  # Socket is already gone
+        
+        config = await db.olt_configurations.find_one({"device_id": device_id}, {"_id": 0, "auto_reconnect": 1})
+        reconnect = bool(config and config.get('auto_reconnect', True))
+        manager.broadcast({
+            "type": "connection",
+            "device_id": device_id,
+            "status": "reconnecting" if reconnect else "disconnected",
+            "message": "Connection lost"
+        })
+        if reconnect and device_id not in self._reconnecting:
+            self._reconnecting[device_id] = asyncio.create_task(self._reconnect(device_id))
+    
+    async def _reconnect(self, device_id: str):
+        attempt = 0
+        try:
+            while True:
+                # Exponential backoff with full jitter
+                delay = min(RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * 2 ** attempt)
+                await asyncio.sleep(random.uniform(0, delay))
+                attempt += 1
+                
+                device = await db.olt_devices.find_one({"id": device_id}, {"_id": 0})
+                if not device or self.telnet.is_connected(device_id):
+                    return  # Deleted, or reconnected manually
+                if await self._connect(device):
+                    return
+        finally:
+            self._reconnecting.pop(device_id, None)
+
+telnet_supervisor = ConnectionSupervisor(telnet_manager)
+
+# ==================== COMMAND LOG WRITER ====================
+
+LOG_FLUSH_SIZE = int(os.environ.get('LOG_FLUSH_SIZE', '200'))
+LOG_FLUSH_INTERVAL = float(os.environ.get('LOG_FLUSH_INTERVAL', '1.0'))
+LOG_BUFFER_MAX = int(os.environ.get('LOG_BUFFER_MAX', '20000'))
+# Responses longer than this are stored zlib-compressed with a short preview
+LOG_COMPRESS_THRESHOLD = 2048
+LOG_PREVIEW_CHARS = 512
+
+def pack_log_response(doc: Dict[str, Any]) -> Dict[str, Any]:
+    response = doc.get("response") or ""
+    if len(response) > LOG_COMPRESS_THRESHOLD:
+        doc["response_zlib"] = zlib.compress(response.encode('utf-8'))
+        doc["response_size"] = len(response)
+        doc["response"] = response[:LOG_PREVIEW_CHARS]
+    return doc
+
+def unpack_log_response(doc: Dict[str, Any]) -> Dict[str, Any]:
+    packed = doc.pop("response_zlib", None)
+    if packed is not None:
+        doc["response"] = zlib.decompress(packed).decode('utf-8')
+        doc.pop("response_size", None)
+    return doc
+
+class CommandLogWriter:
+    """
+    Write-behind buffer for command_logs.
+    Entries are flushed with insert_many once LOG_FLUSH_SIZE are queued or
+    every LOG_FLUSH_INTERVAL seconds. Devices whose configuration has
+    enable_log on are durable: write() triggers a flush and returns only
+    after their entries are stored. Other devices are fire-and-forget and may lose the last
+    interval of logs on a crash.
+    """
+    
+    def __init__(self):
+        self._buffer: List[Dict[str, Any]] = []
+        self._waiters: List[asyncio.Future] = []
+        self._durable: set = set()  # Ids of buffered entries someone is waiting on
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._settings: Dict[str, tuple] = {}
+        self.dropped = 0
+    
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task:
+            # wait_for swallows a cancel that lands as the wakeup fires; the
+            # flag still ends the loop
+            self._stopping = True
+            self._wakeup.set()
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+    
+    def forget_device(self, device_id: str):
+        """Drop the cached log settings after the configuration changes"""
+        self._settings.pop(device_id, None)
+    
+    async def _device_settings(self, device_id: str) -> tuple:
+        """(durable, retention_days) from the device configuration"""
+        if device_id not in self._settings:
+            config = await db.olt_configurations.find_one(
+                {"device_id": device_id}, {"_id": 0, "enable_log": 1, "log_retention_days": 1}
+            ) or {}
+            self._settings[device_id] = (
+                bool(config.get('enable_log', True)),
+                int(config.get('log_retention_days', DEFAULT_LOG_RETENTION_DAYS))
+            )
+        return self._settings[device_id]
+    
+    async def write(self, device_id: str, results: List[Dict[str, Any]]):
+        """
+        Log command results ({command, response, status}) for a device.
+        Never raises for a failed insert: the commands already ran, so the
+        caller still gets their result and the failure is only logged.
+        """
+        timestamp = datetime.now(timezone.utc)
+        docs = [
+            {
+                "id": str(uuid.uuid4()),
+                "device_id": device_id,
+                "command": result["command"],
+                "response": result["response"],
+                "status": result["status"],
+                "timestamp": timestamp
+            }
+            for result in results if result["status"] != "skipped"
+        ]
+        if not docs:
+            return
+        
+        durable, retention_days = await self._device_settings(device_id)
+        if retention_days > 0:
+            expires_at = timestamp + timedelta(days=retention_days)
+            for doc in docs:
+                doc["expires_at"] = expires_at
+        overflow = len(self._buffer) + len(docs) - LOG_BUFFER_MAX
+        if overflow > 0:
+            self._shed(overflow)
+        self._buffer.extend(docs)
+        
+        if self._task is None:
+            await self.flush()  # Not started (e.g. scripts): write through
+            return
+        
+        if durable:
+            # Flush now rather than on the timer; writers that arrive while
+            # the insert is running go out together in the next batch
+            self._durable.update(doc["id"] for doc in docs)
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            self._wakeup.set()
+            try:
+                await waiter
+            except Exception as e:
+                logger.warning(f"Command log for {device_id} was not stored: {e}")
+        elif len(self._buffer) >= LOG_FLUSH_SIZE:
+            self._wakeup.set()
+    
+    def _shed(self, count: int):
+        """Mongo is not keeping up; drop the oldest fire-and-forget entries"""
+        kept = []
+        dropped = 0
+        for doc in self._buffer:
+            if dropped < count and doc["id"] not in self._durable:
+                dropped += 1
+            else:
+                kept.append(doc)
+        self._buffer = kept
+        if dropped:
+            self.dropped += dropped
+            logger.warning(f"Command log buffer full, dropped {dropped} entries")
+    
+    async def flush(self):
+        while self._buffer:
+            docs, self._buffer = self._buffer, []
+            waiters, self._waiters = self._waiters, []
+            self._durable = set()
+            try:
+                docs = await asyncio.get_running_loop().run_in_executor(
+                    None, lambda: [pack_log_response(doc) for doc in docs]
+                )
+                await db.command_logs.insert_many(docs, ordered=False)
+            except Exception as e:
+                logger.error(f"Failed to write {len(docs)} command logs: {e}")
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_exception(e)
+            else:
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_result(None)
+    
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), LOG_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+    
+    def stats(self) -> Dict[str, Any]:
+        return {"buffered": len(self._buffer), "waiting": len(self._waiters), "dropped": self.dropped}
+
+command_log_writer = CommandLogWriter()
+
+# ==================== DATABASE INDEXES ====================
+
+DATABASE_INDEXES = {
+    "users": [
+        IndexModel([("username", ASCENDING)], unique=True),
+        IndexModel([("id", ASCENDING)], unique=True)
+    ],
+    "olt_devices": [
+        IndexModel([("id", ASCENDING)], unique=True)
+    ],
+    "olt_configurations": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("device_id", ASCENDING)])
+    ],
+    "ont_devices": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        # Stops the same ONT from being registered twice on one OLT
+        IndexModel([("olt_device_id", ASCENDING), ("serial_number", ASCENDING)], unique=True),
+        IndexModel([("olt_device_id", ASCENDING), ("frame", ASCENDING), ("board", ASCENDING),
+                    ("port", ASCENDING), ("ont_id", ASCENDING)]),
+        IndexModel([("serial_number", ASCENDING)]),
+        # Keyset pagination per OLT
+        IndexModel([("olt_device_id", ASCENDING), ("_id", ASCENDING)]),
+        IndexModel([("created_at", DESCENDING)])
+    ],
+    "command_logs": [
+        IndexModel([("device_id", ASCENDING), ("timestamp", DESCENDING)]),
+        # Cross-device queries by time range, status and command prefix
+        IndexModel([("timestamp", DESCENDING)]),
+        IndexModel([("status", ASCENDING), ("timestamp", DESCENDING)]),
+        IndexModel([("command", ASCENDING), ("timestamp", DESCENDING)]),
+        # Per-device retention: each entry carries its own expiry
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+        # Compressed responses only index their preview
+        IndexModel([("command", "text"), ("response", "text")], name="command_logs_text")
+    ],
+    "optical_samples": [
+        IndexModel([("ont", ASCENDING), ("start", ASCENDING)]),
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0)
+    ],
+    "optical_rollups": [
+        IndexModel([("ont", ASCENDING), ("resolution", ASCENDING), ("start", ASCENDING)]),
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0)
+    ],
+    "log_archives": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("created_at", DESCENDING)])
+    ],
+    "fleet_jobs": [
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0)
+    ],
+    "olt_config_backups": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("device_id", ASCENDING), ("taken_at", DESCENDING)])
+    ],
+    "ont_id_allocations": [
+        IndexModel([("olt_device_id", ASCENDING)])
+    ]
+}
+
+async def ensure_indexes():
+    """Create the indexes behind every hot query; safe to run on each startup"""
+    for collection, indexes in DATABASE_INDEXES.items():
+        for index in indexes:
+            try:
+                await db[collection].create_indexes([index])
+            except OperationFailure as e:
+                # E.g. existing duplicates block a unique index; keep serving without it
+                logger.warning(f"Could not create index {index.document['key']} on {collection}: {e}")
+
+# Fields that older releases wrote as ISO strings
+TIMESTAMP_FIELDS = {
+    "users": ["created_at"],
+    "olt_devices": ["created_at", "last_connected"],
+    "olt_configurations": ["created_at", "updated_at"],
+    "ont_devices": ["created_at"],
+    "command_logs": ["timestamp"]
+}
+MIGRATION_CHUNK_SIZE = 500
+
+def parse_timestamp(value: str) -> Optional[datetime]:
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+async def migrate_timestamps():
+    """
+    Convert ISO-string timestamps to BSON dates in place.
+    Works through each collection in _id order, MIGRATION_CHUNK_SIZE documents
+    at a time, and checkpoints the last _id in `migrations` so a restart picks
+    up where it stopped instead of rescanning.
+    """
+    for collection, fields in TIMESTAMP_FIELDS.items():
+        checkpoint_id = f"timestamps:{collection}"
+        checkpoint = await db.migrations.find_one({"_id": checkpoint_id})
+        if checkpoint and checkpoint.get("done"):
+            continue
+        
+        last_id = checkpoint.get("last_id") if checkpoint else None
+        selector = {"$or": [{field: {"$type": "string"}} for field in fields]}
+        converted = 0
+        
+        while True:
+            query = dict(selector)
+            if last_id is not None:
+                query["_id"] = {"$gt": last_id}
+            chunk = await db[collection].find(query, {field: 1 for field in fields}) \
+                .sort("_id", ASCENDING).limit(MIGRATION_CHUNK_SIZE).to_list(MIGRATION_CHUNK_SIZE)
+            if not chunk:
+                break
+            
+            operations = []
+            for doc in chunk:
+                update = {}
+                for field in fields:
+                    value = doc.get(field)
+                    if isinstance(value, str):
+                        parsed = parse_timestamp(value)
+                        if parsed is not None:
+                            update[field] = parsed
+                if update:
+                    # Guard on the field types so a concurrent write is never overwritten
+                    guard = {"_id": doc["_id"], **{field: doc[field] for field in update}}
+                    operations.append(UpdateOne(guard, {"$set": update}))
+            if operations:
+                result = await db[collection].bulk_write(operations, ordered=False)
+                converted += result.modified_count
+            
+            last_id = chunk[-1]["_id"]
+            await db.migrations.update_one(
+                {"_id": checkpoint_id}, {"$set": {"last_id": last_id}}, upsert=True
+            )
+        
+        await db.migrations.update_one(
+            {"_id": checkpoint_id},
+            {"$set": {"done": True, "finished_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+        if converted:
+            logger.info(f"Converted {converted} string timestamps in {collection}")
+
+async def run_timestamp_migration():
+    try:
+        await migrate_timestamps()
+    except Exception as e:
+        # Checkpoint is kept; the next startup resumes from it
+        logger.error(f"Timestamp migration interrupted: {e}")
+
 # ==================== API ROUTES ====================
 
 @api_router.get("/")
@@ -430,11 +1722,22 @@ async def root():
 # ==================== AUTHENTICATION ====================
 
 @api_router.post("/auth/login", response_model=Token)
-async def login(credentials: UserLogin):
+async def login(credentials: UserLogin, request: Request):
     """Login endpoint"""
-    user = await db.users.find_one({"username": credentials.username}, {"_id": 0})
+    client_ip = request.client.host if request.client else "unknown"
+    if not await ip_login_limiter.acquire(client_ip):
+        raise HTTPException(status_code=429, detail="Too many concurrent login attempts")
+    if not await username_login_limiter.acquire(credentials.username):
+        ip_login_limiter.release(client_ip)
+        raise HTTPException(status_code=429, detail="Login already in progress for this user")
+    try:
+        user = await db.users.find_one({"username": credentials.username}, {"_id": 0})
+        valid = bool(user) and await verify_password_async(credentials.password, user['password_hash'])
+    finally:
+        username_login_limiter.release(credentials.username)
+        ip_login_limiter.release(client_ip)
     
-    if not user or not verify_password(credentials.password, user['password_hash']):
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password"
@@ -447,7 +1750,7 @@ async def login(credentials: UserLogin):
         )
     
     # Create access token
-    access_token = create_access_token(data={"sub": user['username']})
+    access_token = create_user_token(user)
     
     # Prepare user response
     user_response = UserResponse(
@@ -525,12 +1828,12 @@ async def create_user(
     user_dict = {
         "id": str(uuid.uuid4()),
         "username": input.username,
-        "password_hash": hash_password(input.password),
+        "password_hash": await hash_password_async(input.password),
         "full_name": input.full_name,
         "role": input.role,
         "permissions": permissions,
         "is_active": True,
-        "created_at": datetime.now(timezone.utc).isoformat(),
+        "created_at": datetime.now(timezone.utc),
         "created_by": current_user.username
     }
     
@@ -581,13 +1884,20 @@ async def update_user(
     
     # Update password if provided
     if input.password:
-        update_data["password_hash"] = hash_password(input.password)
+        update_data["password_hash"] = await hash_password_async(input.password)
     
     # Update permissions
     if input.permissions:
         update_data["permissions"] = input.permissions
     
+    # Activate / deactivate
+    if input.is_active is not None:
+        if user_id == current_user.id and not input.is_active:
+            raise HTTPException(status_code=400, detail="Cannot deactivate your own account")
+        update_data["is_active"] = input.is_active
+    
     await db.users.update_one({"id": user_id}, {"$set": update_data})
+    user_cache.invalidate(existing['username'])
     
     updated_user = await db.users.find_one({"id": user_id}, {"_id": 0, "password_hash": 0})
     return UserResponse(**updated_user)
@@ -602,9 +1912,10 @@ async def delete_user(
     if user_id == current_user.id:
         raise HTTPException(status_code=400, detail="Cannot delete your own account")
     
-    result = await db.users.delete_one({"id": user_id})
-    if result.deleted_count == 0:
+    deleted = await db.users.find_one_and_delete({"id": user_id}, {"username": 1})
+    if not deleted:
         raise HTTPException(status_code=404, detail="User not found")
+    user_cache.invalidate(deleted['username'])
     
     return {"message": "User deleted successfully"}
 
@@ -616,23 +1927,12 @@ async def create_device(input: OLTDeviceCreate):
     device_obj = OLTDevice(**device_dict)
     
     doc = device_obj.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
-    if doc.get('last_connected'):
-        doc['last_connected'] = doc['last_connected'].isoformat()
-    
     await db.olt_devices.insert_one(doc)
     return device_obj
 
 @api_router.get("/devices", response_model=List[OLTDevice])
 async def get_devices():
     devices = await db.olt_devices.find({}, {"_id": 0}).to_list(1000)
-    
-    for device in devices:
-        if isinstance(device.get('created_at'), str):
-            device['created_at'] = datetime.fromisoformat(device['created_at'])
-        if device.get('last_connected') and isinstance(device['last_connected'], str):
-            device['last_connected'] = datetime.fromisoformat(device['last_connected'])
-    
     return devices
 
 @api_router.get("/devices/{device_id}", response_model=OLTDevice)
@@ -640,12 +1940,6 @@ async def get_device(device_id: str):
     device = await db.olt_devices.find_one({"id": device_id}, {"_id": 0})
     if not device:
         raise HTTPException(status_code=404, detail="Device not found")
-    
-    if isinstance(device.get('created_at'), str):
-        device['created_at'] = datetime.fromisoformat(device['created_at'])
-    if device.get('last_connected') and isinstance(device['last_connected'], str):
-        device['last_connected'] = datetime.fromisoformat(device['last_connected'])
-    
     return device
 
 @api_router.put("/devices/{device_id}", response_model=OLTDevice)
@@ -658,11 +1952,6 @@ async def update_device(device_id: str, input: OLTDeviceCreate):
     await db.olt_devices.update_one({"id": device_id}, {"$set": update_data})
     
     updated_device = await db.olt_devices.find_one({"id": device_id}, {"_id": 0})
-    if isinstance(updated_device.get('created_at'), str):
-        updated_device['created_at'] = datetime.fromisoformat(updated_device['created_at'])
-    if updated_device.get('last_connected') and isinstance(updated_device['last_connected'], str):
-        updated_device['last_connected'] = datetime.fromisoformat(updated_device['last_connected'])
-    
     return updated_device
 
 @api_router.delete("/devices/{device_id}")
@@ -675,6 +1964,12 @@ async def delete_device(device_id: str):
     await db.olt_configurations.delete_many({"device_id": device_id})
     await db.ont_devices.delete_many({"olt_device_id": device_id})
     await db.command_logs.delete_many({"device_id": device_id})
+    await ont_id_allocator.forget_device(device_id)
+    await service_port_allocator.forget_device(device_id)
+    command_log_writer.forget_device(device_id)
+    optical_info_service.forget_device(device_id)
+    ont_status_poller.forget_device(device_id)
+    autofind_watcher.forget_device(device_id)
     
     return {"message": "Device deleted successfully"}
 
@@ -686,91 +1981,118 @@ async def connect_device(device_id: str):
     if not device:
         raise HTTPException(status_code=404, detail="Device not found")
     
-    success, message = await telnet_manager.connect(
+    success, message, reason = await telnet_manager.connect(
         device_id,
         device['ip_address'],
         device['port'],
         device['username'],
-        device['password']
+        device['password'],
+        pool_size=device.get('pool_size', DEFAULT_POOL_SIZE),
+        vty_limit=device.get('vty_limit', DEFAULT_VTY_LIMIT)
     )
     
     if success:
-        await manager.broadcast(json.dumps({
+        manager.broadcast({
             "type": "connection",
             "device_id": device_id,
             "status": "connected",
             "message": message
-        }))
+        })
     
-    return {"success": success, "message": message}
+    return {"success": success, "message": message, "reason": reason}
 
 @api_router.post("/devices/{device_id}/disconnect")
 async def disconnect_device(device_id: str):
     await telnet_manager.disconnect(device_id)
     
-    await manager.broadcast(json.dumps({
+    manager.broadcast({
         "type": "connection",
         "device_id": device_id,
         "status": "disconnected"
-    }))
+    })
     
     return {"message": "Disconnected successfully"}
 
 @api_router.get("/devices/{device_id}/status")
 async def get_connection_status(device_id: str):
     is_connected = telnet_manager.is_connected(device_id)
-    return {"device_id": device_id, "is_connected": is_connected}
+    return {
+        "device_id": device_id,
+        "is_connected": is_connected,
+        "scheduler": telnet_manager.get_stats(device_id)
+    }
 
 @api_router.post("/devices/command")
 async def send_command(input: TelnetCommand):
-    success, status, response = await telnet_manager.send_command(input.device_id, input.command)
+    success, status, response = await telnet_manager.send_command(
+        input.device_id, input.command, priority=PRIORITY_INTERACTIVE
+    )
+    if status == "busy":
+        raise HTTPException(status_code=429, detail=response)
     
     # Log command
-    log_dict = {
-        "id": str(uuid.uuid4()),
-        "device_id": input.device_id,
-        "command": input.command,
-        "response": response,
-        "status": status,
-        "timestamp": datetime.now(timezone.utc).isoformat()
-    }
-    await db.command_logs.insert_one(log_dict)
+    await command_log_writer.write(
+        input.device_id, [{"command": input.command, "response": response, "status": status}]
+    )
     
     # Broadcast to WebSocket
-    await manager.broadcast(json.dumps({
+    manager.broadcast({
         "type": "command",
         "device_id": input.device_id,
         "command": input.command,
         "response": response,
         "status": status
-    }))
+    })
     
     return {"success": success, "status": status, "response": response}
 
-# ==================== CONFIGURATIONS ====================
-
-@api_router.post("/configurations", response_model=OLTConfiguration)
-async def create_configuration(input: OLTConfigurationCreate):
-    config_dict = input.model_dump()
+@api_router.post("/devices/{device_id}/batch")
+async def send_batch_commands(device_id: str, input: BatchCommand):
+    """
+    Run an ordered list of commands on the OLT as one scheduler job.
+    With stop_on_error (the default) each command waits for the previous
+    prompt, so the batch costs one round-trip per command; without it the
+    whole script goes out in one write. Output is split back into one result
+    per command.
+    """
+    if not input.commands:
+        raise HTTPException(status_code=400, detail="No commands given")
+    
+    success, status, results = await telnet_manager.send_batch(
+        device_id, input.commands, priority=PRIORITY_NORMAL, stop_on_error=input.stop_on_error
+    )
+    if status == "Not connected":
+        raise HTTPException(status_code=400, detail="Device not connected")
+    if status == "busy":
+        raise HTTPException(status_code=429, detail=results[0]["response"])
+    
+    # Log executed commands
+    await command_log_writer.write(device_id, results)
+    
+    manager.broadcast({
+        "type": "batch",
+        "device_id": device_id,
+        "results": results,
+        "status": status
+    })
+    
+    return {"success": success, "status": status, "results": results}
+
+# ==================== CONFIGURATIONS ====================
+
+@api_router.post("/configurations", response_model=OLTConfiguration)
+async def create_configuration(input: OLTConfigurationCreate):
+    config_dict = input.model_dump()
     config_obj = OLTConfiguration(**config_dict)
     
     doc = config_obj.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
-    doc['updated_at'] = doc['updated_at'].isoformat()
-    
     await db.olt_configurations.insert_one(doc)
+    command_log_writer.forget_device(config_obj.device_id)
     return config_obj
 
 @api_router.get("/configurations", response_model=List[OLTConfiguration])
 async def get_configurations():
     configs = await db.olt_configurations.find({}, {"_id": 0}).to_list(1000)
-    
-    for config in configs:
-        if isinstance(config.get('created_at'), str):
-            config['created_at'] = datetime.fromisoformat(config['created_at'])
-        if isinstance(config.get('updated_at'), str):
-            config['updated_at'] = datetime.fromisoformat(config['updated_at'])
-    
     return configs
 
 @api_router.get("/configurations/device/{device_id}", response_model=OLTConfiguration)
@@ -778,12 +2100,6 @@ async def get_configuration_by_device(device_id: str):
     config = await db.olt_configurations.find_one({"device_id": device_id}, {"_id": 0})
     if not config:
         raise HTTPException(status_code=404, detail="Configuration not found")
-    
-    if isinstance(config.get('created_at'), str):
-        config['created_at'] = datetime.fromisoformat(config['created_at'])
-    if isinstance(config.get('updated_at'), str):
-        config['updated_at'] = datetime.fromisoformat(config['updated_at'])
-    
     return config
 
 @api_router.put("/configurations/{config_id}", response_model=OLTConfiguration)
@@ -793,70 +2109,814 @@ async def update_configuration(config_id: str, input: OLTConfigurationCreate):
         raise HTTPException(status_code=404, detail="Configuration not found")
     
     update_data = input.model_dump()
-    update_data['updated_at'] = datetime.now(timezone.utc).isoformat()
+    update_data['updated_at'] = datetime.now(timezone.utc)
     
     await db.olt_configurations.update_one({"id": config_id}, {"$set": update_data})
+    command_log_writer.forget_device(config['device_id'])
+    if input.log_retention_days != config.get('log_retention_days', DEFAULT_LOG_RETENTION_DAYS):
+        await apply_log_retention(config['device_id'], input.log_retention_days)
     
     updated_config = await db.olt_configurations.find_one({"id": config_id}, {"_id": 0})
-    if isinstance(updated_config.get('created_at'), str):
-        updated_config['created_at'] = datetime.fromisoformat(updated_config['created_at'])
-    if isinstance(updated_config.get('updated_at'), str):
-        updated_config['updated_at'] = datetime.fromisoformat(updated_config['updated_at'])
-    
     return updated_config
 
 @api_router.delete("/configurations/{config_id}")
 async def delete_configuration(config_id: str):
-    result = await db.olt_configurations.delete_one({"id": config_id})
-    if result.deleted_count == 0:
+    config = await db.olt_configurations.find_one_and_delete({"id": config_id}, {"device_id": 1})
+    if not config:
         raise HTTPException(status_code=404, detail="Configuration not found")
+    command_log_writer.forget_device(config['device_id'])
     return {"message": "Configuration deleted successfully"}
 
 # ==================== ONT DEVICES ====================
 
-@api_router.get("/ont/next-id/{device_id}")
-async def get_next_ont_id(device_id: str, frame: int = 0, board: int = 1, port: int = 3):
+# ONT IDs per PON port by board type
+ONT_ID_LIMITS = {"gpon": 128, "epon": 64}
+ALLOCATOR_CAS_RETRIES = 20
+
+class OntIdAllocationError(Exception):
+    pass
+
+def board_type_from_name(board_name: str) -> str:
+    """Huawei service board names carry the PON type after the model prefix, e.g. H806EPBD, H805GPFD"""
+    return "epon" if board_name[4:6].upper() == "EP" else "gpon"
+
+class OntIdAllocator:
     """
-    Get next available ONT ID for a specific port.
-    Returns the next sequential ONT ID that hasn't been used.
+    Hands out ONT IDs per (OLT, frame, board, port) from a bitmap stored in
+    `ont_id_allocations` (bit n set = ONT ID n in use). Each change is a
+    conditional update on the bitmap that was read, so concurrent
+    registrations, in this process or another, never receive the same ID.
     """
-    # Find all ONTs on this specific port
-    existing_onts = await db.ont_devices.find({
-        "olt_device_id": device_id,
-        "frame": frame,
-        "board": board,
-        "port": port
-    }, {"_id": 0, "ont_id": 1}).to_list(1000)
+    def __init__(self):
+        self._cache: Dict[str, Dict[str, Any]] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._board_types: Dict[tuple, Dict[int, str]] = {}  # (device, frame) -> {slot: board type}
     
-    if not existing_onts:
-        # No ONTs yet, start from 0
-        return {"next_ont_id": 0, "available_ids": list(range(0, 128))}
+    @staticmethod
+    def _key(device_id: str, frame: int, board: int, port: int) -> str:
+        return f"{device_id}:{frame}/{board}/{port}"
     
-    # Get list of used ONT IDs
-    used_ids = sorted([ont["ont_id"] for ont in existing_onts])
+    async def _detect_board_type(self, device_id: str, frame: int, board: int) -> Optional[str]:
+        """Board type from the OLT's board table, None if the OLT cannot tell us"""
+        key = (device_id, frame)
+        if key not in self._board_types:
+            if not telnet_manager.is_connected(device_id):
+                return None
+            success, status, response = await telnet_manager.send_command(device_id, f"display board {frame}")
+            if not success:
+                return None
+            self._board_types[key] = {
+                record['slot']: board_type_from_name(record['board_name'])
+                for record in parse_boards(response) if record.get('board_name')
+            }
+        return self._board_types[key].get(board)
     
-    # Find first available ID (starting from 0)
-    next_id = 0
-    for used_id in used_ids:
-        if next_id == used_id:
-            next_id += 1
+    async def _load(self, device_id: str, frame: int, board: int, port: int, board_type: Optional[str],
+                    refresh: bool = False) -> Dict[str, Any]:
+        """
+        Allocation state of one port. `board_type` None means the caller does
+        not know it: the type comes from the OLT's board table, or while the
+        OLT is unreachable from the port's inventory, then gpon. A guessed
+        type is checked against the board table once the OLT is connected.
+        An explicit or detected type that disagrees with the stored limit
+        updates it.
+        """
+        key = self._key(device_id, frame, board, port)
+        doc = None if refresh else self._cache.get(key)
+        if doc is None:
+            doc = await db.ont_id_allocations.find_one({"_id": key})
+        if not doc:
+            # First use of this port: seed the bitmap from the inventory
+            onts = await db.ont_devices.find(
+                {"olt_device_id": device_id, "frame": frame, "board": board, "port": port},
+                {"_id": 0, "ont_id": 1, "board_type": 1}
+            ).to_list(None)
+            used = 0
+            for ont in onts:
+                used |= 1 << ont['ont_id']
+            if board_type is None:
+                board_type = await self._detect_board_type(device_id, frame, board)
+            confirmed = board_type is not None
+            if board_type is None:
+                board_type = next((ont['board_type'] for ont in onts if ont.get('board_type')), "gpon")
+            doc = {
+                "_id": key,
+                "olt_device_id": device_id,
+                "frame": frame,
+                "board": board,
+                "port": port,
+                "board_type": board_type,
+                "board_type_confirmed": confirmed,
+                "limit": ONT_ID_LIMITS.get(board_type, ONT_ID_LIMITS["gpon"]),
+                "used": format(used, 'x')
+            }
+            try:
+                await db.ont_id_allocations.insert_one(doc)
+            except DuplicateKeyError:
+                doc = await db.ont_id_allocations.find_one({"_id": key})
+        
+        if board_type is None and not doc.get('board_type_confirmed'):
+            board_type = await self._detect_board_type(device_id, frame, board)
+        if board_type is not None:
+            limit = ONT_ID_LIMITS.get(board_type, ONT_ID_LIMITS["gpon"])
+            if doc['limit'] != limit or not doc.get('board_type_confirmed'):
+                update = {"limit": limit, "board_type": board_type, "board_type_confirmed": True}
+                await db.ont_id_allocations.update_one({"_id": key}, {"$set": update})
+                doc = {**doc, **update}
+        
+        self._cache[key] = doc
+        return doc
+    
+    async def port_board_type(self, device_id: str, frame: int, board: int, port: int) -> str:
+        """Board type the port is allocated as"""
+        doc = await self._load(device_id, frame, board, port, None)
+        return doc.get('board_type') or ("epon" if doc['limit'] == ONT_ID_LIMITS["epon"] else "gpon")
+    
+    async def _update(self, device_id: str, frame: int, board: int, port: int, board_type: Optional[str], change):
+        """Apply change(used, limit) -> (new_used, result) with compare-and-swap"""
+        key = self._key(device_id, frame, board, port)
+        async with self._locks.setdefault(key, asyncio.Lock()):
+            refresh = False
+            for _ in range(ALLOCATOR_CAS_RETRIES):
+                doc = await self._load(device_id, frame, board, port, board_type, refresh=refresh)
+                new_used, result = change(int(doc['used'], 16), doc['limit'])
+                new_hex = format(new_used, 'x')
+                if new_hex == doc['used']:
+                    return result
+                
+                update = await db.ont_id_allocations.update_one(
+                    {"_id": key, "used": doc['used']},
+                    {"$set": {"used": new_hex}}
+                )
+                if update.modified_count:
+                    self._cache[key] = {**doc, "used": new_hex}
+                    return result
+                refresh = True  # Changed by another process: reload and retry
+        raise OntIdAllocationError("ONT ID allocation is busy, please retry")
+    
+    async def allocate(self, device_id: str, frame: int, board: int, port: int,
+                       count: int = 1, board_type: Optional[str] = None) -> List[int]:
+        """Allocate the lowest free IDs; returns fewer than `count` if the port fills up"""
+        def change(used: int, limit: int):
+            ids = []
+            for _ in range(count):
+                lowest_free = ~used & (used + 1)
+                ont_id = lowest_free.bit_length() - 1
+                if ont_id >= limit:
+                    break
+                used |= lowest_free
+                ids.append(ont_id)
+            if not ids:
+                raise OntIdAllocationError(f"No free ONT ID on port {frame}/{board}/{port}")
+            return used, ids
+        
+        return await self._update(device_id, frame, board, port, board_type, change)
+    
+    async def reserve(self, device_id: str, frame: int, board: int, port: int,
+                      ont_id: int, board_type: Optional[str] = None):
+        def change(used: int, limit: int):
+            if not 0 <= ont_id < limit:
+                raise OntIdAllocationError(f"ONT ID {ont_id} out of range (0-{limit - 1})")
+            if used >> ont_id & 1:
+                raise OntIdAllocationError(f"ONT ID {ont_id} already in use on port {frame}/{board}/{port}")
+            return used | 1 << ont_id, ont_id
+        
+        return await self._update(device_id, frame, board, port, board_type, change)
+    
+    async def release(self, device_id: str, frame: int, board: int, port: int, ont_id: int,
+                      board_type: Optional[str] = None):
+        def change(used: int, limit: int):
+            return used & ~(1 << ont_id), None
+        
+        await self._update(device_id, frame, board, port, board_type, change)
+    
+    async def peek(self, device_id: str, frame: int, board: int, port: int,
+                   board_type: Optional[str] = None) -> Dict[str, Any]:
+        doc = await self._load(device_id, frame, board, port, board_type, refresh=True)
+        used = int(doc['used'], 16)
+        limit = doc['limit']
+        lowest_free = (~used & (used + 1)).bit_length() - 1
+        used_count = bin(used).count('1')
+        available_ids = [i for i in range(limit) if not used >> i & 1][:10]
+        return {
+            "next_ont_id": lowest_free if lowest_free < limit else -1,
+            "used_count": used_count,
+            "available_count": limit - used_count,
+            "available_ids": available_ids  # Return first 10 available
+        }
+    
+    async def suggest(self, device_id: str, frame: int, board: int, port: int,
+                      count: int, board_type: Optional[str] = None) -> List[int]:
+        """The IDs allocate() would hand out right now, without reserving them"""
+        doc = await self._load(device_id, frame, board, port, board_type, refresh=True)
+        used = int(doc['used'], 16)
+        return [i for i in range(doc['limit']) if not used >> i & 1][:count]
+    
+    async def forget_device(self, device_id: str):
+        await db.ont_id_allocations.delete_many({"olt_device_id": device_id})
+        for key in [key for key in self._cache if key.startswith(f"{device_id}:")]:
+            del self._cache[key]
+        for key in [key for key in self._board_types if key[0] == device_id]:
+            del self._board_types[key]
+
+ont_id_allocator = OntIdAllocator()
+
+class ServicePortAllocationError(Exception):
+    pass
+
+# Service-port rows in "display service-port all": INDEX VLAN VLAN-ATTR PORT-TYPE ...
+
+def _take_range(free: List[List[int]], next_index: int, count: int):
+    """First fit from the free list, otherwise extend the high-water mark"""
+    for i, (start, length) in enumerate(free):
+        if length >= count:
+            if length == count:
+                free.pop(i)
+            else:
+                free[i] = [start + count, length - count]
+            return start, next_index
+    return next_index, next_index + count
+
+def _reserve_range(free: List[List[int]], next_index: int, start: int, count: int) -> int:
+    end = start + count
+    if start >= next_index:
+        if start > next_index:
+            free.append([next_index, start - next_index])
+        return end
+    for i, (free_start, length) in enumerate(free):
+        free_end = free_start + length
+        if free_start <= start and end <= free_end:
+            pieces = [[free_start, start - free_start], [end, free_end - end]]
+            free[i:i + 1] = [piece for piece in pieces if piece[1] > 0]
+            return next_index
+    raise ServicePortAllocationError(f"Service-port index {start}-{end - 1} already in use")
+
+def _release_range(free: List[List[int]], next_index: int, start: int, count: int) -> int:
+    free.append([start, count])
+    free.sort()
+    merged: List[List[int]] = []
+    for range_start, length in free:
+        if merged and merged[-1][0] + merged[-1][1] >= range_start:
+            merged[-1][1] = max(merged[-1][1], range_start + length - merged[-1][0])
         else:
-            break
+            merged.append([range_start, length])
+    # A free range at the top just lowers the high-water mark
+    if merged and merged[-1][0] + merged[-1][1] >= next_index:
+        next_index = merged.pop()[0]
+    free[:] = merged
+    return next_index
+
+class ServicePortAllocator:
+    """
+    Hands out service-port indexes per OLT from a high-water mark plus a free
+    list of released ranges, stored in `service_port_allocations`. Multi-gemport
+    ONTs get contiguous ranges. Each change is conditional on the version that
+    was read, so concurrent registrations never share an index. Cost depends
+    on fragmentation of the free list, not on the size of the inventory.
+    """
+    def __init__(self):
+        self._cache: Dict[str, Dict[str, Any]] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+    
+    async def _seed(self, device_id: str) -> Dict[str, Any]:
+        """Build the initial state from the OLT's service-port table and the inventory"""
+        used = set()
+        from_device = False
+        if telnet_manager.is_connected(device_id):
+            success, status, response = await telnet_manager.send_command(device_id, "display service-port all")
+            if success:
+                used.update(service_port['index'] for service_port in parse_service_ports(response))
+                from_device = True
+        async for ont in db.ont_devices.find(
+            {"olt_device_id": device_id},
+            {"_id": 0, "service_port_index": 1, "service_port_count": 1, "gemport": 1}
+        ):
+            count = ont.get('service_port_count') or len(ont.get('gemport', '1').split(','))
+            used.update(range(ont.get('service_port_index', 0), ont.get('service_port_index', 0) + count))
+        
+        next_index = max(used) + 1 if used else 0
+        free: List[List[int]] = []
+        previous = -1
+        for index in sorted(used):
+            if index > previous + 1:
+                free.append([previous + 1, index - previous - 1])
+            previous = index
+        return {"_id": device_id, "next": next_index, "free": free, "version": 0, "seeded_from_device": from_device}
+    
+    async def _load(self, device_id: str, refresh: bool = False) -> Dict[str, Any]:
+        if not refresh and device_id in self._cache:
+            return self._cache[device_id]
+        doc = await db.service_port_allocations.find_one({"_id": device_id})
+        if not doc:
+            doc = await self._seed(device_id)
+            try:
+                await db.service_port_allocations.insert_one(dict(doc))
+            except DuplicateKeyError:
+                doc = await db.service_port_allocations.find_one({"_id": device_id})
+        self._cache[device_id] = doc
+        return doc
+    
+    async def _sync_with_device(self, device_id: str):
+        """
+        Merge the OLT's service-port table into a state that was seeded from
+        the inventory alone (the OLT was offline at first use), so indexes
+        configured directly on the OLT are never handed out.
+        """
+        doc = await self._load(device_id)
+        if doc.get('seeded_from_device') or not telnet_manager.is_connected(device_id):
+            return
+        success, status, response = await telnet_manager.send_command(device_id, "display service-port all")
+        if not success:
+            return
+        indexes = sorted({service_port['index'] for service_port in parse_service_ports(response)})
+        
+        def change(free, next_index):
+            for index in indexes:
+                try:
+                    next_index = _reserve_range(free, next_index, index, 1)
+                except ServicePortAllocationError:
+                    pass  # Already allocated here
+            return next_index, None
+        
+        await self._update(device_id, change, seeded_from_device=True)
+    
+    async def _update(self, device_id: str, change, **extra):
+        """Apply change(free, next) -> (next, result) with compare-and-swap on the version"""
+        async with self._locks.setdefault(device_id, asyncio.Lock()):
+            refresh = False
+            for _ in range(ALLOCATOR_CAS_RETRIES):
+                doc = await self._load(device_id, refresh=refresh)
+                free = [list(free_range) for free_range in doc['free']]
+                next_index, result = change(free, doc['next'])
+                
+                update = await db.service_port_allocations.update_one(
+                    {"_id": device_id, "version": doc['version']},
+                    {"$set": {"next": next_index, "free": free, **extra}, "$inc": {"version": 1}}
+                )
+                if update.modified_count:
+                    self._cache[device_id] = {
+                        **doc, "next": next_index, "free": free, "version": doc['version'] + 1, **extra
+                    }
+                    return result
+                refresh = True  # Changed by another process: reload and retry
+        raise ServicePortAllocationError("Service-port allocation is busy, please retry")
+    
+    async def allocate_many(self, device_id: str, counts: List[int]) -> List[int]:
+        """Allocate one contiguous range per entry in `counts`; returns the start indexes"""
+        await self._sync_with_device(device_id)
+        
+        def change(free, next_index):
+            starts = []
+            for count in counts:
+                start, next_index = _take_range(free, next_index, count)
+                starts.append(start)
+            return next_index, starts
+        
+        return await self._update(device_id, change)
+    
+    async def allocate(self, device_id: str, count: int) -> int:
+        return (await self.allocate_many(device_id, [count]))[0]
+    
+    async def reserve(self, device_id: str, start: int, count: int):
+        await self._sync_with_device(device_id)
+        
+        def change(free, next_index):
+            return _reserve_range(free, next_index, start, count), start
+        
+        return await self._update(device_id, change)
+    
+    async def release(self, device_id: str, start: int, count: int):
+        def change(free, next_index):
+            return _release_range(free, next_index, start, count), None
+        
+        await self._update(device_id, change)
+    
+    async def suggest_many(self, device_id: str, counts: List[int]) -> List[int]:
+        """The starts allocate_many() would return right now, without reserving them"""
+        await self._sync_with_device(device_id)
+        doc = await self._load(device_id, refresh=True)
+        free = [list(free_range) for free_range in doc['free']]
+        next_index = doc['next']
+        starts = []
+        for count in counts:
+            start, next_index = _take_range(free, next_index, count)
+            starts.append(start)
+        return starts
+    
+    async def forget_device(self, device_id: str):
+        await db.service_port_allocations.delete_one({"_id": device_id})
+        self._cache.pop(device_id, None)
+
+service_port_allocator = ServicePortAllocator()
+
+# How long a port's optical readings are served from memory
+OPTICAL_CACHE_TTL = float(os.environ.get('OPTICAL_CACHE_TTL', '60'))
+OPTICAL_FIELDS = ("rx_power", "tx_power", "olt_rx_power", "temperature", "voltage", "current")
+# Seconds a newly added ONT needs to range before it reports optical levels
+OPTICAL_RANGING_DELAY = float(os.environ.get('OPTICAL_RANGING_DELAY', '30'))
+
+class OpticalInfoService:
+    """
+    Optical levels (Rx/Tx power, temperature, voltage, bias current) per PON
+    port. One `display ont optical-info P all` covers every ONT on the port;
+    results are written to the ONT records with one bulk_write and kept in
+    memory for OPTICAL_CACHE_TTL seconds. Concurrent requests for the same
+    port share one query.
+    """
+    def __init__(self):
+        self._cache: Dict[tuple, tuple] = {}  # (device, f, b, p) -> (fetched_at, {ont_id: reading})
+        self._inflight: Dict[tuple, asyncio.Task] = {}
+        self._scheduled: Dict[tuple, tuple] = {}  # (device, f, b, p) -> (due, task), one per port
+    
+    def cached(self, device_id: str, frame: int, board: int, port: int,
+               max_age: float = OPTICAL_CACHE_TTL) -> Optional[Dict[int, Dict[str, Any]]]:
+        entry = self._cache.get((device_id, frame, board, port))
+        if entry and time.monotonic() - entry[0] <= max_age:
+            return entry[1]
+        return None
     
-    # Get list of all available IDs
-    all_ids = set(range(0, 128))  # GPON max
-    used_ids_set = set(used_ids)
-    available_ids = sorted(list(all_ids - used_ids_set))
+    async def get_port(self, device_id: str, frame: int, board: int, port: int,
+                       max_age: float = OPTICAL_CACHE_TTL, board_type: str = "gpon",
+                       priority: int = PRIORITY_NORMAL) -> Dict[int, Dict[str, Any]]:
+        readings = self.cached(device_id, frame, board, port, max_age)
+        if readings is not None:
+            return readings
+        key = (device_id, frame, board, port)
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._collect(device_id, frame, board, port, board_type, priority))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # Shielded: a waiter that gives up must not cancel the query for the others
+        return await asyncio.shield(task)
+    
+    def refresh_soon(self, device_id: str, frame: int, board: int, port: int, board_type: str = "gpon",
+                     delay: float = 0):
+        """
+        Refresh a port in the background at bulk priority after `delay`
+        seconds. A pending refresh for the port is pushed back to the later
+        time rather than run twice, so a bulk registration queries each port
+        once, after its last ONT had time to range.
+        """
+        key = (device_id, frame, board, port)
+        due = time.monotonic() + delay
+        pending = self._scheduled.get(key)
+        if pending:
+            if pending[0] >= due:
+                return
+            pending[1].cancel()  # The port query itself is shielded in get_port
+        
+        async def refresh():
+            await asyncio.sleep(delay)
+            await self.get_port(device_id, frame, board, port, 0, board_type, PRIORITY_BULK)
+        
+        task = asyncio.create_task(refresh())
+        self._scheduled[key] = (due, task)
+        
+        def done(task: asyncio.Task):
+            if self._scheduled.get(key, (None, None))[1] is task:
+                del self._scheduled[key]
+            if not task.cancelled():
+                task.exception()  # Errors are logged in _collect
+        task.add_done_callback(done)
+    
+    async def _collect(self, device_id: str, frame: int, board: int, port: int, board_type: str,
+                       priority: int) -> Dict[int, Dict[str, Any]]:
+        interface = "epon" if board_type == "epon" else "gpon"
+        success, status, results = await telnet_manager.send_batch(
+            device_id,
+            [f"interface {interface} {frame}/{board}", f"display ont optical-info {port} all", "quit"],
+            priority=priority,
+            cleanup=["quit"],
+            read_only=True
+        )
+        if len(results) < 2 or results[1]['status'] != "success":
+            failed = next((r for r in results if r['status'] != "success"), None)
+            message = failed['response'] if failed else status
+            logger.warning(f"Optical query failed on {device_id} {frame}/{board}/{port}: {message}")
+            raise HTTPException(status_code=502, detail=f"Optical query failed: {message}".strip())
+        
+        fetched_at = datetime.now(timezone.utc)
+        readings = {
+            reading['ont_id']: {**reading, "updated_at": fetched_at}
+            for reading in parse_optical_info(results[1]['response'], frame, board, port)
+            if reading.get('ont_id') is not None
+        }
+        self.store(device_id, frame, board, port, readings)
+        
+        if readings:
+            onts = await db.ont_devices.find(
+                {"olt_device_id": device_id, "frame": frame, "board": board, "port": port},
+                {"_id": 0, "id": 1, "ont_id": 1}
+            ).to_list(None)
+            onts = [ont for ont in onts if ont['ont_id'] in readings]
+            if onts:
+                await db.ont_devices.bulk_write([
+                    UpdateOne({"id": ont['id']}, {"$set": {"optical": {
+                        **{field: readings[ont['ont_id']].get(field) for field in OPTICAL_FIELDS},
+                        "updated_at": fetched_at
+                    }}})
+                    for ont in onts
+                ], ordered=False)
+                await optical_history.record(
+                    device_id, [(ont['id'], readings[ont['ont_id']]) for ont in onts], fetched_at
+                )
+        return readings
     
+    def store(self, device_id: str, frame: int, board: int, port: int, readings: Dict[int, Dict[str, Any]]):
+        """Cache readings collected elsewhere (e.g. by the status poller)"""
+        self._cache[(device_id, frame, board, port)] = (time.monotonic(), readings)
+    
+    def forget_device(self, device_id: str):
+        for key in [key for key in self._cache if key[0] == device_id]:
+            del self._cache[key]
+
+optical_info_service = OpticalInfoService()
+
+@api_router.get("/ont/optical/{device_id}")
+async def get_port_optical_info(device_id: str, frame: int, board: int, port: int,
+                                max_age: float = OPTICAL_CACHE_TTL, board_type: str = "gpon"):
+    """Optical readings for every ONT on a port; max_age=0 forces a fresh query"""
+    readings = optical_info_service.cached(device_id, frame, board, port, max_age)
+    if readings is None:
+        if not telnet_manager.is_connected(device_id):
+            raise HTTPException(status_code=400, detail="Device not connected")
+        readings = await optical_info_service.get_port(device_id, frame, board, port, max_age, board_type)
+    return {
+        "device_id": device_id,
+        "frame": frame,
+        "board": board,
+        "port": port,
+        "onts": sorted(readings.values(), key=lambda reading: reading['ont_id'])
+    }
+
+def registration_optical_info(device_id: str, frame: int, board: int, port: int, ont_id: int,
+                              board_type: str = "gpon") -> Dict[str, Any]:
+    """
+    Optical info for a just-registered ONT from the port cache. A fresh ONT
+    has no levels until it has ranged, so the port is refreshed in the
+    background after OPTICAL_RANGING_DELAY and the reading lands on the ONT
+    record then.
+    """
+    readings = optical_info_service.cached(device_id, frame, board, port) or {}
+    if telnet_manager.is_connected(device_id):
+        optical_info_service.refresh_soon(device_id, frame, board, port, board_type, delay=OPTICAL_RANGING_DELAY)
     return {
-        "next_ont_id": next_id,
-        "used_count": len(used_ids),
-        "available_count": len(available_ids),
-        "available_ids": available_ids[:10]  # Return first 10 available
+        "rx_power": None,
+        **readings.get(ont_id, {}),
+        "frame": frame,
+        "board": board,
+        "port": port,
+        "ont_id": ont_id
     }
 
+# ==================== OPTICAL HISTORY ====================
+
+# Retention per resolution, in days
+OPTICAL_RAW_RETENTION_DAYS = int(os.environ.get('OPTICAL_RAW_RETENTION_DAYS', '7'))
+OPTICAL_5M_RETENTION_DAYS = int(os.environ.get('OPTICAL_5M_RETENTION_DAYS', '90'))
+OPTICAL_1H_RETENTION_DAYS = int(os.environ.get('OPTICAL_1H_RETENTION_DAYS', '730'))
+# Rollup resolutions: name -> (bucket seconds, retention days)
+OPTICAL_ROLLUPS = {
+    "5m": (300, OPTICAL_5M_RETENTION_DAYS),
+    "1h": (3600, OPTICAL_1H_RETENTION_DAYS),
+}
+# Longest range served from each resolution before stepping down to a coarser one
+OPTICAL_RESOLUTION_SPANS = [
+    ("raw", timedelta(days=1)),
+    ("5m", timedelta(days=14)),
+    ("1h", None),
+]
+OPTICAL_HISTORY_MAX_POINTS = 20000
+
+def bucket_start(timestamp: datetime, seconds: int) -> datetime:
+    epoch = int(timestamp.timestamp())
+    return datetime.fromtimestamp(epoch - epoch % seconds, tz=timezone.utc)
+
+class OpticalHistory:
+    """
+    Optical samples per ONT record, stored as bucketed documents:
+    `optical_samples` holds one document per ONT per hour with the raw
+    samples pushed into it, and `optical_rollups` holds min/max/sum/count per
+    field for 5-minute and hourly buckets, maintained with $min/$max/$inc
+    upserts as samples arrive. Every document carries its own expires_at so
+    a TTL index applies the retention of its resolution.
+    """
+    
+    async def record(self, device_id: str, samples: List[tuple], timestamp: datetime):
+        """Store (ont record id, reading) samples taken at `timestamp`"""
+        operations_raw = []
+        operations_rollup = []
+        hour = bucket_start(timestamp, 3600)
+        for ont_record_id, reading in samples:
+            values = {field: reading.get(field) for field in OPTICAL_FIELDS if reading.get(field) is not None}
+            if not values:
+                continue  # Offline ONT: nothing measured
+            operations_raw.append(UpdateOne(
+                {"_id": f"{ont_record_id}:{int(hour.timestamp())}"},
+                {
+                    "$setOnInsert": {
+                        "ont": ont_record_id, "device_id": device_id, "start": hour,
+                        "expires_at": hour + timedelta(days=OPTICAL_RAW_RETENTION_DAYS, hours=1)
+                    },
+                    "$push": {"samples": {"t": timestamp, **values}},
+                    "$inc": {"count": 1}
+                },
+                upsert=True
+            ))
+            for resolution, (seconds, retention_days) in OPTICAL_ROLLUPS.items():
+                start = bucket_start(timestamp, seconds)
+                update: Dict[str, Dict[str, Any]] = {
+                    "$setOnInsert": {
+                        "ont": ont_record_id, "device_id": device_id, "resolution": resolution, "start": start,
+                        "expires_at": start + timedelta(days=retention_days, seconds=seconds)
+                    },
+                    "$min": {}, "$max": {}, "$inc": {}
+                }
+                for field, value in values.items():
+                    update["$min"][f"{field}.min"] = value
+                    update["$max"][f"{field}.max"] = value
+                    update["$inc"][f"{field}.sum"] = value
+                    update["$inc"][f"{field}.n"] = 1
+                operations_rollup.append(UpdateOne(
+                    {"_id": f"{ont_record_id}:{resolution}:{int(start.timestamp())}"}, update, upsert=True
+                ))
+        try:
+            if operations_raw:
+                await db.optical_samples.bulk_write(operations_raw, ordered=False)
+            if operations_rollup:
+                await db.optical_rollups.bulk_write(operations_rollup, ordered=False)
+        except Exception as e:
+            # History is best effort; never fail the poll or query that produced it
+            logger.error(f"Failed to record optical history for {device_id}: {e}")
+    
+    @staticmethod
+    def pick_resolution(since: datetime, until: datetime) -> str:
+        """Finest resolution whose span covers the range and whose retention still reaches `since`"""
+        now = datetime.now(timezone.utc)
+        retention = {"raw": OPTICAL_RAW_RETENTION_DAYS, **{name: days for name, (_, days) in OPTICAL_ROLLUPS.items()}}
+        for resolution, span in OPTICAL_RESOLUTION_SPANS:
+            if span is not None and until - since > span:
+                continue
+            if since < now - timedelta(days=retention[resolution]) and resolution != "1h":
+                continue
+            return resolution
+        return "1h"
+    
+    async def query(self, ont_record_id: str, since: datetime, until: datetime, resolution: str) -> List[Dict[str, Any]]:
+        if resolution == "raw":
+            buckets = await db.optical_samples.find(
+                {"ont": ont_record_id, "start": {"$gte": bucket_start(since, 3600), "$lt": until}},
+                {"_id": 0, "samples": 1}
+            ).sort("start", ASCENDING).to_list(None)
+            return [
+                sample for bucket in buckets for sample in bucket['samples']
+                if since <= sample['t'] < until
+            ][:OPTICAL_HISTORY_MAX_POINTS]
+        
+        rollups = await db.optical_rollups.find(
+            {"ont": ont_record_id, "resolution": resolution, "start": {"$gte": since, "$lt": until}},
+            {"_id": 0, "start": 1, **{field: 1 for field in OPTICAL_FIELDS}}
+        ).sort("start", ASCENDING).limit(OPTICAL_HISTORY_MAX_POINTS).to_list(OPTICAL_HISTORY_MAX_POINTS)
+        points = []
+        for rollup in rollups:
+            point: Dict[str, Any] = {"t": rollup['start']}
+            for field in OPTICAL_FIELDS:
+                stats = rollup.get(field)
+                if stats and stats.get('n'):
+                    point[field] = {
+                        "min": stats['min'],
+                        "avg": round(stats['sum'] / stats['n'], 3),
+                        "max": stats['max']
+                    }
+            points.append(point)
+        return points
+
+optical_history = OpticalHistory()
+
+@api_router.get("/ont/{ont_id}/optical-history")
+async def get_optical_history(ont_id: str, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                              resolution: str = "auto"):
+    """
+    Optical history of one ONT record. Defaults to the last 24 hours.
+    resolution=auto picks raw samples for short ranges and 5-minute or hourly
+    min/avg/max rollups for longer ones.
+    """
+    window = time_range(since, until)
+    until = window.get("$lt") or datetime.now(timezone.utc)
+    since = window.get("$gte") or until - timedelta(days=1)
+    if since >= until:
+        raise HTTPException(status_code=400, detail="since must be before until")
+    if resolution == "auto":
+        resolution = optical_history.pick_resolution(since, until)
+    elif resolution != "raw" and resolution not in OPTICAL_ROLLUPS:
+        raise HTTPException(status_code=400, detail="resolution must be auto, raw, 5m or 1h")
+    
+    points = await optical_history.query(ont_id, since, until, resolution)
+    return {"ont_id": ont_id, "since": since, "until": until, "resolution": resolution, "points": points}
+
+@api_router.get("/ont/next-id/{device_id}")
+async def get_next_ont_id(device_id: str, frame: int = 0, board: int = 1, port: int = 3,
+                          board_type: Optional[str] = None):
+    """
+    Get next available ONT ID for a specific port.
+    Returns the lowest ONT ID that hasn't been used, without reserving it.
+    """
+    return await ont_id_allocator.peek(device_id, frame, board, port, board_type)
+
+def build_registration_code(registration_rule: str, board: int, port: int, ont_id: int) -> str:
+    return registration_rule.replace('(B)', str(board)).replace('(P)', str(port)).replace('(O)', str(ont_id))
+
+def build_registration_commands(frame: int, board: int, port: int, ont_id: int, serial_number: str,
+                                line_profile_id: int, service_profile_id: int, vlan: str, gemport: str,
+                                service_port_index: int, description: str = "") -> List[str]:
+    """Build the "ont add" command followed by one service-port command per gemport"""
+    cmd = f"ont add {frame}/{board}/{port} {ont_id} sn-auth \"{serial_number}\" omci ont-lineprofile-id {line_profile_id} ont-srvprofile-id {service_profile_id}"
+    if description:
+        cmd += f" desc \"{description}\""
+    commands = [cmd]
+    
+    # Parse VLANs (support comma-separated)
+    vlans = [v.strip() for v in vlan.split(',')]
+    gemports = [g.strip() for g in gemport.split(',')]
+    
+    # If single VLAN but multiple gemports, use same VLAN for all
+    if len(vlans) == 1 and len(gemports) > 1:
+        vlans = vlans * len(gemports)
+    
+    # Create service ports with VLAN mapping
+    for idx, gp in enumerate(gemports):
+        sp_idx = service_port_index + idx
+        vlan_id = vlans[idx] if idx < len(vlans) else vlans[0]
+        commands.append(f"service-port {sp_idx} vlan {vlan_id} gpon {frame}/{board}/{port} ont {ont_id} gemport {gp} multi-service user-vlan {vlan_id} tag-transform translate")
+    
+    return commands
+
+def build_rollback_commands(frame: int, board: int, port: int, ont_id: int, service_port_index: int,
+                            service_port_count: int, board_type: str = "gpon") -> List[str]:
+    """Undo a partly applied registration: service ports first, the OLT refuses to delete an ONT that has any"""
+    interface = "epon" if board_type == "epon" else "gpon"
+    commands = [f"undo service-port {index}" for index in range(service_port_index, service_port_index + service_port_count)]
+    commands += [f"interface {interface} {frame}/{board}", f"ont delete {port} {ont_id}", "quit"]
+    return commands
+
+async def rollback_registration(doc: Dict[str, Any]):
+    """Remove a registration that never made it onto the OLT from inventory and the allocators"""
+    await db.ont_devices.delete_one({"id": doc['id']})
+    await ont_id_allocator.release(doc['olt_device_id'], doc['frame'], doc['board'], doc['port'], doc['ont_id'],
+                                   board_type=doc.get('board_type'))
+    await service_port_allocator.release(doc['olt_device_id'], doc['service_port_index'], doc['service_port_count'])
+    autofind_watcher.note_removed(doc['olt_device_id'], doc['serial_number'])
+
+async def provision_registration(doc: Dict[str, Any]) -> Tuple[str, str]:
+    """
+    Run a stored registration on the OLT: "ont add", then its service ports.
+    Returns (outcome, message), outcome being "registered", "rolled_back" or
+    "unconfirmed". Only a registration whose "ont add" the OLT refused is
+    rolled back, since nothing of it can be on the OLT. After any other
+    failure (queue full, timeout, a service port refused and the undo
+    script run) the OLT state is unknown: the record keeps its ONT ID and
+    service ports and is flagged needs_reconcile instead.
+    """
+    device_id = doc['olt_device_id']
+    # Note: DBA Profile sudah included dalam Line Profile
+    # Tidak perlu execute "ont dba-profile" terpisah
+    commands = build_registration_commands(
+        doc['frame'], doc['board'], doc['port'], doc['ont_id'], doc['serial_number'],
+        doc['line_profile_id'], doc['service_profile_id'],
+        doc['vlan'], doc['gemport'], doc['service_port_index'], doc['description']
+    )
+    # Runs only if "ont add" went through and a later command failed
+    rollback = build_rollback_commands(
+        doc['frame'], doc['board'], doc['port'], doc['ont_id'],
+        doc['service_port_index'], doc['service_port_count'], doc['board_type']
+    )
+    success, status, results = await telnet_manager.send_batch(
+        device_id, commands, priority=PRIORITY_BULK, cleanup=rollback, pipeline_after=1
+    )
+    await command_log_writer.write(device_id, results)
+    if success:
+        return "registered", "ONT registered"
+    
+    failed = next((r for r in results if r['status'] != "success"), None)
+    message = f"{failed['command']}: {failed['response']}".strip() if failed else status
+    logger.warning(f"Registration of {doc['serial_number']} on {device_id} failed: {message}")
+    ont_add = results[0] if results else None
+    if ont_add and ont_add['status'] == "error" and COMMAND_ERROR_PATTERN.search(ont_add['response']):
+        await rollback_registration(doc)
+        return "rolled_back", f"{message}; registration rolled back"
+    await db.ont_devices.update_one({"id": doc['id']}, {"$set": {"needs_reconcile": True}})
+    doc['needs_reconcile'] = True
+    return "unconfirmed", f"{message}; kept for reconciliation"
+
 @api_router.post("/ont", response_model=ONTDevice)
 async def create_ont(input: ONTDeviceCreate, current_user: User = Depends(require_permission("ont_management_register"))):
+    """
+    Register an ONT and, when the OLT is connected, provision it: "ont add"
+    in one round-trip, then all of its service ports in one write.
+    If the OLT refuses "ont add" the registration is rolled back and 502
+    returned; see provision_registration for the other failures.
+    """
     # Generate registration code
     device = await db.olt_devices.find_one({"id": input.olt_device_id})
     if not device:
@@ -864,147 +2924,220 @@ async def create_ont(input: ONTDeviceCreate, current_user: User = Depends(requir
     
     config = await db.olt_configurations.find_one({"device_id": input.olt_device_id})
     
-    # Auto-increment ONT ID if set to -1 (auto mode)
+    # Auto-increment ONT ID if set to -1 (auto mode), otherwise reserve the given ID
     ont_id = input.ont_id
-    if ont_id == -1:
-        # Get next available ONT ID
-        next_id_data = await get_next_ont_id(
-            input.olt_device_id, 
-            input.frame, 
-            input.board, 
-            input.port
-        )
-        ont_id = next_id_data["next_ont_id"]
+    try:
+        if ont_id == -1:
+            ont_id = (await ont_id_allocator.allocate(
+                input.olt_device_id, input.frame, input.board, input.port, board_type=input.board_type
+            ))[0]
+        else:
+            await ont_id_allocator.reserve(
+                input.olt_device_id, input.frame, input.board, input.port, ont_id, board_type=input.board_type
+            )
+    except OntIdAllocationError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    board_type = input.board_type or await ont_id_allocator.port_board_type(
+        input.olt_device_id, input.frame, input.board, input.port
+    )
+    
+    # One service-port index per gemport, as a contiguous range
+    service_port_count = len(input.gemport.split(','))
+    try:
+        if input.service_port_index == -1:
+            service_port_index = await service_port_allocator.allocate(input.olt_device_id, service_port_count)
+        else:
+            service_port_index = await service_port_allocator.reserve(
+                input.olt_device_id, input.service_port_index, service_port_count
+            )
+    except ServicePortAllocationError as e:
+        await ont_id_allocator.release(input.olt_device_id, input.frame, input.board, input.port, ont_id)
+        raise HTTPException(status_code=409, detail=str(e))
     
     registration_rule = config.get('registration_rule', '0-(B)-(P)-(O)') if config else '0-(B)-(P)-(O)'
-    registration_code = registration_rule.replace('(B)', str(input.board)).replace('(P)', str(input.port)).replace('(O)', str(ont_id))
+    registration_code = build_registration_code(registration_rule, input.board, input.port, ont_id)
     
     ont_dict = input.model_dump()
     ont_dict['ont_id'] = ont_id  # Use auto-generated or provided ID
+    ont_dict['service_port_index'] = service_port_index
+    ont_dict['service_port_count'] = service_port_count
     ont_dict['registration_code'] = registration_code
+    ont_dict['board_type'] = board_type
     ont_dict['registered_by'] = current_user.full_name  # Auto-fill from logged user
     ont_obj = ONTDevice(**ont_dict)
     
     doc = ont_obj.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
     
-    await db.ont_devices.insert_one(doc)
+    try:
+        await db.ont_devices.insert_one(doc)
+    except DuplicateKeyError:
+        await ont_id_allocator.release(input.olt_device_id, input.frame, input.board, input.port, ont_id)
+        await service_port_allocator.release(input.olt_device_id, service_port_index, service_port_count)
+        raise HTTPException(status_code=409, detail="ONT already registered")
+    autofind_watcher.note_registered(input.olt_device_id, input.serial_number)
     
-    # Execute registration command if connected
-    generated_commands = []
+    # Provision on the OLT if connected; a rejected "ont add" undoes the registration
     if telnet_manager.is_connected(input.olt_device_id):
-        try:
-            cmd = f"ont add {input.frame}/{input.board}/{input.port} {ont_id} sn-auth \"{input.serial_number}\" omci ont-lineprofile-id {input.line_profile_id} ont-srvprofile-id {input.service_profile_id}"
-            if input.description:
-                cmd += f" desc \"{input.description}\""
-            generated_commands.append(cmd)
-            print(f"\n{'='*80}")
-            print(f"📋 COMMAND 1 - ONT Registration:")
-            print(f"{'='*80}")
-            print(cmd)
-            await telnet_manager.send_command(input.olt_device_id, cmd)
-            
-            # Note: DBA Profile sudah included dalam Line Profile
-            # Tidak perlu execute "ont dba-profile" terpisah
-            
-            # Get service-port index
-            if input.service_port_index == -1:
-                # Auto-generate: count existing service ports
-                existing_ports = await db.ont_devices.count_documents({})
-                service_port_index = existing_ports + 1
-            else:
-                service_port_index = input.service_port_index
-            
-            # Save service_port_index to ONT record
-            ont_dict['service_port_index'] = service_port_index
-            
-            # Parse VLANs (support comma-separated)
-            vlans = [v.strip() for v in input.vlan.split(',')]
-            gemports = [g.strip() for g in input.gemport.split(',')]
-            
-            # If single VLAN but multiple gemports, use same VLAN for all
-            if len(vlans) == 1 and len(gemports) > 1:
-                vlans = vlans * len(gemports)
-            
-            # Create service ports with VLAN mapping
-            print(f"\n{'='*80}")
-            print(f"📋 COMMAND 2+ - Service Port Configuration:")
-            print(f"{'='*80}")
-            for idx, gp in enumerate(gemports):
-                sp_idx = service_port_index + idx
-                vlan_id = vlans[idx] if idx < len(vlans) else vlans[0]
-                
-                sp_cmd = f"service-port {sp_idx} vlan {vlan_id} gpon {input.frame}/{input.board}/{input.port} ont {ont_id} gemport {gp} multi-service user-vlan {vlan_id} tag-transform translate"
-                generated_commands.append(sp_cmd)
-                print(f"Command {idx + 2}: {sp_cmd}")
-                await telnet_manager.send_command(input.olt_device_id, sp_cmd)
-            print(f"{'='*80}\n")
-        except Exception as e:
-            print(f"Registration command failed: {e}")
+        outcome, message = await provision_registration(doc)
+        if outcome == "rolled_back":
+            raise HTTPException(status_code=502, detail=message)
     
-    # Get optical info after registration
-    optical_info = None
-    if telnet_manager.is_connected(input.olt_device_id):
-        try:
-            # Execute command: display ont optical-info <ont-id> <board>
-            optical_cmd = f"display ont optical-info {ont_id} {input.board}"
-            print(f"\n📡 Getting optical info: {optical_cmd}")
-            
-            optical_output = await telnet_manager.send_command(input.olt_device_id, optical_cmd)
-            
-            # Parse optical power from output
-            rx_power = None
-            if optical_output and "Rx optical power" in optical_output:
-                for line in optical_output.split('\n'):
-                    if "Rx optical power" in line:
-                        # Extract value: "Rx optical power(dBm)           : -2.60"
-                        parts = line.split(':')
-                        if len(parts) > 1:
-                            rx_power = parts[1].strip()
-                            print(f"✅ Rx Optical Power: {rx_power} dBm")
-                            break
-            
-            optical_info = {
-                "rx_power": rx_power,
-                "frame": input.frame,
-                "board": input.board,
-                "port": input.port,
-                "ont_id": ont_id
-            }
-        except Exception as e:
-            print(f"Failed to get optical info: {e}")
+    # Optical info comes from the port-wide cache
+    optical_info = registration_optical_info(
+        input.olt_device_id, input.frame, input.board, input.port, ont_id, board_type
+    )
     
     # Add optical info to response
-    response = ont_obj.model_dump()
+    response = {**ont_obj.model_dump(), 'needs_reconcile': doc.get('needs_reconcile', False)}
     response['optical_info'] = optical_info
     
     return response
 
-@api_router.get("/ont", response_model=List[ONTDevice])
-async def get_ont_devices():
-    onts = await db.ont_devices.find({}, {"_id": 0}).to_list(1000)
+ONT_PAGE_MAX = 5000
+
+def json_default(value):
+    """json.dumps fallback for values Mongo hands back"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def time_range(since: Optional[datetime], until: Optional[datetime]) -> Dict[str, datetime]:
+    """Mongo range clause for a [since, until) window; naive values are taken as UTC"""
+    window = {}
+    if since is not None:
+        window["$gte"] = since if since.tzinfo else since.replace(tzinfo=timezone.utc)
+    if until is not None:
+        window["$lt"] = until if until.tzinfo else until.replace(tzinfo=timezone.utc)
+    return window
+
+def build_ont_query(device_id: Optional[str], frame: Optional[int], board: Optional[int], port: Optional[int],
+                    status: Optional[str], serial_prefix: Optional[str], vlan: Optional[str],
+                    registered_by: Optional[str], cursor: Optional[str],
+                    created_since: Optional[datetime] = None,
+                    created_until: Optional[datetime] = None) -> Dict[str, Any]:
+    query: Dict[str, Any] = {}
+    if device_id:
+        query["olt_device_id"] = device_id
+    if frame is not None:
+        query["frame"] = frame
+    if board is not None:
+        query["board"] = board
+    if port is not None:
+        query["port"] = port
+    if status:
+        query["status"] = status
+    if serial_prefix:
+        # Anchored prefix match can use the serial_number index
+        query["serial_number"] = {"$regex": f"^{re.escape(serial_prefix)}"}
+    if vlan:
+        # vlan holds a comma-separated list
+        query["vlan"] = {"$regex": f"(^|,)\\s*{re.escape(vlan)}\\s*(,|$)"}
+    if registered_by:
+        query["registered_by"] = registered_by
+    created_range = time_range(created_since, created_until)
+    if created_range:
+        query["created_at"] = created_range
+    if cursor:
+        try:
+            query["_id"] = {"$gt": ObjectId(cursor)}
+        except InvalidId:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    return query
+
+async def list_onts(query: Dict[str, Any], limit: Optional[int], format: str):
+    """
+    Keyset-paginated ONT listing in insertion order.
+    With `limit` a page is returned and X-Next-Cursor carries the cursor of the
+    next page; without it every match is streamed straight from the cursor.
+    `format=ndjson` streams one JSON document per line.
+    """
+    if limit is not None:
+        limit = max(1, min(limit, ONT_PAGE_MAX))
+    cursor = db.ont_devices.find(query).sort("_id", ASCENDING)
     
-    for ont in onts:
-        if isinstance(ont.get('created_at'), str):
-            ont['created_at'] = datetime.fromisoformat(ont['created_at'])
+    if format == "ndjson":
+        if limit is not None:
+            cursor = cursor.limit(limit)
+        
+        async def stream_lines():
+            async for ont in cursor:
+                ont.pop('_id')
+                yield json.dumps(ont, default=json_default) + '\n'
+        
+        return StreamingResponse(stream_lines(), media_type="application/x-ndjson")
     
-    return onts
-
-@api_router.get("/ont/device/{device_id}", response_model=List[ONTDevice])
-async def get_ont_by_device(device_id: str):
-    onts = await db.ont_devices.find({"olt_device_id": device_id}, {"_id": 0}).to_list(1000)
+    if limit is None:
+        async def stream_array():
+            first = True
+            async for ont in cursor:
+                ont.pop('_id')
+                yield ('[' if first else ',') + json.dumps(ont, default=json_default)
+                first = False
+            yield '[]' if first else ']'
+        
+        return StreamingResponse(stream_array(), media_type="application/json")
     
+    onts = await cursor.limit(limit + 1).to_list(limit + 1)
+    headers = {}
+    if len(onts) > limit:
+        onts = onts[:limit]
+        headers["X-Next-Cursor"] = str(onts[-1]['_id'])
     for ont in onts:
-        if isinstance(ont.get('created_at'), str):
-            ont['created_at'] = datetime.fromisoformat(ont['created_at'])
-    
-    return onts
+        ont.pop('_id')
+    return Response(content=json.dumps(onts, default=json_default), media_type="application/json", headers=headers)
+
+@api_router.get("/ont")
+async def get_ont_devices(
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    frame: Optional[int] = None,
+    board: Optional[int] = None,
+    port: Optional[int] = None,
+    status: Optional[str] = None,
+    serial_prefix: Optional[str] = None,
+    vlan: Optional[str] = None,
+    registered_by: Optional[str] = None,
+    created_since: Optional[datetime] = None,
+    created_until: Optional[datetime] = None,
+    format: str = "json"
+):
+    query = build_ont_query(None, frame, board, port, status, serial_prefix, vlan, registered_by, cursor,
+                            created_since, created_until)
+    return await list_onts(query, limit, format)
+
+@api_router.get("/ont/device/{device_id}")
+async def get_ont_by_device(
+    device_id: str,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    frame: Optional[int] = None,
+    board: Optional[int] = None,
+    port: Optional[int] = None,
+    status: Optional[str] = None,
+    serial_prefix: Optional[str] = None,
+    vlan: Optional[str] = None,
+    registered_by: Optional[str] = None,
+    created_since: Optional[datetime] = None,
+    created_until: Optional[datetime] = None,
+    format: str = "json"
+):
+    query = build_ont_query(device_id, frame, board, port, status, serial_prefix, vlan, registered_by, cursor,
+                            created_since, created_until)
+    return await list_onts(query, limit, format)
 
 @api_router.delete("/ont/{ont_id}")
 async def delete_ont(ont_id: str):
-    result = await db.ont_devices.delete_one({"id": ont_id})
-    if result.deleted_count == 0:
+    ont = await db.ont_devices.find_one_and_delete({"id": ont_id}, {"_id": 0})
+    if not ont:
         raise HTTPException(status_code=404, detail="ONT not found")
+    
+    await ont_id_allocator.release(ont['olt_device_id'], ont['frame'], ont['board'], ont['port'], ont['ont_id'],
+                                   board_type=ont.get('board_type'))
+    if ont.get('service_port_count'):
+        await service_port_allocator.release(ont['olt_device_id'], ont['service_port_index'], ont['service_port_count'])
+    autofind_watcher.note_removed(ont['olt_device_id'], ont['serial_number'])
     return {"message": "ONT deleted successfully"}
 
 # ==================== AUTO-DETECT ONT ====================
@@ -1017,6 +3150,48 @@ class DetectedONT(BaseModel):
     ont_id: int
     detected_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+async def annotate_detected_onts(device_id: str, detected_onts: List[Dict[str, Any]]):
+    """
+    Mark each autofind entry as registered or not, with one $in query on
+    serial numbers instead of a lookup per entry. Unregistered entries get
+    the ONT ID and service-port range registration would use right now
+    (suggestions only, nothing is reserved).
+    """
+    serials = set()
+    for ont in detected_onts:
+        serials.add(ont['serial_number'])
+        if ont.get('sn_hex'):
+            serials.add(ont['sn_hex'])
+    registered = await db.ont_devices.find(
+        {"olt_device_id": device_id, "serial_number": {"$in": list(serials)}}, {"_id": 0}
+    ).to_list(None)
+    by_serial = {ont['serial_number'].upper(): ont for ont in registered}
+    
+    config = await db.olt_configurations.find_one({"device_id": device_id}, {"_id": 0, "gemport": 1}) or {}
+    service_port_count = len(config.get('gemport', '1').split(','))
+    
+    unregistered_by_port: Dict[tuple, List[Dict[str, Any]]] = {}
+    for ont in detected_onts:
+        existing = by_serial.get(ont['serial_number'].upper()) or by_serial.get((ont.get('sn_hex') or '').upper())
+        ont['registered'] = existing is not None
+        ont['existing'] = existing
+        ont['ont_id'] = existing['ont_id'] if existing else -1  # -1 = auto-assign
+        ont['service_port_index'] = existing.get('service_port_index') if existing else None
+        ont['service_port_count'] = existing.get('service_port_count') if existing else service_port_count
+        if not existing:
+            unregistered_by_port.setdefault((ont['frame'], ont['board'], ont['port']), []).append(ont)
+    
+    for (frame, board, port), onts in unregistered_by_port.items():
+        ont_ids = await ont_id_allocator.suggest(device_id, frame, board, port, len(onts))
+        for ont, ont_id in zip(onts, ont_ids):
+            ont['ont_id'] = ont_id
+    # Service-port ranges in autofind order, the order bulk registration allocates them in
+    unregistered = [ont for ont in detected_onts if not ont['registered']]
+    if unregistered:
+        starts = await service_port_allocator.suggest_many(device_id, [service_port_count] * len(unregistered))
+        for ont, start in zip(unregistered, starts):
+            ont['service_port_index'] = start
+
 @api_router.post("/ont/detect/{device_id}")
 async def detect_unauthorized_onts(device_id: str):
     """
@@ -1041,64 +3216,15 @@ async def detect_unauthorized_onts(device_id: str):
             raise HTTPException(status_code=500, detail="Failed to detect ONTs")
         
         # Parse response to extract ONT information for Huawei MA5683T format
-        detected_onts = []
-        lines = response.split('\n')
-        
-        current_ont = {}
-        for line in lines:
-            line = line.strip()
-            
-            # Check for F/S/P line
-            if 'F/S/P' in line and ':' in line:
-                fsp_value = line.split(':', 1)[1].strip()
-                if '/' in fsp_value:
-                    fsp = fsp_value.split('/')
-                    if len(fsp) == 3:
-                        try:
-                            current_ont['frame'] = int(fsp[0])
-                            current_ont['board'] = int(fsp[1])
-                            current_ont['port'] = int(fsp[2])
-                        except ValueError:
-                            pass
-            
-            # Check for Serial Number line
-            elif 'Ont SN' in line and ':' in line:
-                sn_value = line.split(':', 1)[1].strip()
-                # Extract SN from format: "485754439F3887B1 (HWTC-9F3887B1)"
-                if '(' in sn_value:
-                    sn_readable = sn_value.split('(')[1].split(')')[0]
-                    current_ont['serial_number'] = sn_readable
-                else:
-                    current_ont['serial_number'] = sn_value.split()[0] if sn_value else "UNKNOWN"
-            
-            # Check for VendorID
-            elif 'VendorID' in line and ':' in line:
-                vendor = line.split(':', 1)[1].strip()
-                current_ont['vendor_id'] = vendor
-            
-            # Check for EquipmentID (model)
-            elif 'Ont EquipmentID' in line and ':' in line:
-                model = line.split(':', 1)[1].strip()
-                current_ont['model'] = model
-            
-            # When we hit separator line, save current ONT
-            elif '---' in line and current_ont:
-                if 'serial_number' in current_ont and 'frame' in current_ont:
-                    current_ont['ont_id'] = 0  # Will be assigned during registration
-                    current_ont['detected_at'] = datetime.now(timezone.utc).isoformat()
-                    detected_onts.append(current_ont.copy())
-                current_ont = {}
-        
-        # Add last ONT if exists
-        if current_ont and 'serial_number' in current_ont and 'frame' in current_ont:
-            current_ont['ont_id'] = 0
-            current_ont['detected_at'] = datetime.now(timezone.utc).isoformat()
-            detected_onts.append(current_ont.copy())
+        detected_at = datetime.now(timezone.utc)
+        detected_onts = [{**ont, "detected_at": detected_at} for ont in parse_autofind(response)]
+        await annotate_detected_onts(device_id, detected_onts)
         
         return {
             "success": True,
             "device_id": device_id,
             "detected_count": len(detected_onts),
+            "unregistered_count": sum(1 for ont in detected_onts if not ont['registered']),
             "onts": detected_onts,
             "raw_response": response
         }
@@ -1147,7 +3273,9 @@ async def simulate_detect_onts(device_id: str):
 async def auto_register_detected_ont(device_id: str, ont_data: Dict[str, Any], current_user: User = Depends(require_permission("ont_management_register"))):
     """
     Auto-register a detected ONT.
-    Takes detected ONT info and registers it in the system.
+    Takes detected ONT info and registers it in the system, provisioning it
+    like create_ont ("ont add", then all service ports in one write).
+    A rejected "ont add" rolls the registration back (see provision_registration).
     """
     device = await db.olt_devices.find_one({"id": device_id}, {"_id": 0})
     if not device:
@@ -1157,26 +3285,89 @@ async def auto_register_detected_ont(device_id: str, ont_data: Dict[str, Any], c
     if not config:
         raise HTTPException(status_code=404, detail="Configuration not found for device")
     
+    # Check if ONT already exists
+    existing = await db.ont_devices.find_one({
+        "olt_device_id": device_id,
+        "serial_number": ont_data['serial_number']
+    }, {"_id": 0})
+    
+    if existing:
+        return {
+            "success": False,
+            "message": "ONT already registered",
+            "ont": existing
+        }
+    
+    # Detected entries only carry a suggested ONT ID: keep it if still free,
+    # otherwise take the next free one on the port
+    board_type = ont_data.get('board_type')
+    ont_id = ont_data.get('ont_id', -1)
+    try:
+        if ont_id != -1:
+            try:
+                await ont_id_allocator.reserve(
+                    device_id, ont_data['frame'], ont_data['board'], ont_data['port'], ont_id, board_type=board_type
+                )
+            except OntIdAllocationError:
+                ont_id = -1
+        if ont_id == -1:
+            ont_id = (await ont_id_allocator.allocate(
+                device_id, ont_data['frame'], ont_data['board'], ont_data['port'], board_type=board_type
+            ))[0]
+    except OntIdAllocationError as e:
+        return {
+            "success": False,
+            "message": str(e)
+        }
+    ont_data['ont_id'] = ont_id
+    board_type = board_type or await ont_id_allocator.port_board_type(
+        device_id, ont_data['frame'], ont_data['board'], ont_data['port']
+    )
+    
     # Generate registration code
     registration_rule = config.get('registration_rule', '0-(B)-(P)-(O)')
-    registration_code = registration_rule.replace('(B)', str(ont_data['board'])).replace('(P)', str(ont_data['port'])).replace('(O)', str(ont_data['ont_id']))
+    registration_code = build_registration_code(registration_rule, ont_data['board'], ont_data['port'], ont_id)
     
-    # Get service VLAN from config
-    vlan = config.get('service_inner_vlan', 41)
+    # Get service VLAN, gemports and templates from config
+    vlan = str(ont_data.get('vlan') or config.get('service_inner_vlan', 41))
+    gemport = str(ont_data.get('gemport') or config.get('gemport', '1'))
+    line_profile_id = ont_data.get('line_profile_id') or config.get('g_line_template', 1)
+    service_profile_id = ont_data.get('service_profile_id') or config.get('g_service_template', 1)
+    
+    # One service-port index per gemport; keep the range suggested by detection if still free
+    service_port_count = len(gemport.split(','))
+    service_port_index = ont_data.get('service_port_index')
+    try:
+        if service_port_index is not None and service_port_index >= 0:
+            try:
+                await service_port_allocator.reserve(device_id, service_port_index, service_port_count)
+            except ServicePortAllocationError:
+                service_port_index = None
+        if service_port_index is None or service_port_index < 0:
+            service_port_index = await service_port_allocator.allocate(device_id, service_port_count)
+    except ServicePortAllocationError as e:
+        await ont_id_allocator.release(device_id, ont_data['frame'], ont_data['board'], ont_data['port'], ont_id)
+        return {
+            "success": False,
+            "message": str(e)
+        }
     
     # Create ONT entry
     ont_dict = {
         "olt_device_id": device_id,
-        "ont_id": ont_data['ont_id'],
+        "ont_id": ont_id,
         "serial_number": ont_data['serial_number'],
         "frame": ont_data['frame'],
         "board": ont_data['board'],
         "port": ont_data['port'],
-        "vlan": ont_data.get('vlan', str(vlan)),
-        "line_profile_id": ont_data.get('line_profile_id', 1),
-        "service_profile_id": ont_data.get('service_profile_id', 1),
-        "gemport": ont_data.get('gemport', '1'),
+        "vlan": vlan,
+        "line_profile_id": line_profile_id,
+        "service_profile_id": service_profile_id,
+        "gemport": gemport,
         "description": ont_data.get('description', ''),
+        "service_port_index": service_port_index,
+        "service_port_count": service_port_count,
+        "board_type": board_type,
         "registration_code": registration_code,
         "registered_by": current_user.full_name  # Auto-fill from logged user
     }
@@ -1184,97 +3375,811 @@ async def auto_register_detected_ont(device_id: str, ont_data: Dict[str, Any], c
     ont_obj = ONTDevice(**ont_dict)
     
     doc = ont_obj.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
     
-    # Check if ONT already exists
-    existing = await db.ont_devices.find_one({
-        "olt_device_id": device_id,
-        "serial_number": ont_data['serial_number']
-    })
-    
-    if existing:
+    try:
+        await db.ont_devices.insert_one(doc)
+    except DuplicateKeyError:
+        # Registered concurrently by someone else
+        await ont_id_allocator.release(device_id, ont_data['frame'], ont_data['board'], ont_data['port'], ont_id)
+        await service_port_allocator.release(device_id, service_port_index, service_port_count)
         return {
             "success": False,
-            "message": "ONT already registered",
-            "ont": existing
+            "message": "ONT already registered"
         }
     
-    await db.ont_devices.insert_one(doc)
+    autofind_watcher.note_registered(device_id, ont_data['serial_number'])
     
-    # If device is connected, execute registration command on OLT
+    # If device is connected, provision it the same way as create_ont
+    outcome, message = "registered", "ONT auto-registered successfully"
     if telnet_manager.is_connected(device_id) and config.get('auto_registration', True):
+        outcome, message = await provision_registration(doc)
+        if outcome == "rolled_back":
+            return {
+                "success": False,
+                "message": message
+            }
+        if outcome == "registered":
+            message = "ONT auto-registered successfully"
+    
+    # Optical info comes from the port-wide cache
+    optical_info = registration_optical_info(
+        device_id, ont_data['frame'], ont_data['board'], ont_data['port'], ont_id, board_type
+    )
+    
+    ont_response = {**ont_obj.model_dump(), 'needs_reconcile': doc.get('needs_reconcile', False)}
+    ont_response['optical_info'] = optical_info
+    
+    return {
+        "success": outcome == "registered",
+        "message": message,
+        "ont": ont_response
+    }
+
+class BulkRegisterItem(BaseModel):
+    olt_device_id: str
+    serial_number: str
+    frame: int
+    board: int
+    port: int
+    ont_id: int = -1  # -1 = auto-assign
+    vlan: Optional[str] = None  # Defaults come from the OLT configuration
+    gemport: Optional[str] = None
+    line_profile_id: Optional[int] = None
+    service_profile_id: Optional[int] = None
+    description: str = ""
+    board_type: Optional[str] = None  # None = the port's type
+
+class BulkRegisterRequest(BaseModel):
+    onts: List[BulkRegisterItem]
+
+async def register_onts(onts: List[BulkRegisterItem], registered_by: str, job_id: str) -> Dict[str, Any]:
+    """
+    Register many ONTs at once, possibly across several OLTs. ONT IDs and
+    service-port indexes are allocated in one pass, inventory is written with
+    a single insert_many, and the telnet batches run in parallel across OLTs
+    (in order within each OLT). Missing VLAN, gemport and profiles come from
+    each OLT's configuration. A registration whose "ont add" the OLT rejects
+    is rolled back so it can be retried; other failures keep the record,
+    flagged needs_reconcile (see provision_registration).
+    """
+    device_ids = list({item.olt_device_id for item in onts})
+    
+    devices = await db.olt_devices.find({"id": {"$in": device_ids}}, {"_id": 0, "id": 1}).to_list(len(device_ids))
+    known_devices = {device['id'] for device in devices}
+    configs = await db.olt_configurations.find({"device_id": {"$in": device_ids}}, {"_id": 0}).to_list(len(device_ids))
+    configs_by_device = {config['device_id']: config for config in configs}
+    
+    # Serials already in inventory, in one query
+    registered = await db.ont_devices.find(
+        {"olt_device_id": {"$in": device_ids}, "serial_number": {"$in": [item.serial_number for item in onts]}},
+        {"_id": 0, "olt_device_id": 1, "serial_number": 1}
+    ).to_list(None)
+    seen = {(ont['olt_device_id'], ont['serial_number']) for ont in registered}
+    
+    results: List[Dict[str, Any]] = []
+    to_register = []
+    for item in onts:
+        key = (item.olt_device_id, item.serial_number)
+        if item.olt_device_id not in known_devices:
+            results.append({"serial_number": item.serial_number, "olt_device_id": item.olt_device_id,
+                            "status": "failed", "message": "OLT Device not found"})
+        elif key in seen:
+            results.append({"serial_number": item.serial_number, "olt_device_id": item.olt_device_id,
+                            "status": "skipped", "message": "ONT already registered"})
+        else:
+            seen.add(key)
+            to_register.append(item)
+    
+    # ONT IDs: one allocator update per port for all auto-assigned ONTs on it
+    assigned_ids: Dict[int, int] = {}
+    id_errors: Dict[int, str] = {}
+    by_port: Dict[tuple, List[int]] = {}
+    for index, item in enumerate(to_register):
+        by_port.setdefault((item.olt_device_id, item.frame, item.board, item.port), []).append(index)
+    for (device_id, frame, board, port), indexes in by_port.items():
+        auto = []
+        for index in indexes:
+            item = to_register[index]
+            if item.ont_id == -1:
+                auto.append(index)
+                continue
+            try:
+                await ont_id_allocator.reserve(device_id, frame, board, port, item.ont_id, board_type=item.board_type)
+                assigned_ids[index] = item.ont_id
+            except OntIdAllocationError as e:
+                id_errors[index] = str(e)
+        if auto:
+            try:
+                ids = await ont_id_allocator.allocate(
+                    device_id, frame, board, port, count=len(auto), board_type=to_register[auto[0]].board_type
+                )
+            except OntIdAllocationError:
+                ids = []
+            assigned_ids.update(zip(auto, ids))
+            for index in auto[len(ids):]:
+                id_errors[index] = f"No free ONT ID on port {frame}/{board}/{port}"
+    
+    # Service-port ranges: one allocator update per OLT
+    gemports: Dict[int, str] = {}
+    service_port_starts: Dict[int, int] = {}
+    by_device: Dict[str, List[int]] = {}
+    for index, item in enumerate(to_register):
+        if index in assigned_ids:
+            gemports[index] = item.gemport or configs_by_device.get(item.olt_device_id, {}).get('gemport', '1')
+            by_device.setdefault(item.olt_device_id, []).append(index)
+    for device_id, indexes in by_device.items():
+        try:
+            starts = await service_port_allocator.allocate_many(
+                device_id, [len(gemports[index].split(',')) for index in indexes]
+            )
+            service_port_starts.update(zip(indexes, starts))
+        except ServicePortAllocationError as e:
+            for index in indexes:
+                item = to_register[index]
+                await ont_id_allocator.release(device_id, item.frame, item.board, item.port, assigned_ids.pop(index))
+                id_errors[index] = str(e)
+    
+    docs = []
+    for index, item in enumerate(to_register):
+        config = configs_by_device.get(item.olt_device_id, {})
+        if index in id_errors:
+            results.append({"serial_number": item.serial_number, "olt_device_id": item.olt_device_id,
+                            "status": "failed", "message": id_errors[index]})
+            continue
+        ont_id = assigned_ids[index]
+        
+        gemport = gemports[index]
+        
+        ont_obj = ONTDevice(
+            olt_device_id=item.olt_device_id,
+            ont_id=ont_id,
+            serial_number=item.serial_number,
+            registration_code=build_registration_code(
+                config.get('registration_rule', '0-(B)-(P)-(O)'), item.board, item.port, ont_id
+            ),
+            frame=item.frame,
+            board=item.board,
+            port=item.port,
+            vlan=item.vlan or str(config.get('service_inner_vlan', 41)),
+            line_profile_id=item.line_profile_id or config.get('g_line_template', 1),
+            service_profile_id=item.service_profile_id or config.get('g_service_template', 1),
+            gemport=gemport,
+            description=item.description,
+            service_port_index=service_port_starts[index],
+            service_port_count=len(gemport.split(',')),
+            board_type=item.board_type or await ont_id_allocator.port_board_type(
+                item.olt_device_id, item.frame, item.board, item.port
+            ),
+            registered_by=registered_by
+        )
+        docs.append(ont_obj.model_dump())
+    
+    if docs:
         try:
-            # Build registration command based on config
-            line_template = config.get('g_line_template', 1)
-            service_template = config.get('g_service_template', 1)
+            await db.ont_devices.insert_many([dict(doc) for doc in docs], ordered=False)
+        except BulkWriteError as e:
+            # Serials registered concurrently by someone else
+            duplicates = {error['index'] for error in e.details.get('writeErrors', [])}
+            for position in sorted(duplicates, reverse=True):
+                doc = docs.pop(position)
+                await ont_id_allocator.release(doc['olt_device_id'], doc['frame'], doc['board'], doc['port'], doc['ont_id'])
+                await service_port_allocator.release(doc['olt_device_id'], doc['service_port_index'], doc['service_port_count'])
+                results.append({"serial_number": doc['serial_number'], "olt_device_id": doc['olt_device_id'],
+                                "status": "skipped", "message": "ONT already registered"})
+        for doc in docs:
+            autofind_watcher.note_registered(doc['olt_device_id'], doc['serial_number'])
+    
+    total = len(onts)
+    for result in results:
+        manager.broadcast({"type": "bulk_register", "job_id": job_id, "total": total, **result})
+    
+    async def provision_device(device_id: str, device_docs: List[Dict[str, Any]]):
+        # One OLT session: keep registrations in order
+        for doc in device_docs:
+            result = {
+                "serial_number": doc['serial_number'],
+                "olt_device_id": device_id,
+                "ont_id": doc['ont_id'],
+                "frame": doc['frame'],
+                "board": doc['board'],
+                "port": doc['port'],
+                "service_port_index": doc['service_port_index']
+            }
+            if not telnet_manager.is_connected(device_id):
+                result.update(status="saved", message="Saved to inventory; OLT not connected")
+            else:
+                outcome, message = await provision_registration(doc)
+                if outcome == "registered":
+                    result.update(status="registered", message=message)
+                else:
+                    result.update(status="failed", message=message, rolled_back=outcome == "rolled_back",
+                                  needs_reconcile=outcome == "unconfirmed")
+            results.append(result)
+            manager.broadcast({"type": "bulk_register", "job_id": job_id, "total": total, **result})
+    
+    docs_by_device: Dict[str, List[Dict[str, Any]]] = {}
+    for doc in docs:
+        docs_by_device.setdefault(doc['olt_device_id'], []).append(doc)
+    await asyncio.gather(*[provision_device(device_id, device_docs) for device_id, device_docs in docs_by_device.items()])
+    
+    summary = {
+        "job_id": job_id,
+        "total": total,
+        "registered": sum(1 for r in results if r['status'] == "registered"),
+        "saved": sum(1 for r in results if r['status'] == "saved"),
+        "skipped": sum(1 for r in results if r['status'] == "skipped"),
+        "failed": sum(1 for r in results if r['status'] == "failed")
+    }
+    manager.broadcast({"type": "bulk_register_done", **summary})
+    
+    return {**summary, "results": results}
+
+@api_router.post("/ont/bulk-register")
+async def bulk_register_onts(input: BulkRegisterRequest, current_user: User = Depends(require_permission("ont_management_register"))):
+    """
+    Register many detected ONTs at once, possibly across several OLTs.
+    Per-ONT progress is broadcast on /ws as "bulk_register" events carrying
+    the returned job_id.
+    """
+    return await register_onts(input.onts, current_user.full_name, str(uuid.uuid4()))
+
+# ==================== ONT STATUS POLLER ====================
+
+ONT_POLL_ENABLED = os.environ.get('ONT_POLL_ENABLED', 'true').lower() == 'true'
+ONT_POLL_INTERVAL = float(os.environ.get('ONT_POLL_INTERVAL', '300'))
+# OLTs polled at the same time
+ONT_POLL_CONCURRENCY = int(os.environ.get('ONT_POLL_CONCURRENCY', '4'))
+# Optical drift below this (dB) is not worth a write
+OPTICAL_CHANGE_THRESHOLD = 0.5
+
+def optical_changed(old: Optional[Dict[str, Any]], new: Dict[str, Any]) -> bool:
+    if not old:
+        return any(new.get(field) is not None for field in OPTICAL_FIELDS)
+    for field in ("rx_power", "olt_rx_power"):
+        before, after = old.get(field), new.get(field)
+        if (before is None) != (after is None):
+            return True
+        if before is not None and abs(after - before) >= OPTICAL_CHANGE_THRESHOLD:
+            return True
+    return False
+
+class OntStatusPoller:
+    """
+    Polls run state and optical levels of every registered ONT on connected
+    OLTs every ONT_POLL_INTERVAL seconds. OLTs are spread evenly over the
+    interval and at most ONT_POLL_CONCURRENCY are polled at once. Each port
+    costs one bulk-priority job on the OLT (interface mode, `display ont info
+    P all`, `display ont optical-info P all`), so operator commands always go
+    first, and each OLT's changes land in one bulk_write.
+    """
+    
+    def __init__(self, telnet: TelnetConnection):
+        self.telnet = telnet
+        self._task: Optional[asyncio.Task] = None
+        self._semaphore = asyncio.Semaphore(ONT_POLL_CONCURRENCY)
+        self._polling: Dict[str, asyncio.Task] = {}
+        self.last_poll: Dict[str, Dict[str, Any]] = {}
+    
+    def start(self):
+        if ONT_POLL_ENABLED and self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        for task in list(self._polling.values()):
+            task.cancel()
+    
+    async def _run(self):
+        while True:
+            cycle_start = time.monotonic()
+            device_ids = sorted(self.telnet.connections)
+            if device_ids:
+                spacing = ONT_POLL_INTERVAL / len(device_ids)
+                await asyncio.gather(*[
+                    self._poll_later(device_id, index * spacing) for index, device_id in enumerate(device_ids)
+                ], return_exceptions=True)
+            await asyncio.sleep(max(1.0, ONT_POLL_INTERVAL - (time.monotonic() - cycle_start)))
+    
+    async def _poll_later(self, device_id: str, delay: float):
+        await asyncio.sleep(delay)
+        if self.telnet.is_connected(device_id):
+            await self.poll(device_id)
+    
+    def polling(self) -> List[str]:
+        """Devices with a poll in progress"""
+        return sorted(self._polling)
+    
+    async def poll(self, device_id: str) -> Dict[str, Any]:
+        """Poll one OLT now; joins a poll that is already running"""
+        task = self._polling.get(device_id)
+        if task is None:
+            task = asyncio.create_task(self._poll(device_id))
+            self._polling[device_id] = task
+            task.add_done_callback(lambda _: self._polling.pop(device_id, None))
+        # Shielded: a caller that gives up must not cancel the poll for the others
+        return await asyncio.shield(task)
+    
+    async def _poll(self, device_id: str) -> Dict[str, Any]:
+        async with self._semaphore:
+            started = time.monotonic()
+            onts = await db.ont_devices.find(
+                {"olt_device_id": device_id},
+                {"_id": 0, "id": 1, "frame": 1, "board": 1, "port": 1, "ont_id": 1,
+                 "board_type": 1, "status": 1, "optical": 1}
+            ).to_list(None)
             
-            register_cmd = f"ont add {ont_data['frame']}/{ont_data['board']}/{ont_data['port']} {ont_data['ont_id']} sn-auth \\\"{ont_data['serial_number']}\\\" omci ont-lineprofile-id {line_template} ont-srvprofile-id {service_template}"
+            ports: Dict[tuple, Dict[int, Dict[str, Any]]] = {}
+            for ont in onts:
+                key = (ont['frame'], ont['board'], ont['port'], ont.get('board_type', 'gpon'))
+                ports.setdefault(key, {})[ont['ont_id']] = ont
             
-            success, status, response = await telnet_manager.send_command(device_id, register_cmd)
+            operations = []
+            changes = []
+            samples = []
+            failed_ports = 0
+            now = datetime.now(timezone.utc)
+            for (frame, board, port, board_type), known in sorted(ports.items()):
+                if not self.telnet.is_connected(device_id):
+                    break
+                states, readings = await self._query_port(device_id, frame, board, port, board_type)
+                if states is None:
+                    failed_ports += 1
+                    continue
+                optical_info_service.store(device_id, frame, board, port, readings)
+                
+                for ont_id, ont in known.items():
+                    state = states.get(ont_id)
+                    update: Dict[str, Any] = {}
+                    if state:
+                        status = state.get('run_state', 'unknown')
+                        if status != ont.get('status'):
+                            update.update(status=status, status_changed_at=now,
+                                          config_state=state.get('config_state'),
+                                          match_state=state.get('match_state'))
+                            changes.append({"id": ont['id'], "frame": frame, "board": board, "port": port,
+                                            "ont_id": ont_id, "status": status, "previous": ont.get('status')})
+                    reading = readings.get(ont_id)
+                    if reading:
+                        samples.append((ont['id'], reading))
+                    if reading and optical_changed(ont.get('optical'), reading):
+                        update["optical"] = {
+                            **{field: reading.get(field) for field in OPTICAL_FIELDS}, "updated_at": now
+                        }
+                    if update:
+                        operations.append(UpdateOne({"id": ont['id']}, {"$set": update}))
             
-            # Log the command
-            log_dict = {
-                "id": str(uuid.uuid4()),
+            if operations:
+                await db.ont_devices.bulk_write(operations, ordered=False)
+            if samples:
+                await optical_history.record(device_id, samples, now)
+            if changes:
+                manager.broadcast({"type": "ont_status", "device_id": device_id, "changes": changes})
+            
+            result = {
                 "device_id": device_id,
-                "command": register_cmd,
-                "response": response,
-                "status": status,
-                "timestamp": datetime.now(timezone.utc).isoformat()
+                "ports": len(ports),
+                "failed_ports": failed_ports,
+                "onts": len(onts),
+                "updated": len(operations),
+                "status_changes": len(changes),
+                "duration_ms": round((time.monotonic() - started) * 1000),
+                "finished_at": now
             }
-            await db.command_logs.insert_one(log_dict)
-            
-        except Exception as e:
-            print(f"Warning: Failed to execute registration command: {e}")
+            self.last_poll[device_id] = result
+            return result
     
-    # Get optical info after registration
-    optical_info = None
-    if telnet_manager.is_connected(device_id):
-        try:
-            optical_cmd = f"display ont optical-info {ont_data['ont_id']} {ont_data['board']}"
-            print(f"\n📡 Getting optical info: {optical_cmd}")
-            
-            optical_output = await telnet_manager.send_command(device_id, optical_cmd)
-            
-            rx_power = None
-            if optical_output and "Rx optical power" in optical_output:
-                for line in optical_output.split('\n'):
-                    if "Rx optical power" in line:
-                        parts = line.split(':')
-                        if len(parts) > 1:
-                            rx_power = parts[1].strip()
-                            print(f"✅ Rx Optical Power: {rx_power} dBm")
-                            break
-            
-            optical_info = {
-                "rx_power": rx_power,
-                "frame": ont_data['frame'],
-                "board": ont_data['board'],
-                "port": ont_data['port'],
-                "ont_id": ont_data['ont_id']
+    async def _query_port(self, device_id: str, frame: int, board: int, port: int, board_type: str):
+        """({ont_id: state}, {ont_id: optical reading}) for one port, (None, None) on failure"""
+        interface = "epon" if board_type == "epon" else "gpon"
+        success, status, results = await self.telnet.send_batch(
+            device_id,
+            [f"interface {interface} {frame}/{board}", f"display ont info {port} all",
+             f"display ont optical-info {port} all", "quit"],
+            priority=PRIORITY_BULK,
+            cleanup=["quit"],
+            read_only=True
+        )
+        if len(results) < 3 or results[1]['status'] != "success":
+            logger.warning(f"Status poll failed on {device_id} {frame}/{board}/{port}: {status}")
+            return None, None
+        states = {state['ont_id']: state for state in parse_ont_info(results[1]['response'])}
+        readings = {}
+        if results[2]['status'] == "success":
+            readings = {
+                reading['ont_id']: reading
+                for reading in parse_optical_info(results[2]['response'], frame, board, port)
+                if reading.get('ont_id') is not None
             }
-        except Exception as e:
-            print(f"Failed to get optical info: {e}")
+        return states, readings
     
-    ont_response = ont_obj.model_dump()
-    ont_response['optical_info'] = optical_info
+    def forget_device(self, device_id: str):
+        self.last_poll.pop(device_id, None)
+
+ont_status_poller = OntStatusPoller(telnet_manager)
+
+@api_router.post("/ont/poll/{device_id}")
+async def poll_ont_status(device_id: str):
+    """Poll run state and optical levels of a device's ONTs right away"""
+    if not telnet_manager.is_connected(device_id):
+        raise HTTPException(status_code=400, detail="Device not connected")
+    return await ont_status_poller.poll(device_id)
+
+@api_router.get("/ont/poll")
+async def get_poller_status():
+    return {
+        "enabled": ONT_POLL_ENABLED,
+        "interval": ONT_POLL_INTERVAL,
+        "concurrency": ONT_POLL_CONCURRENCY,
+        "polling": ont_status_poller.polling(),
+        "last_poll": ont_status_poller.last_poll
+    }
+
+# ==================== AUTOFIND WATCHER ====================
+
+# Autofind polling backs off from MIN to MAX seconds while nothing new shows up
+AUTOFIND_INTERVAL_MIN = float(os.environ.get('AUTOFIND_INTERVAL_MIN', '3'))
+AUTOFIND_INTERVAL_MAX = float(os.environ.get('AUTOFIND_INTERVAL_MAX', '30'))
+AUTOFIND_BACKOFF = 1.5
+# A rolled-back registration is retried after RETRY_DELAY, doubling each time, at most RETRY_MAX times
+AUTOFIND_RETRY_DELAY = float(os.environ.get('AUTOFIND_RETRY_DELAY', '60'))
+AUTOFIND_RETRY_MAX = int(os.environ.get('AUTOFIND_RETRY_MAX', '3'))
+
+class AutofindWatcher:
+    """
+    Per-OLT watch mode: runs `display ont autofind all` in a loop and
+    registers serials that are not in inventory yet, using the OLT
+    configuration's templates, VLANs and gemports (see register_onts), when
+    its auto_registration setting is on. Known serials are loaded once per
+    OLT and kept current by the registration and delete paths, so a cycle
+    with nothing new costs one display command and no queries. The interval
+    drops to AUTOFIND_INTERVAL_MIN whenever a new ONT shows up and backs off
+    towards AUTOFIND_INTERVAL_MAX while the list is quiet. A serial whose
+    registration the OLT rejected is retried with backoff, up to
+    AUTOFIND_RETRY_MAX times, or once it drops off the list and comes back.
+    """
+    
+    def __init__(self, telnet: TelnetConnection):
+        self.telnet = telnet
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._known: Dict[str, Set[str]] = {}
+        # Serials already reported; reported again once they drop off the autofind list
+        self._seen: Dict[str, Set[str]] = {}
+        # Rolled-back serials: (failed attempts, monotonic time of the next try)
+        self._retries: Dict[str, Dict[str, tuple]] = {}
+        self.state: Dict[str, Dict[str, Any]] = {}
+    
+    def is_watching(self, device_id: str) -> bool:
+        return device_id in self._tasks
     
+    async def resume(self):
+        devices = await db.olt_devices.find(
+            {"autofind_watch": True}, {"_id": 0, "id": 1, "autofind_watch_by": 1}
+        ).to_list(None)
+        for device in devices:
+            await self.start(device['id'], device.get('autofind_watch_by', ''))
+    
+    async def start(self, device_id: str, started_by: str):
+        if device_id in self._tasks:
+            return
+        onts = await db.ont_devices.find(
+            {"olt_device_id": device_id}, {"_id": 0, "serial_number": 1}
+        ).to_list(None)
+        self._known[device_id] = {ont['serial_number'].upper() for ont in onts}
+        self._seen[device_id] = set()
+        self._retries[device_id] = {}
+        self.state[device_id] = {
+            "started_by": started_by,
+            "started_at": datetime.now(timezone.utc),
+            "interval": AUTOFIND_INTERVAL_MIN,
+            "last_scan": None,
+            "detected": 0,
+            "registered": 0
+        }
+        self._tasks[device_id] = asyncio.create_task(self._run(device_id))
+    
+    async def stop(self, device_id: Optional[str] = None):
+        device_ids = [device_id] if device_id else list(self._tasks)
+        for watched in device_ids:
+            task = self._tasks.pop(watched, None)
+            if task:
+                task.cancel()
+            self._known.pop(watched, None)
+            self._seen.pop(watched, None)
+            self._retries.pop(watched, None)
+    
+    def note_registered(self, device_id: str, serial_number: str):
+        if device_id in self._known:
+            self._known[device_id].add(serial_number.upper())
+    
+    def note_removed(self, device_id: str, serial_number: str):
+        if device_id in self._known:
+            self._known[device_id].discard(serial_number.upper())
+    
+    async def _run(self, device_id: str):
+        interval = AUTOFIND_INTERVAL_MIN
+        while True:
+            try:
+                found = await self._scan(device_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Autofind watch failed on {device_id}: {e}")
+                found = None
+            if found:
+                interval = AUTOFIND_INTERVAL_MIN
+            elif found is None:
+                interval = AUTOFIND_INTERVAL_MAX  # Not connected or command failed
+            else:
+                interval = min(interval * AUTOFIND_BACKOFF, AUTOFIND_INTERVAL_MAX)
+            self.state[device_id]["interval"] = interval
+            await asyncio.sleep(interval)
+    
+    async def _scan(self, device_id: str) -> Optional[int]:
+        """Number of new ONTs found, None if the OLT could not be asked"""
+        if not self.telnet.is_connected(device_id):
+            return None
+        success, status, response = await self.telnet.send_command(device_id, "display ont autofind all")
+        if not success:
+            return None
+        state = self.state[device_id]
+        state["last_scan"] = datetime.now(timezone.utc)
+        
+        known = self._known[device_id]
+        detected = parse_autofind(response)
+        current = {ont['serial_number'].upper() for ont in detected}
+        seen = self._seen[device_id]
+        seen &= current
+        retries = self._retries.setdefault(device_id, {})
+        now = time.monotonic()
+        for serial in list(retries):
+            attempts, retry_at = retries[serial]
+            if serial not in current:
+                del retries[serial]  # Unplugged: starts over if it comes back
+            elif attempts < AUTOFIND_RETRY_MAX and now >= retry_at:
+                seen.discard(serial)
+        new_onts = []
+        for ont in detected:
+            serial = ont['serial_number'].upper()
+            if serial in known or serial in seen or (ont.get('sn_hex') or '').upper() in known:
+                continue
+            seen.add(serial)
+            new_onts.append(ont)
+        if not new_onts:
+            return 0
+        state["detected"] += len(new_onts)
+        
+        config = await db.olt_configurations.find_one({"device_id": device_id}, {"_id": 0, "auto_registration": 1})
+        if config is None or not config.get('auto_registration', True):
+            for ont in new_onts:
+                manager.broadcast({"type": "autofind_ont", "device_id": device_id, **ont,
+                                   "status": "detected", "message": "Auto-registration is off for this OLT"})
+            return len(new_onts)
+        
+        summary = await register_onts(
+            [
+                BulkRegisterItem(olt_device_id=device_id, serial_number=ont['serial_number'],
+                                 frame=ont['frame'], board=ont['board'], port=ont['port'])
+                for ont in new_onts
+            ],
+            state["started_by"] or "autofind",
+            f"autofind:{device_id}:{uuid.uuid4()}"
+        )
+        state["registered"] += summary["registered"]
+        results = {result['serial_number']: result for result in summary['results']}
+        for ont in new_onts:
+            result = results.get(ont['serial_number'], {})
+            serial = ont['serial_number'].upper()
+            if result.get('status') == "skipped":
+                self.note_registered(device_id, ont['serial_number'])  # Registered elsewhere meanwhile
+            if result.get('rolled_back'):
+                attempts = retries.get(serial, (0, 0.0))[0] + 1
+                retries[serial] = (attempts, time.monotonic() + AUTOFIND_RETRY_DELAY * 2 ** (attempts - 1))
+                if attempts >= AUTOFIND_RETRY_MAX:
+                    result = {**result, "message": f"{result['message']}; giving up after {attempts} attempts"}
+            else:
+                retries.pop(serial, None)
+            manager.broadcast({"type": "autofind_ont", "device_id": device_id, **ont, **result})
+        return len(new_onts)
+    
+    def forget_device(self, device_id: str):
+        task = self._tasks.pop(device_id, None)
+        if task:
+            task.cancel()
+        self._known.pop(device_id, None)
+        self._seen.pop(device_id, None)
+        self._retries.pop(device_id, None)
+        self.state.pop(device_id, None)
+
+autofind_watcher = AutofindWatcher(telnet_manager)
+
+@api_router.post("/ont/autofind-watch/{device_id}")
+async def start_autofind_watch(device_id: str, current_user: User = Depends(require_permission("ont_management_register"))):
+    """
+    Watch the OLT's autofind list and register new ONTs as soon as they are
+    plugged in. Survives restarts until stopped. Each new ONT is broadcast on
+    /ws as an "autofind_ont" event.
+    """
+    device = await db.olt_devices.find_one({"id": device_id}, {"_id": 0, "id": 1})
+    if not device:
+        raise HTTPException(status_code=404, detail="Device not found")
+    await db.olt_devices.update_one(
+        {"id": device_id}, {"$set": {"autofind_watch": True, "autofind_watch_by": current_user.full_name}}
+    )
+    await autofind_watcher.start(device_id, current_user.full_name)
+    return {"device_id": device_id, "watching": True, **autofind_watcher.state[device_id]}
+
+@api_router.delete("/ont/autofind-watch/{device_id}")
+async def stop_autofind_watch(device_id: str, current_user: User = Depends(require_permission("ont_management_register"))):
+    await db.olt_devices.update_one({"id": device_id}, {"$set": {"autofind_watch": False}})
+    await autofind_watcher.stop(device_id)
+    return {"device_id": device_id, "watching": False}
+
+@api_router.get("/ont/autofind-watch")
+async def get_autofind_watch_status():
     return {
-        "success": True,
-        "message": "ONT auto-registered successfully",
-        "ont": ont_response
+        "interval_min": AUTOFIND_INTERVAL_MIN,
+        "interval_max": AUTOFIND_INTERVAL_MAX,
+        "watchers": {
+            device_id: {"watching": autofind_watcher.is_watching(device_id), **state}
+            for device_id, state in autofind_watcher.state.items()
+        }
     }
 
 # ==================== COMMAND LOGS ====================
 
-@api_router.get("/logs/{device_id}")
-async def get_logs(device_id: str, limit: int = 100):
-    logs = await db.command_logs.find({"device_id": device_id}, {"_id": 0}).sort("timestamp", -1).limit(limit).to_list(limit)
+LOG_QUERY_MAX = 1000
+LOG_ARCHIVE_BATCH = 1000
+
+async def apply_log_retention(device_id: str, retention_days: int):
+    """
+    Re-stamp expires_at on a device's stored logs after its retention changes.
+    Logs still carrying a string timestamp (migrate_timestamps has not reached
+    them yet) are skipped: $add cannot add milliseconds to a string.
+    """
+    if retention_days > 0:
+        await db.command_logs.update_many(
+            {"device_id": device_id, "timestamp": {"$type": "date"}},
+            [{"$set": {"expires_at": {"$add": ["$timestamp", retention_days * 86400000]}}}]
+        )
+    else:
+        await db.command_logs.update_many({"device_id": device_id}, {"$unset": {"expires_at": ""}})
+
+def build_log_query(device_id: Optional[str], since: Optional[datetime], until: Optional[datetime],
+                    command_prefix: Optional[str], status: Optional[str], q: Optional[str]) -> Dict[str, Any]:
+    query: Dict[str, Any] = {}
+    if device_id:
+        query["device_id"] = device_id
+    window = time_range(since, until)
+    if window:
+        query["timestamp"] = window
+    if command_prefix:
+        # Anchored prefix match can use the command index
+        query["command"] = {"$regex": f"^{re.escape(command_prefix)}"}
+    if status:
+        query["status"] = status
+    if q:
+        query["$text"] = {"$search": q}
+    return query
+
+@api_router.get("/logs")
+async def search_logs(
+    device_id: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    command_prefix: Optional[str] = None,
+    status: Optional[str] = None,
+    q: Optional[str] = None,
+    limit: int = 100
+):
+    """
+    Query command logs across devices, newest first.
+    `q` is a full-text search over commands and stored responses (for
+    compressed responses only the preview is searchable). Page backwards
+    by passing the oldest timestamp returned as `until`.
+    """
+    limit = max(1, min(limit, LOG_QUERY_MAX))
+    query = build_log_query(device_id, since, until, command_prefix, status, q)
+    logs = await db.command_logs.find(query, {"_id": 0}).sort("timestamp", -1).limit(limit).to_list(limit)
+    return [unpack_log_response(log) for log in logs]
+
+def write_archive_lines(path: Path, lines: List[str]):
+    with gzip.open(path, 'at', encoding='utf-8') as archive:
+        archive.writelines(lines)
+
+@api_router.post("/logs/archive")
+async def archive_logs(before: datetime, device_id: Optional[str] = None):
+    """
+    Move logs older than `before` into a gzip-compressed JSONL file under
+    LOG_ARCHIVE_DIR and delete them from the collection.
+    """
+    query = build_log_query(device_id, None, before, None, None, None)
+    archive_id = str(uuid.uuid4())
+    created_at = datetime.now(timezone.utc)
+    filename = f"command_logs_{device_id or 'all'}_{created_at.strftime('%Y%m%dT%H%M%S')}_{archive_id[:8]}.jsonl.gz"
+    LOG_ARCHIVE_DIR.mkdir(parents=True, exist_ok=True)
+    path = LOG_ARCHIVE_DIR / filename
+    loop = asyncio.get_running_loop()
     
-    for log in logs:
-        if isinstance(log.get('timestamp'), str):
-            log['timestamp'] = datetime.fromisoformat(log['timestamp'])
+    count = 0
+    last_id = None
+    while True:
+        # Walk in _id order so each chunk is deleted only after it is on disk
+        chunk_query = dict(query)
+        if last_id is not None:
+            chunk_query["_id"] = {"$gt": last_id}
+        chunk = await db.command_logs.find(chunk_query).sort("_id", ASCENDING) \
+            .limit(LOG_ARCHIVE_BATCH).to_list(LOG_ARCHIVE_BATCH)
+        if not chunk:
+            break
+        ids = [log.pop('_id') for log in chunk]
+        lines = [json.dumps(unpack_log_response(log), default=json_default) + '\n' for log in chunk]
+        await loop.run_in_executor(None, write_archive_lines, path, lines)
+        await db.command_logs.delete_many({"_id": {"$in": ids}})
+        count += len(chunk)
+        last_id = ids[-1]
+    
+    if not count:
+        return {"archive": None, "count": 0}
     
-    return logs
+    archive = {
+        "id": archive_id,
+        "filename": filename,
+        "device_id": device_id,
+        "before": before,
+        "count": count,
+        "size": path.stat().st_size,
+        "created_at": created_at
+    }
+    await db.log_archives.insert_one(dict(archive))
+    return {"archive": archive, "count": count}
+
+@api_router.get("/logs/archives")
+async def list_log_archives(device_id: Optional[str] = None, limit: int = 100):
+    query = {"device_id": device_id} if device_id else {}
+    return await db.log_archives.find(query, {"_id": 0}).sort("created_at", -1).limit(limit).to_list(limit)
+
+@api_router.get("/logs/archives/{archive_id}")
+async def download_log_archive(archive_id: str, format: str = "gzip"):
+    """Stream an archive back, either as stored or decompressed to NDJSON (`format=ndjson`)"""
+    archive = await db.log_archives.find_one({"id": archive_id}, {"_id": 0})
+    if not archive:
+        raise HTTPException(status_code=404, detail="Archive not found")
+    path = LOG_ARCHIVE_DIR / archive['filename']
+    if not path.exists():
+        raise HTTPException(status_code=410, detail="Archive file is missing")
+    
+    loop = asyncio.get_running_loop()
+    
+    if format == "ndjson":
+        async def stream_lines():
+            with gzip.open(path, 'rb') as f:
+                while True:
+                    data = await loop.run_in_executor(None, f.read, 65536)
+                    if not data:
+                        break
+                    yield data
+        return StreamingResponse(stream_lines(), media_type="application/x-ndjson")
+    
+    async def stream_file():
+        with open(path, 'rb') as f:
+            while True:
+                data = await loop.run_in_executor(None, f.read, 65536)
+                if not data:
+                    break
+                yield data
+    headers = {"Content-Disposition": f'attachment; filename="{archive["filename"]}"'}
+    return StreamingResponse(stream_file(), media_type="application/gzip", headers=headers)
+
+@api_router.get("/logs/{device_id}")
+async def get_logs(device_id: str, limit: int = 100, since: Optional[datetime] = None, until: Optional[datetime] = None):
+    query: Dict[str, Any] = {"device_id": device_id}
+    window = time_range(since, until)
+    if window:
+        query["timestamp"] = window
+    logs = await db.command_logs.find(query, {"_id": 0}).sort("timestamp", -1).limit(limit).to_list(limit)
+    return [unpack_log_response(log) for log in logs]
 
 @api_router.delete("/logs/{device_id}")
 async def clear_logs(device_id: str):
@@ -1317,7 +4222,7 @@ async def import_config(input: ConfigFileUpload):
                 "g_service_template": int(basic_section.get('G业务模板', basic_section.get('g_service_template', '1'))),
                 "service_outer_vlan": int(basic_section.get('业务外层', basic_section.get('service_outer_vlan', '41'))),
                 "service_inner_vlan": int(basic_section.get('业务内层', basic_section.get('service_inner_vlan', '41'))),
-                "updated_at": datetime.now(timezone.utc).isoformat()
+                "updated_at": datetime.now(timezone.utc)
             }
             
             await db.olt_configurations.update_one(
@@ -1377,19 +4282,334 @@ async def export_config(device_id: str):
     
     return {"config_content": config_content}
 
+# ==================== FLEET OPERATIONS ====================
+
+# OLTs worked on at the same time by all fleet jobs together
+FLEET_CONCURRENCY = int(os.environ.get('FLEET_CONCURRENCY', '8'))
+# Seconds one OLT may take for its part of a job
+FLEET_TIMEOUT = float(os.environ.get('FLEET_TIMEOUT', '120'))
+FLEET_JOB_RETENTION_DAYS = int(os.environ.get('FLEET_JOB_RETENTION_DAYS', '7'))
+FLEET_OPERATIONS = ("command", "autofind", "optical_sweep", "config_backup")
+
+fleet_semaphore = asyncio.Semaphore(FLEET_CONCURRENCY)
+# Running jobs; the event loop only keeps weak references to tasks
+fleet_tasks: Set[asyncio.Task] = set()
+
+class FleetRequest(BaseModel):
+    operation: str = "command"  # command, autofind, optical_sweep or config_backup
+    command: Optional[str] = None  # Required for operation=command
+    # Device filters; all given filters must match, none selects every OLT
+    device_ids: Optional[List[str]] = None
+    name: Optional[str] = None  # Substring, case-insensitive
+    identifier: Optional[str] = None
+    connected_only: bool = True  # Otherwise disconnected OLTs are reported as not_connected
+    timeout: Optional[float] = None  # Seconds per OLT, defaults to FLEET_TIMEOUT
+
+async def fleet_command(device_id: str, command: str) -> Dict[str, Any]:
+    success, status, response = await telnet_manager.send_command(device_id, command)
+    await command_log_writer.write(device_id, [{"command": command, "response": response, "status": status}])
+    if not success:
+        raise RuntimeError(response or status)
+    return {"response": response}
+
+async def fleet_autofind(device_id: str) -> Dict[str, Any]:
+    success, status, response = await telnet_manager.send_command(device_id, "display ont autofind all")
+    if not success:
+        raise RuntimeError(response or status)
+    detected_at = datetime.now(timezone.utc)
+    onts = [{**ont, "detected_at": detected_at} for ont in parse_autofind(response)]
+    await annotate_detected_onts(device_id, onts)
+    return {
+        "detected_count": len(onts),
+        "unregistered_count": sum(1 for ont in onts if not ont['registered']),
+        "onts": onts
+    }
+
+async def fleet_optical_sweep(device_id: str) -> Dict[str, Any]:
+    return await ont_status_poller.poll(device_id)
+
+async def fleet_config_backup(device_id: str) -> Dict[str, Any]:
+    command = "display current-configuration"
+    success, status, response = await telnet_manager.send_command(device_id, command)
+    await command_log_writer.write(device_id, [{"command": command, "response": response, "status": status}])
+    if not success:
+        raise RuntimeError(response or status)
+    backup = {
+        "id": str(uuid.uuid4()),
+        "device_id": device_id,
+        "taken_at": datetime.now(timezone.utc),
+        "size": len(response),
+        "content_zlib": zlib.compress(response.encode('utf-8'))
+    }
+    await db.olt_config_backups.insert_one(backup)
+    return {"backup_id": backup['id'], "size": backup['size']}
+
+async def run_fleet_device(job_id: str, request: FleetRequest, device: Dict[str, Any]) -> Dict[str, Any]:
+    """Run the job's operation on one OLT; failures become the OLT's result instead of failing the job"""
+    device_id = device['id']
+    result: Dict[str, Any] = {"device_id": device_id, "name": device.get('name', '')}
+    if not telnet_manager.is_connected(device_id):
+        result.update(status="not_connected", duration_ms=0)
+    else:
+        async with fleet_semaphore:
+            started = time.monotonic()
+            if request.operation == "command":
+                operation = fleet_command(device_id, request.command)
+            elif request.operation == "autofind":
+                operation = fleet_autofind(device_id)
+            elif request.operation == "optical_sweep":
+                operation = fleet_optical_sweep(device_id)
+            else:
+                operation = fleet_config_backup(device_id)
+            try:
+                result.update(status="success", result=await asyncio.wait_for(
+                    operation, timeout=request.timeout or FLEET_TIMEOUT
+                ))
+            except asyncio.TimeoutError:
+                result.update(status="timeout", error=f"No result within {request.timeout or FLEET_TIMEOUT:g}s")
+            except Exception as e:
+                result.update(status="failed", error=str(e))
+            result["duration_ms"] = round((time.monotonic() - started) * 1000)
+    
+    # Kept on the job as soon as it is known, so a dropped stream loses nothing
+    await db.fleet_jobs.update_one(
+        {"_id": job_id},
+        {"$push": {"results": result}, "$inc": {f"counts.{result['status']}": 1}}
+    )
+    return result
+
+@api_router.post("/fleet/run")
+async def run_fleet_operation(input: FleetRequest, current_user: User = Depends(get_current_user)):
+    """
+    Run a command or a named operation on many OLTs at once.
+    OLTs run in parallel, at most FLEET_CONCURRENCY at a time across all
+    jobs, each within its own timeout. The response is NDJSON: a "start"
+    line, one "result" line per OLT as soon as it finishes, then a "done"
+    line with counts per status. Results are also stored on the job and can
+    be read back from /fleet/jobs/{job_id}, even if the stream was dropped.
+    """
+    if input.operation not in FLEET_OPERATIONS:
+        raise HTTPException(status_code=400, detail=f"operation must be one of: {', '.join(FLEET_OPERATIONS)}")
+    if input.operation == "command":
+        if not input.command or not input.command.strip():
+            raise HTTPException(status_code=400, detail="command is required")
+        if current_user.role != "admin" and not current_user.permissions.get("terminal", False):
+            raise HTTPException(status_code=403, detail="Permission denied: terminal")
+    
+    query: Dict[str, Any] = {}
+    if input.device_ids is not None:
+        query["id"] = {"$in": input.device_ids}
+    if input.name:
+        query["name"] = {"$regex": re.escape(input.name), "$options": "i"}
+    if input.identifier:
+        query["identifier"] = input.identifier
+    devices = await db.olt_devices.find(query, {"_id": 0, "id": 1, "name": 1}).sort("name", ASCENDING).to_list(None)
+    if input.connected_only:
+        devices = [device for device in devices if telnet_manager.is_connected(device['id'])]
+    
+    job_id = str(uuid.uuid4())
+    now = datetime.now(timezone.utc)
+    job = {
+        "_id": job_id,
+        "operation": input.operation,
+        "command": input.command,
+        "device_ids": [device['id'] for device in devices],
+        "started_by": current_user.full_name,
+        "started_at": now,
+        "finished_at": None,
+        "counts": {},
+        "results": [],
+        "expires_at": now + timedelta(days=FLEET_JOB_RETENTION_DAYS)
+    }
+    await db.fleet_jobs.insert_one(job)
+    
+    # The job runs to completion on its own; the stream only follows it
+    results: asyncio.Queue = asyncio.Queue()
+    
+    async def run_device(device: Dict[str, Any]):
+        try:
+            result = await run_fleet_device(job_id, input, device)
+        except Exception as e:
+            result = {"device_id": device['id'], "name": device.get('name', ''), "status": "failed", "error": str(e)}
+        results.put_nowait(result)
+    
+    async def run_job():
+        await asyncio.gather(*[run_device(device) for device in devices])
+        await db.fleet_jobs.update_one({"_id": job_id}, {"$set": {"finished_at": datetime.now(timezone.utc)}})
+    
+    job_task = asyncio.create_task(run_job())
+    fleet_tasks.add(job_task)
+    job_task.add_done_callback(fleet_tasks.discard)
+    
+    async def stream_results():
+        yield json.dumps({"type": "start", "job_id": job_id, "operation": input.operation,
+                          "devices": len(devices)}) + '\n'
+        counts: Dict[str, int] = {}
+        for _ in devices:
+            result = await results.get()
+            counts[result['status']] = counts.get(result['status'], 0) + 1
+            yield json.dumps({"type": "result", "job_id": job_id, **result}, default=json_default) + '\n'
+        await job_task
+        yield json.dumps({"type": "done", "job_id": job_id, "devices": len(devices), "counts": counts}) + '\n'
+    
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+@api_router.get("/fleet/jobs/{job_id}")
+async def get_fleet_job(job_id: str, current_user: User = Depends(get_current_user)):
+    job = await db.fleet_jobs.find_one({"_id": job_id})
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    # Command output is only for those allowed to run commands
+    if job["operation"] == "command" and current_user.role != "admin" \
+            and not current_user.permissions.get("terminal", False):
+        raise HTTPException(status_code=403, detail="Permission denied: terminal")
+    job["job_id"] = job.pop("_id")
+    return job
+
+@api_router.get("/config/backups/{device_id}")
+async def list_config_backups(device_id: str, limit: int = 50,
+                              current_user: User = Depends(require_permission("configuration"))):
+    return await db.olt_config_backups.find(
+        {"device_id": device_id}, {"_id": 0, "content_zlib": 0}
+    ).sort("taken_at", DESCENDING).limit(max(1, min(limit, 500))).to_list(None)
+
+@api_router.get("/config/backups/{device_id}/{backup_id}")
+async def get_config_backup(device_id: str, backup_id: str,
+                            current_user: User = Depends(require_permission("configuration"))):
+    backup = await db.olt_config_backups.find_one({"id": backup_id, "device_id": device_id}, {"_id": 0})
+    if not backup:
+        raise HTTPException(status_code=404, detail="Backup not found")
+    filename = f"{device_id}-{backup['taken_at'].strftime('%Y%m%d-%H%M%S')}.cfg"
+    return Response(
+        zlib.decompress(backup['content_zlib']).decode('utf-8'),
+        media_type="text/plain",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
 # ==================== WEBSOCKET ====================
 
+def parse_topics(value) -> Optional[set]:
+    """Subscription filter from a comma-separated string or a list; empty means everything"""
+    if not value:
+        return None
+    if isinstance(value, str):
+        value = value.split(',')
+    topics = {str(item).strip() for item in value if str(item).strip()}
+    return topics or None
+
 @app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+async def websocket_endpoint(websocket: WebSocket, device_id: Optional[str] = None, types: Optional[str] = None):
+    """
+    Event stream. Filter with ?device_id=a,b&types=command,connection or at
+    any time by sending {"action": "subscribe", "device_ids": [...], "types": [...]}.
+    """
+    ws_client = await manager.connect(websocket, parse_topics(device_id), parse_topics(types))
     try:
         while True:
             data = await websocket.receive_text()
-            # Echo back for now
-            await websocket.send_text(f"Received: {data}")
+            try:
+                request = json.loads(data)
+            except ValueError:
+                request = None
+            if not isinstance(request, dict) or request.get("action") != "subscribe":
+                ws_client.push(json.dumps({"type": "error", "message": "Expected a subscribe action"}))
+                continue
+            ws_client.device_ids = parse_topics(request.get("device_ids"))
+            ws_client.types = parse_topics(request.get("types"))
+            ws_client.push(json.dumps({
+                "type": "subscribed",
+                "device_ids": sorted(ws_client.device_ids) if ws_client.device_ids else None,
+                "types": sorted(ws_client.types) if ws_client.types else None
+            }))
     except WebSocketDisconnect:
+        pass
+    finally:
         manager.disconnect(websocket)
 
+@app.websocket("/ws/terminal/{device_id}")
+async def terminal_websocket(websocket: WebSocket, device_id: str, token: str = ""):
+    """
+    Streaming terminal on the device's terminal session, which background jobs
+    never touch, so the CLI mode persists between commands.
+    Send {"type": "command", "command": "..."} to run a command; output comes
+    back as {"type": "output"} chunks while it is read, then {"type": "done"}.
+    {"type": "input", "data": "..."} writes raw keystrokes (e.g. "q" or Ctrl-C)
+    to the command that is currently streaming.
+    Commands go through the device scheduler at interactive priority.
+    """
+    try:
+        user = await get_current_user(HTTPAuthorizationCredentials(scheme="Bearer", credentials=token))
+        if user.role != "admin" and not user.permissions.get("terminal", False):
+            raise HTTPException(status_code=403, detail="Permission denied: terminal")
+    except HTTPException as e:
+        await websocket.close(code=1008, reason=str(e.detail))
+        return
+    
+    await websocket.accept()
+    outbox: asyncio.Queue = asyncio.Queue()
+    streaming = {"command": None}  # Command whose output is arriving right now
+    running: set = set()
+    
+    async def send_loop():
+        while True:
+            message = await outbox.get()
+            await websocket.send_text(json.dumps(message))
+    
+    async def run(command: str):
+        def on_chunk(data: str):
+            streaming["command"] = command
+            if data:
+                outbox.put_nowait({"type": "output", "command": command, "data": data})
+        
+        try:
+            success, status, response = await telnet_manager.send_command(
+                device_id, command, priority=PRIORITY_INTERACTIVE, on_chunk=on_chunk
+            )
+        finally:
+            if streaming["command"] == command:
+                streaming["command"] = None
+        outbox.put_nowait({"type": "done", "command": command, "status": status,
+                           "response": response if status != "success" else None})
+        # The client already has its result; a task nobody awaits must not fail silently
+        try:
+            await command_log_writer.write(device_id, [{"command": command, "response": response, "status": status}])
+            manager.broadcast({"type": "command", "device_id": device_id, "command": command, "status": status})
+        except Exception as e:
+            logger.error(f"Failed to log terminal command on {device_id}: {e}")
+    
+    sender = asyncio.create_task(send_loop())
+    try:
+        while True:
+            data = await websocket.receive_text()
+            try:
+                message = json.loads(data)
+            except ValueError:
+                message = {"type": "command", "command": data}  # Plain text is a command line
+            if not isinstance(message, dict):
+                continue
+            
+            if message.get("type") == "input":
+                connection = telnet_manager.terminal_session(device_id)
+                if streaming["command"] is None or not connection:
+                    outbox.put_nowait({"type": "error", "message": "No command is running"})
+                else:
+                    connection['writer'].write(str(message.get("data", "")))
+            elif message.get("type") == "command":
+                if not telnet_manager.is_connected(device_id):
+                    outbox.put_nowait({"type": "error", "message": "Device not connected"})
+                    continue
+                task = asyncio.create_task(run(str(message.get("command", "")).rstrip('\r\n')))
+                running.add(task)
+                task.add_done_callback(running.discard)
+            else:
+                outbox.put_nowait({"type": "error", "message": "Unknown message type"})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        sender.cancel()
+        for task in running:
+            task.cancel()
+
 # Include the router in the main app
 app.include_router(api_router)
 
@@ -1399,6 +4619,7 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # Configure logging
@@ -1408,6 +4629,21 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def startup():
+    await ensure_indexes()
+    # Old string timestamps are converted in the background; readers cope with both meanwhile
+    asyncio.create_task(run_timestamp_migration())
+    command_log_writer.start()
+    await telnet_supervisor.start()
+    ont_status_poller.start()
+    await autofind_watcher.resume()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await autofind_watcher.stop()
+    await ont_status_poller.stop()
+    await telnet_supervisor.stop()
+    await command_log_writer.stop()
+    password_executor.shutdown(wait=False)
     client.close()
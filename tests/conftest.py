@@ -0,0 +1,34 @@
+import os
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+# Set only when a real MongoDB is available; tests that need one skip otherwise
+LIVE_MONGO_URL = os.environ.get("MONGO_URL")
+
+# server.py reads these at import time; Motor connects lazily, so tests that
+# never touch the database run without a MongoDB server
+os.environ.setdefault("MONGO_URL", "mongodb://127.0.0.1:27017")
+os.environ.setdefault("DB_NAME", "registrasi_ont_test")
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        "markers", "benchmark: timing test; report its numbers with record_property(\"benchmark\", text)"
+    )
+
+
+def pytest_terminal_summary(terminalreporter):
+    """Collect the numbers benchmark tests recorded into one section instead of printing them mid-run"""
+    lines = [
+        f"{report.nodeid}: {value}"
+        for report in terminalreporter.stats.get("passed", []) + terminalreporter.stats.get("failed", [])
+        if report.when == "call"
+        for name, value in report.user_properties if name == "benchmark"
+    ]
+    if lines:
+        terminalreporter.write_sep("-", "benchmark results")
+        for line in lines:
+            terminalreporter.write_line(line)
@@ -0,0 +1,76 @@
+"""
+Minimal Huawei MA5600-style telnet server for tests: login prompts, CLI
+modes and canned command output. Not a telnet implementation; option
+negotiation is ignored, which telnetlib3 tolerates.
+"""
+import asyncio
+
+HOSTNAME = "MA5683T"
+
+
+class FakeOLT:
+    def __init__(self, username="root", password="admin", banner_delay=0.0, silent=False, outputs=None):
+        self.username = username
+        self.password = password
+        self.banner_delay = banner_delay  # Seconds before the login banner
+        self.silent = silent  # Accept the connection but never prompt
+        self.outputs = outputs or {}  # Command -> output
+        self.sessions = 0
+        self.commands = []  # Every command received, across sessions
+        self.session_commands = {}  # Session number -> commands received on it
+        self.server = None
+        self.port = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        self.sessions += 1
+        received = self.session_commands.setdefault(self.sessions, [])
+        mode = ">"
+
+        async def readline():
+            line = await reader.readline()
+            if not line:
+                raise EOFError
+            return line.decode(errors="replace").strip("\r\n")
+
+        try:
+            if self.silent:
+                await reader.read()
+                return
+            await asyncio.sleep(self.banner_delay)
+            writer.write(b"\r\nWarning: Telnet is not a secure protocol\r\n\r\n>>User name:")
+            username = await readline()
+            writer.write(b"\r\n>>User password:")
+            password = await readline()
+            if (username, password) != (self.username, self.password):
+                writer.write(b"\r\n  Username or password invalid.\r\n\r\n>>User name:")
+                await writer.drain()
+                return
+            writer.write(f"\r\n\r\n  Huawei Integrated Access Software (MA5600T).\r\n\r\n{HOSTNAME}{mode}".encode())
+            while True:
+                command = (await readline()).strip()
+                self.commands.append(command)
+                received.append(command)
+                if command == "enable":
+                    mode = "#"
+                elif command == "config":
+                    mode = "(config)#"
+                elif command.startswith("interface"):
+                    mode = "(config-if-gpon-0/1)#"
+                elif command == "quit":
+                    mode = "(config)#"
+                output = self.outputs.get(command, "")
+                writer.write(f"{command}\r\n{output}\r\n{HOSTNAME}{mode}".encode())
+                await writer.drain()
+        except (EOFError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
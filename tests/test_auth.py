@@ -0,0 +1,52 @@
+import asyncio
+
+import mongomock_motor
+import pytest
+from fastapi import HTTPException
+from fastapi.security import HTTPAuthorizationCredentials
+
+import server
+
+
+@pytest.fixture
+def database(monkeypatch):
+    database = mongomock_motor.AsyncMongoMockClient(tz_aware=True)["auth"]
+    monkeypatch.setattr(server, "db", database)
+    monkeypatch.setattr(server, "user_cache", server.UserCache())
+    return database
+
+
+def authenticate(token):
+    return server.get_current_user(HTTPAuthorizationCredentials(scheme="Bearer", credentials=token))
+
+
+def claims_token():
+    return server.create_access_token({"sub": "budi", "role": "admin", "perms": {}})
+
+
+def test_role_claims_are_ignored_outside_claims_mode(database, monkeypatch):
+    monkeypatch.setattr(server, "AUTH_CLAIMS_IN_TOKEN", False)
+
+    async def scenario():
+        await database.users.insert_one({
+            "id": "u1", "username": "budi", "password_hash": "", "full_name": "Budi",
+            "role": "operator", "permissions": {}, "is_active": False,
+        })
+        with pytest.raises(HTTPException) as error:
+            await authenticate(claims_token())
+        return error.value
+
+    error = asyncio.run(scenario())
+    assert error.status_code == 401 and error.detail == "User account is disabled"
+
+
+def test_role_claims_are_trusted_in_claims_mode(database, monkeypatch):
+    monkeypatch.setattr(server, "AUTH_CLAIMS_IN_TOKEN", True)
+    user = asyncio.run(authenticate(claims_token()))
+    assert user.username == "budi" and user.role == "admin"
+
+
+def test_malformed_token_is_rejected_with_401(database):
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(authenticate("not-a-jwt"))
+    assert error.value.status_code == 401 and error.value.detail == "Could not validate credentials"
@@ -0,0 +1,143 @@
+import asyncio
+import time
+
+import mongomock_motor
+import pytest
+
+import server
+
+CONCURRENT_WRITERS = 20
+
+
+@pytest.fixture
+def database(monkeypatch):
+    database = mongomock_motor.AsyncMongoMockClient(tz_aware=True)["command_log_writer"]
+    monkeypatch.setattr(server, "db", database)
+    return database
+
+
+def result(command="display version", status="success"):
+    return {"command": command, "response": "ok", "status": status}
+
+
+async def configure(database, device_id, enable_log):
+    await database.olt_configurations.insert_one({"device_id": device_id, "enable_log": enable_log})
+
+
+def wrap_insert_many(monkeypatch, database, before):
+    """Run `before(docs)` ahead of every insert_many (collections are built per access, so patch the class)"""
+    collection_class = type(database.command_logs)
+    insert_many = collection_class.insert_many
+
+    async def wrapped_insert_many(self, docs, **kwargs):
+        await before(docs)
+        return await insert_many(self, docs, **kwargs)
+
+    monkeypatch.setattr(collection_class, "insert_many", wrapped_insert_many)
+
+
+def count_inserts(monkeypatch, database):
+    calls = []
+
+    async def count(docs):
+        calls.append(len(docs))
+
+    wrap_insert_many(monkeypatch, database, count)
+    return calls
+
+
+@pytest.mark.benchmark
+def test_durable_write_does_not_wait_for_the_timer(database, monkeypatch, record_property):
+    monkeypatch.setattr(server, "LOG_FLUSH_INTERVAL", 5.0)
+
+    async def scenario():
+        await configure(database, "olt1", enable_log=True)
+        writer = server.CommandLogWriter()
+        writer.start()
+        try:
+            started = time.perf_counter()
+            await writer.write("olt1", [result()])
+            elapsed = time.perf_counter() - started
+        finally:
+            await writer.stop()
+        return elapsed, await database.command_logs.count_documents({})
+
+    elapsed, stored = asyncio.run(scenario())
+    record_property("benchmark", f"durable command log write: {elapsed * 1000:.1f} ms")
+    assert stored == 1
+    assert elapsed < 0.5
+
+
+def test_concurrent_durable_writers_share_inserts(database, monkeypatch):
+    calls = count_inserts(monkeypatch, database)
+
+    async def scenario():
+        await configure(database, "olt1", enable_log=True)
+        writer = server.CommandLogWriter()
+        writer.start()
+        try:
+            await asyncio.gather(*[
+                writer.write("olt1", [result(f"display ont info 0 {i}")]) for i in range(CONCURRENT_WRITERS)
+            ])
+        finally:
+            await writer.stop()
+
+    asyncio.run(scenario())
+    assert sum(calls) == CONCURRENT_WRITERS
+    assert len(calls) < CONCURRENT_WRITERS
+
+
+def test_overflow_drops_only_fire_and_forget_entries(database, monkeypatch):
+    monkeypatch.setattr(server, "LOG_BUFFER_MAX", 4)
+
+    async def scenario():
+        await configure(database, "durable", enable_log=True)
+        await configure(database, "casual", enable_log=False)
+        writer = server.CommandLogWriter()
+        writer.start()
+        # Hold the insert so entries pile up in the buffer
+        release = asyncio.Event()
+
+        async def hold(docs):
+            await release.wait()
+
+        wrap_insert_many(monkeypatch, database, hold)
+        try:
+            first = asyncio.create_task(writer.write("durable", [result("first")]))
+            await asyncio.sleep(0.05)  # The first flush is now stuck in insert_many
+            durable = [asyncio.create_task(writer.write("durable", [result(f"durable {i}")])) for i in range(3)]
+            await asyncio.sleep(0)
+            for i in range(5):
+                await writer.write("casual", [result(f"casual {i}")])
+            buffered = len(writer._buffer)
+            release.set()
+            await asyncio.gather(first, *durable)
+        finally:
+            await writer.stop()
+        commands = {doc["command"] for doc in await database.command_logs.find({}, {"command": 1}).to_list(None)}
+        return buffered, writer.dropped, commands
+
+    buffered, dropped, commands = asyncio.run(scenario())
+    assert buffered <= 4
+    assert dropped == 4
+    assert {"first", "durable 0", "durable 1", "durable 2"} <= commands
+    assert "casual 4" in commands
+
+
+def test_failed_durable_insert_does_not_fail_the_writer(database, monkeypatch):
+    async def fail(docs):
+        raise ConnectionError("mongod went away")
+
+    wrap_insert_many(monkeypatch, database, fail)
+
+    async def scenario():
+        await configure(database, "olt1", enable_log=True)
+        writer = server.CommandLogWriter()
+        writer.start()
+        try:
+            await writer.write("olt1", [result()])
+        finally:
+            await writer.stop()
+        return await database.command_logs.count_documents({})
+
+    assert asyncio.run(scenario()) == 0
@@ -0,0 +1,53 @@
+import asyncio
+import time
+
+import server
+
+
+class Stream:
+    def is_closing(self):
+        return False
+
+    def at_eof(self):
+        return False
+
+
+class HungScheduler:
+    async def submit(self, job, priority=server.PRIORITY_NORMAL, **kwargs):
+        await asyncio.Event().wait()
+
+
+class Scheduler:
+    def __init__(self, checked):
+        self.checked = checked
+
+    async def submit(self, job, priority=server.PRIORITY_NORMAL, **kwargs):
+        self.checked.append(time.perf_counter())
+
+
+class FakeTelnet:
+    def __init__(self, schedulers):
+        self.schedulers = schedulers
+        idle = {"reader": Stream(), "writer": Stream(), "busy": False, "last_used": 0.0}
+        self.connections = {device_id: dict(idle) for device_id in schedulers}
+
+
+def test_hung_olt_does_not_delay_the_others(monkeypatch):
+    monkeypatch.setattr(server, "SUPERVISOR_CHECK_INTERVAL", 0.01)
+    monkeypatch.setattr(server, "SUPERVISOR_CHECK_TIMEOUT", 0.2)
+    checked = []
+    telnet = FakeTelnet({"hung": HungScheduler(), "olt2": Scheduler(checked), "olt3": Scheduler(checked)})
+
+    async def scenario():
+        supervisor = server.ConnectionSupervisor(telnet)
+        started = time.perf_counter()
+        task = asyncio.create_task(supervisor._run())
+        await asyncio.sleep(0.5)
+        task.cancel()
+        return started
+
+    started = asyncio.run(scenario())
+    # Both healthy OLTs got their keepalive in the first round, not after the hung one timed out
+    assert checked[1] - started < 0.1
+    # The hung check times out, so later rounds still run
+    assert len(checked) >= 4
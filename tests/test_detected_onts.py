@@ -0,0 +1,91 @@
+import asyncio
+from pathlib import Path
+
+import mongomock_motor
+import pytest
+
+import server
+from huawei_parser import parse_autofind
+
+AUTOFIND = (Path(__file__).resolve().parent / "fixtures" / "huawei" / "autofind.txt").read_text()
+DEVICE_ID = "olt-annotate"
+
+
+@pytest.fixture
+def database(monkeypatch):
+    database = mongomock_motor.AsyncMongoMockClient(tz_aware=True)["detected_onts"]
+    monkeypatch.setattr(server, "db", database)
+    monkeypatch.setattr(server.telnet_manager, "is_connected", lambda device_id: False)
+    # The allocators cache per device; start each test from the fresh database
+    monkeypatch.setattr(server, "ont_id_allocator", server.OntIdAllocator())
+    monkeypatch.setattr(server, "service_port_allocator", server.ServicePortAllocator())
+    return database
+
+
+def detected():
+    onts = parse_autofind(AUTOFIND)
+    # A second new ONT on the first port
+    return onts + [{**onts[0], "serial_number": "HWTC-00000002", "sn_hex": "4857544300000002"}]
+
+
+async def setup(database):
+    await database.olt_devices.insert_one({"id": DEVICE_ID, "name": DEVICE_ID})
+    await database.olt_configurations.insert_one({"device_id": DEVICE_ID, "gemport": "1,2"})
+    # Registered under its hex serial, which autofind also reports
+    await server.ont_id_allocator.reserve(DEVICE_ID, 0, 2, 15, 0)
+    await server.service_port_allocator.reserve(DEVICE_ID, 0, 2)
+    await database.ont_devices.insert_one({
+        "id": "known", "olt_device_id": DEVICE_ID, "serial_number": "48575443A1B2C3D4", "ont_id": 0,
+        "frame": 0, "board": 2, "port": 15, "service_port_index": 0, "service_port_count": 2,
+    })
+    await server.ont_id_allocator.reserve(DEVICE_ID, 0, 1, 0, 0)  # Configured by hand on the OLT
+
+
+def test_annotation_marks_registered_serials_and_suggests_the_rest(database):
+    async def scenario():
+        await setup(database)
+        onts = detected()
+        await server.annotate_detected_onts(DEVICE_ID, onts)
+        return onts
+
+    onts = asyncio.run(scenario())
+    by_serial = {ont["serial_number"]: ont for ont in onts}
+    known = by_serial["48575443A1B2C3D4"]
+    assert known["registered"] and known["existing"]["id"] == "known"
+    assert (known["ont_id"], known["service_port_index"]) == (0, 0)
+    assert [ont["registered"] for ont in onts] == [False, False, True, False]
+    # Free IDs per port, service-port ranges in autofind order after the used one
+    assert [(ont["ont_id"], ont["service_port_index"]) for ont in onts if not ont["registered"]] == [
+        (1, 2), (0, 4), (2, 6),
+    ]
+    assert all(ont["service_port_count"] == 2 for ont in onts)
+
+
+def test_suggestions_are_what_bulk_registration_allocates(database):
+    async def scenario():
+        await setup(database)
+        onts = detected()
+        await server.annotate_detected_onts(DEVICE_ID, onts)
+        suggested = {ont["serial_number"]: (ont["ont_id"], ont["service_port_index"])
+                     for ont in onts if not ont["registered"]}
+        summary = await server.register_onts(
+            [server.BulkRegisterItem(olt_device_id=DEVICE_ID, serial_number=ont["serial_number"],
+                                     frame=ont["frame"], board=ont["board"], port=ont["port"])
+             for ont in onts if not ont["registered"]],
+            "tester", "job"
+        )
+        return suggested, summary
+
+    suggested, summary = asyncio.run(scenario())
+    assert {result["status"] for result in summary["results"]} == {"saved"}
+    assert {result["serial_number"]: (result["ont_id"], result["service_port_index"])
+            for result in summary["results"]} == suggested
+
+
+def test_suggestions_reserve_nothing(database):
+    async def scenario():
+        await setup(database)
+        await server.annotate_detected_onts(DEVICE_ID, detected())
+        return await server.ont_id_allocator.peek(DEVICE_ID, 0, 1, 0)
+
+    assert asyncio.run(scenario())["next_ont_id"] == 1
@@ -0,0 +1,94 @@
+import asyncio
+import json
+
+import mongomock_motor
+import pytest
+from fastapi import HTTPException
+
+import server
+
+ADMIN = server.User(username="admin", password_hash="", full_name="Admin", role="admin")
+OPERATOR = server.User(username="budi", password_hash="", full_name="Budi", role="operator")
+
+
+class FakeTelnet:
+    """olt-ok answers, olt-slow never does in time, olt-fail errors out, olt-off is not connected"""
+
+    def is_connected(self, device_id):
+        return device_id != "olt-off"
+
+    async def send_command(self, device_id, command, *args, **kwargs):
+        if device_id == "olt-slow":
+            await asyncio.sleep(10)
+        if device_id == "olt-fail":
+            return False, "error", "Failure: Unknown command"
+        return True, "success", f"{device_id}: ok"
+
+
+@pytest.fixture
+def database(monkeypatch):
+    database = mongomock_motor.AsyncMongoMockClient(tz_aware=True)["fleet"]
+    monkeypatch.setattr(server, "db", database)
+    monkeypatch.setattr(server, "telnet_manager", FakeTelnet())
+    monkeypatch.setattr(server.command_log_writer, "write", lambda device_id, results: asyncio.sleep(0))
+    return database
+
+
+async def add_devices(database):
+    await database.olt_devices.insert_many(
+        [{"id": device_id, "name": device_id} for device_id in ("olt-ok", "olt-slow", "olt-fail", "olt-off")]
+    )
+
+
+def fleet_request(**kwargs):
+    return server.FleetRequest(operation="command", command="display version", connected_only=False,
+                               timeout=0.2, **kwargs)
+
+
+async def read_lines(response):
+    return [json.loads(line) async for line in response.body_iterator]
+
+
+def test_fleet_streams_partial_results_and_times_out_slow_olts(database):
+    async def scenario():
+        await add_devices(database)
+        lines = await read_lines(await server.run_fleet_operation(fleet_request(), ADMIN))
+        job = await server.get_fleet_job(lines[0]["job_id"], ADMIN)
+        return lines, job
+
+    lines, job = asyncio.run(scenario())
+    start, *results, done = lines
+    assert start["type"] == "start" and start["devices"] == 4
+    statuses = {result["device_id"]: result["status"] for result in results}
+    assert statuses == {"olt-ok": "success", "olt-slow": "timeout", "olt-fail": "failed", "olt-off": "not_connected"}
+    # The slow OLT does not hold back the others
+    assert results[-1]["device_id"] == "olt-slow"
+    assert results[0]["status"] != "timeout"
+    assert done["counts"] == {"success": 1, "timeout": 1, "failed": 1, "not_connected": 1}
+    assert job["counts"] == done["counts"] and job["finished_at"] is not None
+    assert {result["device_id"] for result in job["results"]} == set(statuses)
+
+
+def test_fleet_job_finishes_when_the_stream_is_dropped(database):
+    async def scenario():
+        await add_devices(database)
+        response = await server.run_fleet_operation(fleet_request(device_ids=["olt-ok", "olt-slow"]), ADMIN)
+        start = json.loads(await response.body_iterator.__anext__())
+        await response.body_iterator.aclose()  # Client went away
+        await asyncio.gather(*server.fleet_tasks)
+        return await database.fleet_jobs.find_one({"_id": start["job_id"]})
+
+    job = asyncio.run(scenario())
+    assert job["finished_at"] is not None
+    assert job["counts"] == {"success": 1, "timeout": 1}
+
+
+def test_command_job_output_needs_the_terminal_permission(database):
+    async def scenario():
+        await add_devices(database)
+        lines = await read_lines(await server.run_fleet_operation(fleet_request(device_ids=["olt-ok"]), ADMIN))
+        with pytest.raises(HTTPException) as error:
+            await server.get_fleet_job(lines[0]["job_id"], OPERATOR)
+        return error.value
+
+    assert asyncio.run(scenario()).status_code == 403
@@ -0,0 +1,244 @@
+"""
+Parser tests against captures in tests/fixtures/huawei. Captures are stored
+with LF endings; every test also runs on the CRLF form telnet delivers.
+"""
+import time
+from pathlib import Path
+
+import pytest
+
+import huawei_parser
+from huawei_parser import (
+    IncrementalParser, merge_ont_info, parse_autofind, parse_boards, parse_ont_info,
+    parse_optical_info, parse_service_ports,
+)
+
+FIXTURES = Path(__file__).resolve().parent / "fixtures" / "huawei"
+CHUNK_SIZES = [1, 7, 64, 1024]
+BENCHMARK_LIMIT = 2.0  # Seconds per multi-MB capture; catches accidental quadratic behaviour
+
+
+@pytest.fixture(params=["lf", "crlf"])
+def capture(request):
+    def load(name):
+        text = (FIXTURES / f"{name}.txt").read_text()
+        return text.replace("\n", "\r\n") if request.param == "crlf" else text
+    return load
+
+
+def test_autofind(capture):
+    onts = parse_autofind(capture("autofind"))
+    assert [(ont["frame"], ont["board"], ont["port"]) for ont in onts] == [(0, 1, 0), (0, 2, 5), (0, 2, 15)]
+    assert onts[0] == {
+        "frame": 0, "board": 1, "port": 0, "number": 1,
+        "serial_number": "HWTC-9F3887B1", "sn_hex": "485754439F3887B1",
+        "vendor_id": "HWTC", "model": "EG8145V5", "ont_version": "159D.A",
+        "software_version": "V5R019C10S125", "autofind_time": "2024-03-11 09:14:02+07:00",
+    }
+    assert onts[1]["loid"] == "budi-01"
+    assert "loid" not in onts[0]
+    # No readable form: the hex serial stands in
+    assert onts[2]["serial_number"] == onts[2]["sn_hex"] == "48575443A1B2C3D4"
+
+
+def test_ont_info_table(capture):
+    onts = parse_ont_info(capture("ont_info_table"))
+    assert [ont["ont_id"] for ont in onts] == [0, 1, 2, 12]
+    assert onts[0] == {
+        "frame": 0, "board": 1, "port": 3, "ont_id": 0, "sn_hex": "485754439F3887B1",
+        "control_flag": "active", "run_state": "online", "config_state": "normal",
+        "match_state": "match", "protect_side": "no", "description": "cust: budi santoso",
+    }
+    assert onts[1]["run_state"] == "offline"
+    assert onts[2]["control_flag"] == "deactivated"
+    assert onts[3]["description"] == "kantor desa - lt 2"
+
+
+def test_ont_info_block(capture):
+    [ont] = parse_ont_info(capture("ont_info_block"))
+    assert ont["frame"] == 0 and ont["board"] == 1 and ont["port"] == 3 and ont["ont_id"] == 7
+    assert ont["serial_number"] == "HWTC-9F3887B1"
+    assert ont["sn_hex"] == "485754439F3887B1"
+    assert ont["run_state"] == "online"
+    assert ont["distance"] == 1532
+    assert ont["description"] == "cust: budi santoso"
+    assert ont["last_down_cause"] == "dying-gasp"
+    assert ont["last_up_time"] == "2024-03-11 09:31:10+07:00"
+
+
+def test_optical_info_table(capture):
+    readings = parse_optical_info(capture("optical_info_table"), frame=0, board=1, port=3)
+    assert [reading["ont_id"] for reading in readings] == [0, 1, 2, 12]
+    assert readings[0] == {
+        "frame": 0, "board": 1, "port": 3, "ont_id": 0, "rx_power": -20.35, "tx_power": 2.19,
+        "olt_rx_power": -22.52, "temperature": 45, "voltage": 3.28, "current": 13,
+    }
+    # Offline ONT: every reading is missing
+    assert all(readings[1][key] is None for key in huawei_parser.OPTICAL_TABLE_COLUMNS)
+
+
+def test_optical_info_block(capture):
+    [reading] = parse_optical_info(capture("optical_info_block"))
+    assert reading == {
+        "rx_power": -20.35, "tx_power": 2.19, "olt_rx_power": -22.52,
+        "temperature": 45, "voltage": 3.28, "current": 13,
+    }
+
+
+def test_service_ports(capture):
+    ports = parse_service_ports(capture("service_port_table"))
+    assert [port["index"] for port in ports] == [0, 1, 7, 1023]
+    assert ports[2] == {
+        "index": 7, "vlan": 200, "vlan_attr": "common", "port_type": "gpon",
+        "frame": 0, "board": 2, "port": 15, "vpi": 12, "vci": 2,
+        "flow_type": "vlan", "flow_para": "200", "rx": "10", "tx": "11", "state": "up",
+    }
+    assert ports[1]["state"] == "down"
+    assert ports[3]["vlan"] is None and ports[3]["vlan_attr"] == "stacking"
+
+
+def test_single_service_port(capture):
+    assert parse_service_ports(capture("service_port_single")) == parse_service_ports(
+        capture("service_port_table")
+    )[2:3]
+
+
+def test_boards(capture):
+    boards = {board["slot"]: board for board in parse_boards(capture("board"))}
+    assert sorted(boards) == [0, 1, 2, 3, 4, 6, 7, 9]
+    assert "board_name" not in boards[0]
+    assert boards[1] == {"slot": 1, "board_name": "H805GPFD", "status": "Normal", "subtypes": []}
+    assert boards[2]["subtypes"] == ["CPCF"] and boards[2]["online_state"] == "Online"
+    assert boards[4]["status"] == "Failed" and boards[4]["online_state"] == "Offline"
+
+
+def test_merge_ont_info_folds_rows_by_ont():
+    merged = merge_ont_info([
+        {"frame": 0, "board": 1, "port": 3, "ont_id": 5, "run_state": "online"},
+        {"frame": 0, "board": 1, "port": 4, "ont_id": 5, "run_state": "offline"},
+        {"frame": 0, "board": 1, "port": 3, "ont_id": 5, "description": "a"},
+    ])
+    assert merged == [
+        {"frame": 0, "board": 1, "port": 3, "ont_id": 5, "run_state": "online", "description": "a"},
+        {"frame": 0, "board": 1, "port": 4, "ont_id": 5, "run_state": "offline"},
+    ]
+
+
+INCREMENTAL_CASES = [
+    ("autofind", "autofind"),
+    ("ont_info", "ont_info_table"),
+    ("ont_info", "ont_info_block"),
+    ("optical_info", "optical_info_table"),
+    ("optical_info", "optical_info_block"),
+    ("service_port", "service_port_table"),
+    ("board", "board"),
+]
+
+
+def parse_in_chunks(kind, text, size):
+    parser = IncrementalParser(kind)
+    records = []
+    for start in range(0, len(text), size):
+        records.extend(parser.feed(text[start:start + size]))
+    return records + parser.close()
+
+
+@pytest.mark.parametrize("size", CHUNK_SIZES)
+@pytest.mark.parametrize("kind,name", INCREMENTAL_CASES)
+def test_incremental_matches_whole_text(capture, kind, name, size):
+    text = capture(name)
+    whole = [record for _, record in huawei_parser.SCANNERS[kind](text)]
+    assert whole
+    assert parse_in_chunks(kind, text, size) == whole
+
+
+def test_incremental_holds_back_the_unfinished_record():
+    text = (FIXTURES / "autofind.txt").read_text()
+    cut = text.index("   Loid                : budi-01")
+    parser = IncrementalParser("autofind")
+    # Block 2 is cut after its serial: only block 1 is known to be complete
+    assert [ont["number"] for ont in parser.feed(text[:cut])] == [1]
+    assert [ont["number"] for ont in parser.feed(text[cut:])] == [2]
+    assert [ont["number"] for ont in parser.close()] == [3]
+
+
+# ==================== BENCHMARK ====================
+
+def autofind_capture(count):
+    blocks = [
+        "   ----------------------------------------------------------------------------\r\n"
+        f"   Number              : {i + 1}\r\n"
+        f"   F/S/P               : 0/{1 + i % 16}/{i % 16}\r\n"
+        f"   Ont SN              : 48575443{i:08X} (HWTC-{i:08X})\r\n"
+        "   Password            : 0x00000000000000000000\r\n"
+        "   Loid                :\r\n"
+        "   Checkcode           :\r\n"
+        "   VendorID            : HWTC\r\n"
+        "   Ont Version         : 159D.A\r\n"
+        "   Ont SoftwareVersion : V5R019C10S125\r\n"
+        "   Ont EquipmentID     : EG8145V5\r\n"
+        "   Ont autofind time   : 2024-03-11 09:14:02+07:00\r\n"
+        for i in range(count)
+    ]
+    return "".join(blocks) + f"   The number of GPON autofind ONT is {count}\r\n"
+
+
+def ont_info_capture(ports, per_port):
+    rule = "  -----------------------------------------------------------------------------\r\n"
+    sections = []
+    for port in range(ports):
+        sections.append(rule + "  F/S/P   ONT         SN         Control     Run      Config   Match    Protect\r\n" + rule)
+        sections.extend(
+            f"  0/ 1/{port:<2} {ont:>4}  48575443{port * 1000 + ont:08X}  active      online   normal   match    no\r\n"
+            for ont in range(per_port)
+        )
+        sections.append(rule + "  F/S/P   ONT-ID   Description\r\n" + rule)
+        sections.extend(f"  0/ 1/{port:<2} {ont:>4}     cust {port}-{ont} jl. merdeka\r\n" for ont in range(per_port))
+        sections.append(rule + f"  In port 0/ 1/{port}, the total of ONTs are: {per_port}, online: {per_port}\r\n")
+    return "".join(sections)
+
+
+def optical_capture(ports, per_port):
+    rows = [
+        f"  {ont:<6} -{15 + ont % 12}.{ont % 100:02d}    2.{ont % 90:02d}      -{18 + ont % 10}.{ont % 100:02d}"
+        f"      {40 + ont % 10}           3.{200 + ont % 90}    {10 + ont % 7}\r\n"
+        for ont in range(per_port)
+    ]
+    return "".join(rows) * ports
+
+
+def service_port_capture(count):
+    return "".join(
+        f"  {i:>6} {41 + i % 3:>4} common   gpon {i % 2}/{1 + i % 16:<2}/{i % 16:<2} {i % 128:<4} {1 + i % 3:<5} "
+        f"vlan  {41 + i % 3:<10} -    -    up\r\n"
+        for i in range(count)
+    )
+
+
+BENCHMARKS = {
+    "autofind 8k ONTs": ("autofind", lambda: autofind_capture(8000), parse_autofind, 8000),
+    "ont_info 128 ports x 128": ("ont_info", lambda: ont_info_capture(128, 128), parse_ont_info, 128 * 128),
+    "optical_info 128 ports x 128": ("optical_info", lambda: optical_capture(128, 128), parse_optical_info, 128 * 128),
+    "service_port 20k": ("service_port", lambda: service_port_capture(20000), parse_service_ports, 20000),
+}
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("name", list(BENCHMARKS))
+def test_parse_benchmark(name, record_property):
+    kind, build, parse, expected = BENCHMARKS[name]
+    text = build()
+
+    started = time.perf_counter()
+    records = parse(text)
+    whole = time.perf_counter() - started
+
+    started = time.perf_counter()
+    streamed = parse_in_chunks(kind, text, 4096)
+    incremental = time.perf_counter() - started
+
+    record_property("benchmark", f"{len(text) / 1e6:.1f} MB, parse {whole * 1000:.0f} ms, "
+                                 f"incremental (4 KB chunks) {incremental * 1000:.0f} ms")
+    assert len(records) == expected
+    assert len(merge_ont_info(streamed) if kind == "ont_info" else streamed) == expected
+    assert whole < BENCHMARK_LIMIT and incremental < BENCHMARK_LIMIT
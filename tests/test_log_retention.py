@@ -0,0 +1,85 @@
+import asyncio
+import gzip
+import json
+from datetime import datetime, timedelta, timezone
+
+import mongomock_motor
+import pytest
+
+import server
+
+NOW = datetime(2024, 3, 11, 9, 0, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def database(monkeypatch):
+    database = mongomock_motor.AsyncMongoMockClient(tz_aware=True)["log_retention"]
+    monkeypatch.setattr(server, "db", database)
+    return database
+
+
+def log(device_id, command, timestamp):
+    return {"id": command, "device_id": device_id, "command": command, "response": "ok",
+            "status": "success", "timestamp": timestamp}
+
+
+def test_retention_restamps_only_dated_logs(database, monkeypatch):
+    # mongomock cannot evaluate $add on dates: record the filter and check what it selects
+    filters = []
+    collection_class = type(database.command_logs)
+    update_many = collection_class.update_many
+
+    async def recording_update_many(self, selector, update, **kwargs):
+        filters.append(selector)
+        if isinstance(update, dict):
+            return await update_many(self, selector, update, **kwargs)
+
+    monkeypatch.setattr(collection_class, "update_many", recording_update_many)
+
+    async def scenario():
+        await database.command_logs.insert_many([
+            log("olt1", "dated", NOW),
+            log("olt1", "unmigrated", NOW.isoformat()),
+            log("olt2", "other device", NOW),
+        ])
+        await server.apply_log_retention("olt1", 7)
+        selected = await database.command_logs.distinct("command", filters[-1])
+        await database.command_logs.update_many({}, {"$set": {"expires_at": NOW}})
+        await server.apply_log_retention("olt1", 0)
+        kept = await database.command_logs.distinct("command", {"expires_at": {"$exists": True}})
+        return selected, kept
+
+    selected, kept = asyncio.run(scenario())
+    assert selected == ["dated"]
+    assert kept == ["other device"]
+
+
+def test_archive_moves_old_logs_to_a_gzip_file(database, monkeypatch, tmp_path):
+    monkeypatch.setattr(server, "LOG_ARCHIVE_DIR", tmp_path)
+    monkeypatch.setattr(server, "LOG_ARCHIVE_BATCH", 2)  # Several chunks
+
+    async def scenario():
+        await database.command_logs.insert_many(
+            [log("olt1", f"old {i}", NOW - timedelta(days=30, minutes=i)) for i in range(5)]
+            + [log("olt1", "recent", NOW), log("olt2", "other device", NOW - timedelta(days=30))]
+        )
+        result = await server.archive_logs(before=NOW - timedelta(days=1), device_id="olt1")
+        remaining = sorted(await database.command_logs.distinct("command"))
+        listed = await server.list_log_archives(device_id="olt1")
+        return result, remaining, listed
+
+    result, remaining, listed = asyncio.run(scenario())
+    assert result["count"] == 5
+    assert remaining == ["other device", "recent"]
+    assert [archive["id"] for archive in listed] == [result["archive"]["id"]]
+    with gzip.open(tmp_path / result["archive"]["filename"], "rt", encoding="utf-8") as archive:
+        archived = [json.loads(line) for line in archive]
+    assert sorted(entry["command"] for entry in archived) == [f"old {i}" for i in range(5)]
+    assert all(entry["device_id"] == "olt1" for entry in archived)
+
+
+def test_archive_with_nothing_to_move_writes_no_file(database, monkeypatch, tmp_path):
+    monkeypatch.setattr(server, "LOG_ARCHIVE_DIR", tmp_path)
+    result = asyncio.run(server.archive_logs(before=NOW))
+    assert result == {"archive": None, "count": 0}
+    assert not list(tmp_path.iterdir())
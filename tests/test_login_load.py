@@ -0,0 +1,123 @@
+"""
+Event-loop lag under concurrent logins. A probe task sleeps in short steps
+and records how late it wakes up while a burst of logins runs: with bcrypt
+on the event loop (how login worked before the worker pool) every check
+stalls the loop for its whole duration; with login() it stays responsive.
+"""
+import asyncio
+import time
+from types import SimpleNamespace
+
+import bcrypt
+import mongomock_motor
+import pytest
+
+import server
+
+LOGINS = 8
+PROBE_STEP = 0.005
+PASSWORD = "s3cret-pass"
+# Cheaper than production cost 12 to keep the test quick; the ratio is what matters
+BCRYPT_ROUNDS = 10
+
+
+@pytest.fixture
+def users(monkeypatch):
+    database = mongomock_motor.AsyncMongoMockClient(tz_aware=True)["login_load"]
+    monkeypatch.setattr(server, "db", database)
+    password_hash = bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode()
+    return database, password_hash
+
+
+async def add_users(database, password_hash, count):
+    await database.users.insert_many([
+        {"id": f"u{i}", "username": f"user{i}", "full_name": f"User {i}", "role": "user",
+         "permissions": {}, "is_active": True, "created_at": server.datetime.now(server.timezone.utc),
+         "password_hash": password_hash}
+        for i in range(count)
+    ])
+
+
+def request_from(ip):
+    return SimpleNamespace(client=SimpleNamespace(host=ip))
+
+
+async def max_loop_lag(work):
+    """Largest wake-up delay of a PROBE_STEP sleep loop while `work` runs"""
+    lags = []
+    done = asyncio.Event()
+
+    async def probe():
+        while not done.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(PROBE_STEP)
+            lags.append(time.perf_counter() - started - PROBE_STEP)
+
+    probe_task = asyncio.create_task(probe())
+    await asyncio.sleep(PROBE_STEP * 2)
+    try:
+        await work()
+    finally:
+        done.set()
+        await probe_task
+    return max(lags)
+
+
+@pytest.mark.benchmark
+def test_login_keeps_event_loop_responsive(users, record_property):
+    database, password_hash = users
+
+    async def scenario():
+        await add_users(database, password_hash, LOGINS)
+
+        async def inline_bcrypt():
+            # Before: verify_password called directly from the handler
+            for _ in range(LOGINS):
+                server.verify_password(PASSWORD, password_hash)
+                await asyncio.sleep(0)
+
+        async def logins():
+            await asyncio.gather(*[
+                server.login(server.UserLogin(username=f"user{i}", password=PASSWORD), request_from(f"10.0.0.{i}"))
+                for i in range(LOGINS)
+            ])
+
+        return await max_loop_lag(inline_bcrypt), await max_loop_lag(logins)
+
+    before, after = asyncio.run(scenario())
+    record_property("benchmark", f"max event-loop lag with {LOGINS} logins: "
+                                 f"bcrypt on the loop {before * 1000:.1f} ms, login() {after * 1000:.1f} ms")
+    assert after < before / 2
+
+
+def test_shared_account_logins_queue_instead_of_failing(users):
+    database, password_hash = users
+
+    async def scenario():
+        await add_users(database, password_hash, 1)
+        attempts = server.LOGIN_MAX_PER_USERNAME + 1
+        return await asyncio.gather(*[
+            server.login(server.UserLogin(username="user0", password=PASSWORD), request_from("10.0.0.1"))
+            for _ in range(attempts)
+        ], return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert not [result for result in results if isinstance(result, Exception)]
+
+
+def test_login_limiter_turns_away_after_the_wait():
+    limiter = server.LoginLimiter(1, wait=0.05)
+
+    async def scenario():
+        assert await limiter.acquire("key")
+        rejected = not await limiter.acquire("key")
+        waiter = asyncio.create_task(limiter.acquire("key"))
+        await asyncio.sleep(0)
+        limiter.release("key")
+        handed_over = await waiter
+        limiter.release("key")
+        return rejected, handed_over, limiter._active, limiter._waiters
+
+    rejected, handed_over, active, waiters = asyncio.run(scenario())
+    assert rejected and handed_over
+    assert not active and not waiters
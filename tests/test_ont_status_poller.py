@@ -0,0 +1,28 @@
+import asyncio
+
+import server
+
+
+def test_cancelled_waiter_does_not_cancel_shared_poll():
+    async def scenario():
+        poller = server.OntStatusPoller(server.TelnetConnection())
+        calls = []
+
+        async def poll(device_id):
+            calls.append(device_id)
+            await asyncio.sleep(0.1)
+            return {"device_id": device_id, "onts": 3}
+
+        poller._poll = poll
+        patient = asyncio.create_task(poller.poll("olt1"))
+        try:
+            await asyncio.wait_for(poller.poll("olt1"), 0.01)
+        except asyncio.TimeoutError:
+            pass
+        during = poller.polling()
+        return await patient, calls, during, poller.polling()
+
+    result, calls, during, after = asyncio.run(scenario())
+    assert result == {"device_id": "olt1", "onts": 3}
+    assert calls == ["olt1"]
+    assert during == ["olt1"] and after == []
@@ -0,0 +1,69 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import mongomock_motor
+import pytest
+
+import server
+
+START = datetime(2024, 3, 11, 9, 0, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def database(monkeypatch):
+    database = mongomock_motor.AsyncMongoMockClient(tz_aware=True)["optical_history"]
+    monkeypatch.setattr(server, "db", database)
+    return database
+
+
+def record_minutes(history, rx_powers):
+    """One poll per minute from START; None is an offline ONT"""
+    async def record():
+        for minute, rx_power in enumerate(rx_powers):
+            await history.record("olt1", [("ont-a", {"rx_power": rx_power, "tx_power": 2.0 if rx_power else None})],
+                                 START + timedelta(minutes=minute))
+    return record()
+
+
+def test_rollups_keep_min_avg_max_per_bucket(database):
+    history = server.OpticalHistory()
+
+    async def scenario():
+        # 09:00-09:04 in the first 5-minute bucket, 09:05-09:06 in the second
+        await record_minutes(history, [-20.0, -21.0, -22.0, None, -19.0, -25.0, -24.0])
+        five_minutes = await history.query("ont-a", START, START + timedelta(hours=1), "5m")
+        hourly = await history.query("ont-a", START, START + timedelta(hours=1), "1h")
+        return five_minutes, hourly
+
+    five_minutes, hourly = asyncio.run(scenario())
+    assert [point["t"] for point in five_minutes] == [START, START + timedelta(minutes=5)]
+    assert five_minutes[0]["rx_power"] == {"min": -22.0, "avg": -20.5, "max": -19.0}
+    assert five_minutes[1]["rx_power"] == {"min": -25.0, "avg": -24.5, "max": -24.0}
+    assert five_minutes[0]["tx_power"] == {"min": 2.0, "avg": 2.0, "max": 2.0}
+    [hour] = hourly
+    assert hour["rx_power"] == {"min": -25.0, "avg": -21.833, "max": -19.0}
+
+
+def test_raw_query_returns_samples_inside_the_window(database):
+    history = server.OpticalHistory()
+
+    async def scenario():
+        await record_minutes(history, [-20.0, -21.0, None, -23.0])
+        return await history.query("ont-a", START + timedelta(minutes=1), START + timedelta(minutes=4), "raw")
+
+    samples = asyncio.run(scenario())
+    # The offline poll stored nothing
+    assert [(sample["t"], sample["rx_power"]) for sample in samples] == [
+        (START + timedelta(minutes=1), -21.0), (START + timedelta(minutes=3), -23.0),
+    ]
+
+
+def test_resolution_follows_the_range_and_retention():
+    now = datetime.now(timezone.utc)
+    pick = server.OpticalHistory.pick_resolution
+    assert pick(now - timedelta(hours=6), now) == "raw"
+    assert pick(now - timedelta(days=3), now) == "5m"
+    assert pick(now - timedelta(days=60), now) == "1h"
+    # A short range that raw samples no longer reach
+    old = now - timedelta(days=server.OPTICAL_RAW_RETENTION_DAYS + 1)
+    assert pick(old, old + timedelta(hours=1)) == "5m"
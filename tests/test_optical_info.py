@@ -0,0 +1,52 @@
+import asyncio
+
+import server
+
+
+def slow_collect(service, calls, duration=0.1):
+    async def collect(device_id, frame, board, port, board_type, priority):
+        calls.append((device_id, frame, board, port, priority))
+        await asyncio.sleep(duration)
+        return {0: {"ont_id": 0, "rx_power": -20.0}}
+    service._collect = collect
+
+
+def test_cancelled_waiter_does_not_cancel_shared_query():
+    async def scenario():
+        service = server.OpticalInfoService()
+        calls = []
+        slow_collect(service, calls)
+        patient = asyncio.create_task(service.get_port("olt1", 0, 1, 3))
+        impatient = asyncio.create_task(asyncio.wait_for(service.get_port("olt1", 0, 1, 3), 0.01))
+        try:
+            await impatient
+        except asyncio.TimeoutError:
+            pass
+        return await patient, calls
+
+    readings, calls = asyncio.run(scenario())
+    assert readings[0]["rx_power"] == -20.0
+    assert len(calls) == 1
+
+
+def test_registration_refresh_waits_for_ranging(monkeypatch):
+    monkeypatch.setattr(server, "OPTICAL_RANGING_DELAY", 0.2)
+    monkeypatch.setattr(server.telnet_manager, "is_connected", lambda device_id: True)
+
+    async def scenario():
+        service = server.OpticalInfoService()
+        monkeypatch.setattr(server, "optical_info_service", service)
+        calls = []
+        slow_collect(service, calls, duration=0)
+        # Three ONTs registered on one port in quick succession
+        for ont_id in range(3):
+            info = server.registration_optical_info("olt1", 0, 1, 3, ont_id)
+            assert info["rx_power"] is None
+            await asyncio.sleep(0.05)
+        before_ranging = len(calls)
+        await asyncio.sleep(0.3)
+        return before_ranging, calls
+
+    before_ranging, calls = asyncio.run(scenario())
+    assert before_ranging == 0
+    assert calls == [("olt1", 0, 1, 3, server.PRIORITY_BULK)]
@@ -0,0 +1,136 @@
+"""
+Query-plan regression tests: every hot query must be served by an index.
+Needs a real MongoDB (mongomock has no planner); set MONGO_URL to run.
+The indexes come from server.DATABASE_INDEXES and the queries from the
+same builders the endpoints use, in a throwaway database.
+"""
+import json
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, MongoClient
+
+import server
+from tests.conftest import LIVE_MONGO_URL
+
+pytestmark = pytest.mark.skipif(not LIVE_MONGO_URL, reason="needs a MongoDB server (set MONGO_URL)")
+
+NOW = datetime(2024, 1, 1, tzinfo=timezone.utc)
+DAY = timedelta(days=1)
+
+
+@pytest.fixture(scope="module")
+def db():
+    client = MongoClient(LIVE_MONGO_URL, serverSelectionTimeoutMS=5000, tz_aware=True)
+    database = client[f"registrasi_ont_plans_{uuid.uuid4().hex[:8]}"]
+    for collection, indexes in server.DATABASE_INDEXES.items():
+        database[collection].create_indexes(indexes)
+
+    # A little data so the planner has real choices to make
+    database.users.insert_many([{"id": f"u{i}", "username": f"user{i}"} for i in range(20)])
+    database.olt_devices.insert_many([{"id": f"olt{i}", "name": f"OLT {i}"} for i in range(5)])
+    database.olt_configurations.insert_many([{"id": f"c{i}", "device_id": f"olt{i}"} for i in range(5)])
+    database.ont_devices.insert_many([
+        {"id": f"ont{i}", "olt_device_id": f"olt{i % 5}", "frame": 0, "board": i % 4, "port": i % 8,
+         "ont_id": i % 128, "serial_number": f"HWTC{i:08X}", "status": "registered",
+         "created_at": NOW - i * timedelta(minutes=10)}
+        for i in range(500)
+    ])
+    database.command_logs.insert_many([
+        {"device_id": f"olt{i % 5}", "command": f"display ont info {i % 8} all", "response": "ok",
+         "status": "success" if i % 7 else "error", "timestamp": NOW - i * timedelta(minutes=1)}
+        for i in range(500)
+    ])
+    yield database
+    client.drop_database(database.name)
+
+
+def winning_plan(cursor):
+    return cursor.explain()["queryPlanner"]["winningPlan"]
+
+
+def assert_indexed(cursor):
+    plan = winning_plan(cursor)
+    assert "COLLSCAN" not in json.dumps(plan, default=str), json.dumps(plan, indent=2, default=str)
+
+
+def ont_query(**filters):
+    arguments = dict(device_id=None, frame=None, board=None, port=None, status=None, serial_prefix=None,
+                     vlan=None, registered_by=None, cursor=None)
+    arguments.update(filters)
+    return server.build_ont_query(**arguments)
+
+
+def log_query(**filters):
+    arguments = dict(device_id=None, since=None, until=None, command_prefix=None, status=None, q=None)
+    arguments.update(filters)
+    return server.build_log_query(**arguments)
+
+
+HOT_QUERIES = {
+    # Auth: every request resolves its user
+    "users by username": lambda db: db.users.find({"username": "user3"}),
+    "users by id": lambda db: db.users.find({"id": "u3"}),
+    "olt device by id": lambda db: db.olt_devices.find({"id": "olt1"}),
+    "configuration by device": lambda db: db.olt_configurations.find({"device_id": "olt1"}),
+    # ONT inventory
+    "ont by id": lambda db: db.ont_devices.find({"id": "ont7"}),
+    "ont by olt and serial": lambda db: db.ont_devices.find(
+        {"olt_device_id": "olt1", "serial_number": "HWTC00000006"}
+    ),
+    "onts by olt serial set": lambda db: db.ont_devices.find(
+        {"olt_device_id": "olt1", "serial_number": {"$in": ["HWTC00000001", "HWTC00000006"]}}
+    ),
+    "onts by port": lambda db: db.ont_devices.find(
+        {"olt_device_id": "olt1", "frame": 0, "board": 1, "port": 1}
+    ),
+    "ont by port and id": lambda db: db.ont_devices.find(
+        {"olt_device_id": "olt1", "frame": 0, "board": 1, "port": 1, "ont_id": 1}
+    ),
+    "onts by serial": lambda db: db.ont_devices.find({"serial_number": "HWTC00000006"}),
+    "onts by serial prefix": lambda db: db.ont_devices.find(ont_query(serial_prefix="HWTC0000")),
+    "ont page per olt": lambda db: db.ont_devices.find(
+        ont_query(device_id="olt1", cursor=str(ObjectId.from_datetime(NOW - DAY)))
+    ).sort("_id", ASCENDING).limit(100),
+    "ont page": lambda db: db.ont_devices.find(
+        ont_query(cursor=str(ObjectId.from_datetime(NOW - DAY)))
+    ).sort("_id", ASCENDING).limit(100),
+    "onts created in range": lambda db: db.ont_devices.find(
+        ont_query(created_since=NOW - DAY, created_until=NOW)
+    ),
+    # Command logs
+    "logs by device newest first": lambda db: db.command_logs.find({"device_id": "olt1"}).sort(
+        "timestamp", DESCENDING
+    ).limit(100),
+    "logs by device in range": lambda db: db.command_logs.find(
+        log_query(device_id="olt1", since=NOW - DAY, until=NOW)
+    ).sort("timestamp", DESCENDING).limit(100),
+    "logs in range": lambda db: db.command_logs.find(
+        log_query(since=NOW - DAY, until=NOW)
+    ).sort("timestamp", DESCENDING).limit(100),
+    "logs by status": lambda db: db.command_logs.find(log_query(status="error")).sort(
+        "timestamp", DESCENDING
+    ).limit(100),
+    "logs by command prefix": lambda db: db.command_logs.find(log_query(command_prefix="display ont")).sort(
+        "timestamp", DESCENDING
+    ).limit(100),
+    "logs full text": lambda db: db.command_logs.find(log_query(q="display")).limit(100),
+    # Optical history, allocators, backups
+    "optical samples by ont": lambda db: db.optical_samples.find(
+        {"ont": "ont1", "start": {"$gte": NOW - DAY, "$lt": NOW}}
+    ).sort("start", ASCENDING),
+    "optical rollups by ont": lambda db: db.optical_rollups.find(
+        {"ont": "ont1", "resolution": "5m", "start": {"$gte": NOW - DAY, "$lt": NOW}}
+    ).sort("start", ASCENDING),
+    "id allocations by olt": lambda db: db.ont_id_allocations.find({"olt_device_id": "olt1"}),
+    "config backups by olt": lambda db: db.olt_config_backups.find({"device_id": "olt1"}).sort(
+        "taken_at", DESCENDING
+    ),
+}
+
+
+@pytest.mark.parametrize("name", sorted(HOT_QUERIES))
+def test_hot_query_uses_an_index(db, name):
+    assert_indexed(HOT_QUERIES[name](db))
@@ -0,0 +1,234 @@
+import asyncio
+from pathlib import Path
+
+import mongomock_motor
+import pytest
+from fastapi import HTTPException
+
+import server
+
+AUTOFIND = (Path(__file__).resolve().parent / "fixtures" / "huawei" / "autofind.txt").read_text()
+SERIAL = "HWTC-9F3887B1"
+
+
+class FakeTelnet:
+    """
+    Stands in for telnet_manager: the OLT refuses the registration command that
+    matches `fail_on`; "busy" stands for a full queue, where nothing is sent.
+    """
+
+    def __init__(self, fail_on):
+        self.fail_on = fail_on
+        self.batches = []
+
+    def is_connected(self, device_id):
+        return True
+
+    async def send_command(self, device_id, command, *args, **kwargs):
+        if command == "display ont autofind all":
+            return True, "success", AUTOFIND
+        return False, "error", ""  # Board and service-port lookups: fall back to inventory
+
+    async def send_batch(self, device_id, commands, priority=server.PRIORITY_NORMAL, stop_on_error=True, cleanup=None,
+                         pipeline_after=None):
+        self.batches.append((commands, cleanup))
+        if self.fail_on == "busy":
+            return False, "busy", [{"command": command, "response": "Command queue full", "status": "skipped"}
+                                   for command in commands]
+        results = []
+        for command in commands:
+            if command.startswith(self.fail_on):
+                results.append({"command": command, "response": "Failure: SN already exists", "status": "error"})
+                break
+            results.append({"command": command, "response": "", "status": "success"})
+        results += [{"command": command, "response": "", "status": "skipped"} for command in commands[len(results):]]
+        success = all(result["status"] == "success" for result in results)
+        return success, "success" if success else "error", results
+
+
+@pytest.fixture
+def olt(monkeypatch):
+    database = mongomock_motor.AsyncMongoMockClient(tz_aware=True)["register_rollback"]
+    monkeypatch.setattr(server, "db", database)
+    monkeypatch.setattr(server.command_log_writer, "write", lambda device_id, results: asyncio.sleep(0))
+
+    def connect(device_id, fail_on):
+        telnet = FakeTelnet(fail_on)
+        monkeypatch.setattr(server, "telnet_manager", telnet)
+        monkeypatch.setattr(server.autofind_watcher, "telnet", telnet)
+        return telnet
+
+    async def add_device(device_id):
+        await database.olt_devices.insert_one({"id": device_id, "name": device_id})
+        await database.olt_configurations.insert_one({"device_id": device_id, "gemport": "1,2"})
+
+    return database, connect, add_device
+
+
+def register(device_id):
+    item = server.BulkRegisterItem(olt_device_id=device_id, serial_number=SERIAL, frame=0, board=1, port=0,
+                                   board_type="gpon")
+    return server.register_onts([item], "tester", "job")
+
+
+def test_rejected_ont_add_is_rolled_back(olt):
+    database, connect, add_device = olt
+    telnet = connect("olt-rejected", "ont add")
+
+    async def scenario():
+        await add_device("olt-rejected")
+        summary = await register("olt-rejected")
+        inventory = await database.ont_devices.count_documents({"olt_device_id": "olt-rejected"})
+        next_id = (await server.ont_id_allocator.peek("olt-rejected", 0, 1, 0))["next_ont_id"]
+        next_service_port = await server.service_port_allocator.allocate("olt-rejected", 2)
+        return summary, inventory, next_id, next_service_port
+
+    summary, inventory, next_id, next_service_port = asyncio.run(scenario())
+    [result] = summary["results"]
+    assert result["status"] == "failed" and result["rolled_back"] and not result["needs_reconcile"]
+    assert inventory == 0
+    # The ONT ID and service-port range are free again
+    assert next_id == result["ont_id"]
+    assert next_service_port == result["service_port_index"]
+    # The OLT-side undo, run by send_batch if a later command fails: service ports first, then the ONT
+    [(commands, cleanup)] = telnet.batches
+    assert cleanup == [
+        f"undo service-port {result['service_port_index']}",
+        f"undo service-port {result['service_port_index'] + 1}",
+        "interface gpon 0/1", f"ont delete 0 {result['ont_id']}", "quit",
+    ]
+
+
+@pytest.mark.parametrize("fail_on", ["service-port", "busy"])
+def test_unconfirmed_registration_keeps_its_reservation(olt, fail_on):
+    database, connect, add_device = olt
+    device_id = f"olt-{fail_on}"
+    connect(device_id, fail_on)
+
+    async def scenario():
+        await add_device(device_id)
+        summary = await register(device_id)
+        stored = await database.ont_devices.find_one({"olt_device_id": device_id}, {"_id": 0})
+        next_id = (await server.ont_id_allocator.peek(device_id, 0, 1, 0))["next_ont_id"]
+        return summary, stored, next_id
+
+    summary, stored, next_id = asyncio.run(scenario())
+    [result] = summary["results"]
+    assert result["status"] == "failed" and result["needs_reconcile"] and not result["rolled_back"]
+    assert result["message"].endswith("kept for reconciliation")
+    assert stored["needs_reconcile"] and stored["ont_id"] == result["ont_id"]
+    assert next_id != result["ont_id"]
+
+
+def create(device_id):
+    user = server.User(username="tester", password_hash="", full_name="Tester", role="admin")
+    item = server.ONTDeviceCreate(olt_device_id=device_id, ont_id=-1, serial_number=SERIAL, frame=0, board=1, port=0,
+                                  gemport="1,2", board_type="gpon")
+    return server.create_ont(item, user)
+
+
+def auto_register(device_id):
+    user = server.User(username="tester", password_hash="", full_name="Tester", role="admin")
+    ont = {"serial_number": SERIAL, "frame": 0, "board": 1, "port": 0, "board_type": "gpon"}
+    return server.auto_register_detected_ont(device_id, ont, user)
+
+
+def test_single_registration_paths_roll_back_like_bulk(olt, monkeypatch):
+    database, connect, add_device = olt
+    monkeypatch.setattr(server, "registration_optical_info", lambda *args: {})
+    connect("olt-single", "ont add")
+
+    async def scenario():
+        await add_device("olt-single")
+        with pytest.raises(HTTPException) as error:
+            await create("olt-single")
+        auto = await auto_register("olt-single")
+        inventory = await database.ont_devices.count_documents({"olt_device_id": "olt-single"})
+        next_id = (await server.ont_id_allocator.peek("olt-single", 0, 1, 0))["next_ont_id"]
+        return error.value, auto, inventory, next_id
+
+    error, auto, inventory, next_id = asyncio.run(scenario())
+    assert error.status_code == 502 and error.detail.endswith("registration rolled back")
+    assert not auto["success"] and auto["message"].endswith("registration rolled back")
+    assert inventory == 0
+    assert next_id == 0
+
+
+def test_single_registration_paths_flag_unconfirmed_outcomes(olt, monkeypatch):
+    database, connect, add_device = olt
+    monkeypatch.setattr(server, "registration_optical_info", lambda *args: {})
+    connect("olt-single-busy", "busy")
+
+    async def scenario():
+        await add_device("olt-single-busy")
+        created = await create("olt-single-busy")
+        await database.ont_devices.delete_many({})  # Let the same serial through again
+        auto = await auto_register("olt-single-busy")
+        return created, auto
+
+    created, auto = asyncio.run(scenario())
+    assert created["needs_reconcile"]
+    assert not auto["success"] and auto["ont"]["needs_reconcile"]
+
+
+def watch(device_id, watcher):
+    watcher._known[device_id] = set()
+    watcher._seen[device_id] = set()
+    watcher.state[device_id] = {"started_by": "tester", "detected": 0, "registered": 0}
+
+
+def test_watcher_retries_a_rolled_back_registration(olt, monkeypatch):
+    monkeypatch.setattr(server, "AUTOFIND_RETRY_DELAY", 0)
+    database, connect, add_device = olt
+    device_id = "olt-watched"
+    telnet = connect(device_id, "ont add")
+    watcher = server.autofind_watcher
+
+    async def scenario():
+        await add_device(device_id)
+        watch(device_id, watcher)
+        try:
+            await watcher._scan(device_id)
+            first_attempts = len(telnet.batches)
+            known_after_failure = set(watcher._known[device_id])
+            telnet.fail_on = "nothing fails"
+            await watcher._scan(device_id)
+            inventory = await database.ont_devices.distinct("serial_number", {"olt_device_id": device_id})
+        finally:
+            watcher.forget_device(device_id)
+        return first_attempts, known_after_failure, len(telnet.batches), inventory
+
+    first_attempts, known_after_failure, attempts, inventory = asyncio.run(scenario())
+    assert first_attempts == 3  # One per ONT in the capture
+    assert SERIAL not in known_after_failure
+    assert attempts == 6
+    assert SERIAL in inventory
+
+
+def test_watcher_backs_off_and_gives_up_on_a_permanent_rejection(olt, monkeypatch):
+    monkeypatch.setattr(server, "AUTOFIND_RETRY_MAX", 2)
+    monkeypatch.setattr(server, "AUTOFIND_RETRY_DELAY", 0.2)
+    database, connect, add_device = olt
+    device_id = "olt-rejecting"
+    telnet = connect(device_id, "ont add")
+    watcher = server.autofind_watcher
+
+    async def scenario():
+        await add_device(device_id)
+        watch(device_id, watcher)
+        attempts = []
+        try:
+            await watcher._scan(device_id)
+            attempts.append(len(telnet.batches))
+            await watcher._scan(device_id)  # Still inside the retry delay
+            attempts.append(len(telnet.batches))
+            for _ in range(3):
+                await asyncio.sleep(0.25)
+                await watcher._scan(device_id)
+                attempts.append(len(telnet.batches))
+        finally:
+            watcher.forget_device(device_id)
+        return attempts
+
+    # Three ONTs in the capture, each tried twice in total
+    assert asyncio.run(scenario()) == [3, 3, 6, 6, 6]
@@ -0,0 +1,60 @@
+import asyncio
+
+import mongomock_motor
+import pytest
+
+import server
+from tests.fake_olt import FakeOLT
+
+ONT_ADD = 'ont add 0/1/3 5 sn-auth "HWTC-9F3887B1" omci ont-lineprofile-id 1 ont-srvprofile-id 1'
+SERVICE_PORTS = [
+    f"service-port {index} vlan 41 gpon 0/1/3 ont 5 gemport {gemport} multi-service user-vlan 41 tag-transform translate"
+    for index, gemport in ((10, 1), (11, 2), (12, 3))
+]
+ROLLBACK = ["undo service-port 10", "undo service-port 11", "undo service-port 12",
+            "interface gpon 0/1", "ont delete 3 5", "quit"]
+
+
+@pytest.fixture(autouse=True)
+def database(monkeypatch):
+    monkeypatch.setattr(server, "db", mongomock_motor.AsyncMongoMockClient(tz_aware=True)["send_batch"])
+
+
+def run_registration(outputs):
+    async def scenario():
+        olt = await FakeOLT(outputs=outputs).start()
+        telnet = server.TelnetConnection()
+        try:
+            await telnet.connect("olt1", "127.0.0.1", olt.port, "root", "admin", pool_size=1)
+            setup = len(olt.commands)
+            success, status, results = await telnet.send_batch(
+                "olt1", [ONT_ADD] + SERVICE_PORTS, priority=server.PRIORITY_BULK,
+                cleanup=ROLLBACK, pipeline_after=1
+            )
+        finally:
+            await telnet.disconnect("olt1")
+            await olt.stop()
+        return success, [result["status"] for result in results], olt.commands[setup:]
+
+    return asyncio.run(scenario())
+
+
+def test_registration_sends_all_service_ports():
+    success, statuses, sent = run_registration({})
+    assert success
+    assert statuses == ["success"] * 4
+    assert sent == [ONT_ADD] + SERVICE_PORTS
+
+
+def test_rejected_ont_add_sends_nothing_else():
+    success, statuses, sent = run_registration({ONT_ADD: "  Failure: SN already exists"})
+    assert not success
+    assert statuses == ["error", "skipped", "skipped", "skipped"]
+    assert sent == [ONT_ADD]
+
+
+def test_failed_service_port_runs_cleanup():
+    success, statuses, sent = run_registration({SERVICE_PORTS[2]: "  Failure: Service virtual port has existed already"})
+    assert not success
+    assert statuses == ["success", "success", "success", "error"]
+    assert sent == [ONT_ADD] + SERVICE_PORTS + ROLLBACK
@@ -0,0 +1,112 @@
+import asyncio
+import socket
+import statistics
+import time
+
+import pytest
+
+import server
+from tests.fake_olt import FakeOLT
+
+CONNECT_BENCHMARK_ROUNDS = 20
+
+
+async def open_session(olt, username="root", password="admin"):
+    reader, writer = await server.TelnetConnection()._open_session("127.0.0.1", olt.port, username, password)
+    writer.close()
+
+
+async def login_error(port, username="root", password="admin"):
+    with pytest.raises(server.LoginError) as error:
+        await server.TelnetConnection()._open_session("127.0.0.1", port, username, password)
+    return error.value
+
+
+def test_login_reaches_config_mode():
+    async def scenario():
+        olt = await FakeOLT().start()
+        try:
+            reader, writer = await server.TelnetConnection()._open_session("127.0.0.1", olt.port, "root", "admin")
+            writer.write("display version\n")
+            output = await server.TelnetConnection()._read_until_prompt(reader, writer)
+            writer.close()
+        finally:
+            await olt.stop()
+        assert output.rstrip().endswith("MA5683T(config)#")
+
+    asyncio.run(scenario())
+
+
+def test_slow_banner_still_logs_in():
+    async def scenario():
+        olt = await FakeOLT(banner_delay=1.5).start()
+        try:
+            await open_session(olt)
+        finally:
+            await olt.stop()
+
+    asyncio.run(scenario())
+
+
+def test_wrong_password_is_auth_failed():
+    async def scenario():
+        olt = await FakeOLT().start()
+        try:
+            error = await login_error(olt.port, password="wrong")
+        finally:
+            await olt.stop()
+        assert error.reason == server.LOGIN_AUTH_FAILED
+
+    asyncio.run(scenario())
+
+
+def test_missing_prompt_is_prompt_timeout(monkeypatch):
+    monkeypatch.setattr(server, "LOGIN_TIMEOUT", 0.3)
+
+    async def scenario():
+        olt = await FakeOLT(silent=True).start()
+        try:
+            error = await login_error(olt.port)
+        finally:
+            await olt.stop()
+        assert error.reason == server.LOGIN_PROMPT_TIMEOUT
+
+    asyncio.run(scenario())
+
+
+def test_closed_port_is_unreachable():
+    # Bind and release a port so nothing is listening on it
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+
+    error = asyncio.run(login_error(port))
+    assert error.reason == server.LOGIN_UNREACHABLE
+
+
+@pytest.mark.benchmark
+def test_connect_latency_benchmark(record_property):
+    """
+    Login latency against the local fake OLT. The previous fixed-sleep login
+    took at least 4.5s per connect; the prompt-driven one is bounded by the
+    round-trips, so it should stay well under a second here.
+    """
+    async def scenario():
+        olt = await FakeOLT().start()
+        latencies = []
+        try:
+            for _ in range(CONNECT_BENCHMARK_ROUNDS):
+                started = time.perf_counter()
+                await open_session(olt)
+                latencies.append(time.perf_counter() - started)
+        finally:
+            await olt.stop()
+        return latencies
+
+    latencies = sorted(asyncio.run(scenario()))
+    median = statistics.median(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    record_property("benchmark", f"connect latency over {len(latencies)} logins: "
+                                 f"median {median * 1000:.1f} ms, p95 {p95 * 1000:.1f} ms, "
+                                 f"max {latencies[-1] * 1000:.1f} ms")
+    assert median < 1.0
@@ -0,0 +1,57 @@
+import asyncio
+
+import mongomock_motor
+import pytest
+
+import server
+from tests.fake_olt import FakeOLT
+
+OPTICAL_QUERY = ["interface gpon 0/1", "display ont optical-info 3 all", "quit"]
+
+
+@pytest.fixture(autouse=True)
+def database(monkeypatch):
+    monkeypatch.setattr(server, "db", mongomock_motor.AsyncMongoMockClient(tz_aware=True)["terminal_session"])
+
+
+def run(vty_limit, scenario):
+    async def main():
+        olt = await FakeOLT().start()
+        telnet = server.TelnetConnection()
+        try:
+            await telnet.connect("olt1", "127.0.0.1", olt.port, "root", "admin", pool_size=2, vty_limit=vty_limit)
+            await scenario(telnet)
+            stats = telnet.schedulers["olt1"].stats()
+        finally:
+            await telnet.disconnect("olt1")
+            await olt.stop()
+        return olt.session_commands, stats
+
+    return asyncio.run(main())
+
+
+def typed(session_commands, command):
+    return [session for session, commands in session_commands.items() if command in commands]
+
+
+async def terminal_then_background(telnet):
+    await telnet.send_command("olt1", "interface gpon 0/1", priority=server.PRIORITY_INTERACTIVE)
+    await telnet.send_batch("olt1", OPTICAL_QUERY, priority=server.PRIORITY_BULK, cleanup=["quit"], read_only=True)
+    await telnet.send_batch("olt1", ["ont add 0/1/3 5 sn-auth HWTC-9F3887B1 omci"], priority=server.PRIORITY_BULK)
+    await telnet.send_command("olt1", "display ont info 3 all", priority=server.PRIORITY_INTERACTIVE)
+
+
+def test_background_jobs_never_touch_the_terminal_session():
+    session_commands, stats = run(5, terminal_then_background)
+    [terminal] = typed(session_commands, "display ont info 3 all")
+    # The terminal is still where the operator left it: nothing ran in between
+    assert session_commands[terminal][-2:] == ["interface gpon 0/1", "display ont info 3 all"]
+    assert terminal not in typed(session_commands, "display ont optical-info 3 all")
+    assert terminal not in typed(session_commands, "ont add 0/1/3 5 sn-auth HWTC-9F3887B1 omci")
+    assert [session["terminal"] for session in stats["pool"]["sessions"]].count(True) == 1
+
+
+def test_single_vty_shares_the_pinned_session():
+    session_commands, stats = run(1, terminal_then_background)
+    assert list(session_commands) == [1]
+    assert stats["pool"]["max_size"] == 1